@@ -0,0 +1,154 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+BATCH_SIZE = 512
+
+_STOP = object()
+# The lock-free C queue where the interpreter has one (3.7+)
+_Queue = getattr(queue, 'SimpleQueue', queue.Queue)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line JSON object that fluentd can parse as
+    is: time, severity, logger, thread and message, plus the fields of the
+    record's audit event when it was logged with extra={'audit': {...}}.
+    """
+
+    def __init__(self):
+        super(JsonFormatter, self).__init__()
+        self._encoder = json.JSONEncoder(default=str)
+        self._second = (None, None)
+
+    def _timestamp(self, created, msecs):
+        # Records come in order, so the date and time is formatted once a second
+        second, text = self._second
+        if second != int(created):
+            second = int(created)
+            text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+            self._second = (second, text)
+        return '%s.%03dZ' % (text, msecs)
+
+    def format(self, record):
+        entry = {'time': self._timestamp(record.created, record.msecs), 'severity': record.levelname,
+                 'logger': record.name, 'thread': record.threadName, 'message': record.getMessage()}
+        audit = getattr(record, 'audit', None)
+        if audit:
+            entry.update(audit)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return self._encoder.encode(entry)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    ''' Hands copies of records to the writer thread with only their message
+        merged, so the calling thread never formats JSON or waits on the file,
+        and other handlers still see the record as it was logged. '''
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogWriter(object):
+    """
+    Writes records taken from a queue to a file on its own thread. Whatever
+    has queued up while the last write was in progress, up to batch_size
+    records, goes out in a single write and flush. The file is reopened when
+    logrotate has moved it away.
+    """
+
+    def __init__(self, path, formatter=None, batch_size=BATCH_SIZE):
+        self.queue = _Queue()
+        self._path = path
+        self._formatter = formatter or JsonFormatter()
+        self._batch_size = batch_size
+        self._stream = None
+        self._inode = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' Writes out everything queued so far, then stops the writer. '''
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is not _STOP:
+                    try:
+                        lines.append(self._formatter.format(record))
+                    except Exception as e:
+                        sys.stderr.write('Could not format log record {!r}: {}\n'.format(record.msg, e))
+            if lines:
+                self._write(lines)
+            if any(record is _STOP for record in batch):
+                return
+
+    def _write(self, lines):
+        try:
+            try:
+                inode = os.stat(self._path).st_ino
+            except OSError:
+                inode = None
+            if self._stream is None or inode != self._inode:
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = open(self._path, 'a')
+                self._inode = os.fstat(self._stream.fileno()).st_ino
+            self._stream.write('\n'.join(lines) + '\n')
+            self._stream.flush()
+        except (IOError, OSError) as e:
+            sys.stderr.write('Could not write {} log record(s) to {}: {}\n'.format(len(lines), self._path, e))
+            self._stream = None
+
+
+def configure(name, path, debug=False):
+    """
+    Sends the records of a logger and its children through a queue to a
+    LogWriter writing JSON lines to path, flushed when the process exits. With
+    debug, records are also printed to stdout as they are logged
+    :return: The LogWriter
+    """
+    writer = LogWriter(path)
+    writer.start()
+    atexit.register(writer.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.addHandler(_QueueHandler(writer.queue))
+    if debug:
+        debug_stream = logging.StreamHandler(sys.stdout)
+        debug_stream.setFormatter(logging.Formatter('%(asctime)s [%(threadName)s] [%(name)s] %(levelname)s: '
+                                                    '%(message)s'))
+        logger.addHandler(debug_stream)
+    return writer
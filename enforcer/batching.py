@@ -0,0 +1,236 @@
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from metrics import error_status, record_call, record_retry, request_method
+from ratelimit import MAX_RETRIES, default_limiter, is_rate_limited, request_project, retry_delay
+
+_log = logging.getLogger('ip-enforcer.batching')
+
+# Google APIs accept at most 1000 calls in a single batch request.
+MAX_BATCH_SIZE = 1000
+BATCH_WINDOW = 0.05
+
+
+def _send(service, requests, indexes, results, limiter):
+    ''' Sends the requests at indexes as one batch once the limiter allows
+        every call in it, storing each outcome in results. '''
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    limiter.acquire_all(Counter(request_project(requests[index]) for index in indexes))
+    for index in indexes:
+        results[index] = None
+    started = time.time()
+    try:
+        if len(indexes) == 1:
+            results[indexes[0]] = (requests[indexes[0]].execute(), None)
+            return
+        batch = service.new_batch_http_request(callback=callback)
+        for index in indexes:
+            batch.add(requests[index], request_id=str(index))
+        batch.execute()
+    except Exception as e:
+        _log.error('Batch of %s request(s) failed: %s', len(indexes), e)
+        for index in indexes:
+            if results[index] is None:
+                results[index] = (None, e)
+    finally:
+        # Every call in a batch is answered together, so each is given the
+        # latency of the whole batch
+        seconds = time.time() - started
+        for index in indexes:
+            error = results[index][1] if results[index] is not None else None
+            record_call(request_method(requests[index]), seconds, error_status(error) if error else '200')
+
+
+def _chunks(requests, indexes, max_batch_size, project_burst):
+    ''' Splits indexes into batches of at most max_batch_size calls, starting a
+        new batch before any one project has more than project_burst calls in
+        it, since the API sees every call in a batch at the same time. '''
+    chunk = []
+    calls = Counter()
+    for index in indexes:
+        project = request_project(requests[index])
+        if len(chunk) >= max_batch_size or (project_burst and project and calls[project] >= project_burst):
+            yield chunk
+            chunk = []
+            calls = Counter()
+        chunk.append(index)
+        calls[project] += 1
+    if chunk:
+        yield chunk
+
+
+def send_batch(service, requests, max_batch_size=MAX_BATCH_SIZE, limiter=None, indexes=None):
+    """
+    Sends requests built on service, or those at indexes, once each as
+    multipart batch requests of at most max_batch_size calls. A lone request is
+    executed on its own. Every call counts against the rate limiter
+    :return: List of (response, exception) tuples in request order, None for
+        requests not sent
+    """
+    limiter = limiter or default_limiter()
+    results = [None] * len(requests)
+    for chunk in _chunks(requests, range(len(requests)) if indexes is None else indexes, max_batch_size,
+                         limiter.project_burst):
+        _send(service, requests, chunk, results, limiter)
+    return results
+
+
+def _retry_delay(request, error, attempt, retries, limiter):
+    ''' Returns the seconds to wait before sending a failed call again, or None
+        when it is not retried. A rate limited call pauses the limiter for its
+        project whether it is retried or not. '''
+    delay = retry_delay(error, attempt)
+    if delay is None:
+        return None
+    rate_limited = is_rate_limited(error)
+    if rate_limited:
+        limiter.pause(delay, request_project(request))
+    if attempt >= retries:
+        return None
+    record_retry(request_method(request), 'rate_limited' if rate_limited else 'transient')
+    return delay
+
+
+class BatchDispatcher(object):
+    """
+    Coalesces API calls submitted from any thread into batch requests. Callers
+    submit a function that builds the request from a service; the dispatcher
+    thread builds it on its own client, waits up to window seconds for more
+    calls to arrive, and sends everything queued as one batch, resolving each
+    caller's future with its own response or error. A call failing with a rate
+    limit or transient error goes back on the queue, not to be sent again
+    before its backoff has passed, so it never holds up the other calls.
+    """
+
+    def __init__(self, service_factory, max_batch_size=MAX_BATCH_SIZE, window=BATCH_WINDOW, retries=MAX_RETRIES):
+        self._service_factory = service_factory
+        self._max_batch_size = max_batch_size
+        self._window = window
+        self._retries = retries
+        self._queue = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, build):
+        """
+        Queues a call for the next batch
+        :param build: Callable taking a compute service and returning a request
+        :return: Future resolving to the response
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('BatchDispatcher is closed')
+            self._queue.append({'build': build, 'future': future, 'request': None, 'attempt': 0, 'not_before': 0})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='batch-dispatcher')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def execute(self, build):
+        return self.submit(build).result()
+
+    def close(self):
+        ''' Stops accepting calls once everything queued has been sent. '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _due(self):
+        now = time.time()
+        return [entry for entry in self._queue if entry['not_before'] <= now]
+
+    def _next_group(self):
+        with self._condition:
+            due = self._due()
+            while not due:
+                if not self._queue:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                else:
+                    self._condition.wait(min(entry['not_before'] for entry in self._queue) - time.time())
+                due = self._due()
+            expires = time.time() + self._window
+            while len(due) < self._max_batch_size and not self._closed:
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+                due = self._due()
+            group = due[:self._max_batch_size]
+            taken = set(id(entry) for entry in group)
+            self._queue = [entry for entry in self._queue if id(entry) not in taken]
+            return group
+
+    def _run(self):
+        try:
+            service = self._service_factory()
+        except Exception as e:
+            _log.error('Batch dispatcher could not build a compute client: %s', e)
+            with self._condition:
+                group, self._queue = self._queue, []
+                self._thread = None
+            for entry in group:
+                entry['future'].set_exception(e)
+            return
+
+        limiter = default_limiter()
+        while True:
+            group = self._next_group()
+            if group is None:
+                return
+            try:
+                self._send_group(service, limiter, group)
+            except Exception as e:
+                _log.error('Batch dispatcher failed sending %s call(s): %s', len(group), e)
+                for entry in group:
+                    if not entry['future'].done():
+                        entry['future'].set_exception(e)
+
+    def _send_group(self, service, limiter, group):
+        entries = []
+        for entry in group:
+            if entry['request'] is None:
+                try:
+                    entry['request'] = entry['build'](service)
+                except Exception as e:
+                    entry['future'].set_exception(e)
+                    continue
+            entries.append(entry)
+
+        requests = [entry['request'] for entry in entries]
+        retry = []
+        for entry, (response, error) in zip(entries, send_batch(service, requests, self._max_batch_size, limiter)):
+            if error is None:
+                entry['future'].set_result(response)
+                continue
+            delay = _retry_delay(entry['request'], error, entry['attempt'], self._retries, limiter)
+            if delay is None:
+                entry['future'].set_exception(error)
+                continue
+            entry['attempt'] += 1
+            entry['not_before'] = time.time() + delay
+            retry.append(entry)
+        if retry:
+            _log.warning('%s of %s batched call(s) failed, sending them again after their backoff.',
+                         len(retry), len(entries))
+            with self._condition:
+                self._queue.extend(retry)
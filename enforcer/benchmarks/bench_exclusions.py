@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of the project exclusion check: the regex search
+project_ids_list() used to run for every project against the ExclusionIndex.
+
+    python benchmarks/bench_exclusions.py [exclusions] [projects]
+"""
+import os
+import re
+import sys
+import timeit
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from exclusions import ExclusionIndex  # noqa: E402
+
+
+def regex_loop(exclusions, project_ids):
+    excluded = 0
+    for project_id in project_ids:
+        if re.search(r".*({}).*".format("|".join(exclusions)), project_id):
+            excluded += 1
+    return excluded
+
+
+def index_loop(exclusions, project_ids):
+    index = ExclusionIndex(exclusions)
+    return sum(1 for project_id in project_ids if index.matches(project_id))
+
+
+def main(exclusion_count=2000, project_count=1000):
+    rng = random.Random(0)
+    exclusions = [str(rng.randint(100000, 999999)) for _ in range(exclusion_count)] + ['xpn']
+    project_ids = ['eim-{}-{}'.format(rng.randint(100000, 999999), rng.choice(['dev', 'prod', 'xpn-host']))
+                   for _ in range(project_count)]
+    assert regex_loop(exclusions, project_ids) == index_loop(exclusions, project_ids)
+
+    for name, func in (('regex', regex_loop), ('index', index_loop)):
+        seconds = min(timeit.repeat(lambda: func(exclusions, project_ids), number=1, repeat=3))
+        print('{:<6} {} exclusions x {} projects: {:.4f}s'.format(name, len(exclusions), project_count, seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
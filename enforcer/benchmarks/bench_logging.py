@@ -0,0 +1,69 @@
+"""
+Micro-benchmark of logging from concurrent scan workers: the FileHandler
+main.get_logger() used to attach, which formats and writes under a lock on
+the calling thread, against the queue handler and batched JSON LogWriter.
+
+    python benchmarks/bench_logging.py [threads] [records per thread]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audit import configure  # noqa: E402
+
+
+def file_handler(name, path):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(threadName)s] [%(name)s] %(levelname)s: %(message)s'))
+    logger.addHandler(handler)
+    return handler.close
+
+
+def queued(name, path):
+    return configure(name, path).stop
+
+
+def run(setup, threads, records):
+    directory = tempfile.mkdtemp()
+    name = 'bench-{}'.format(setup.__name__)
+    try:
+        close = setup(name, os.path.join(directory, 'bench.log'))
+        logger = logging.getLogger(name)
+        action = {'kind': 'addresses', 'project': 'bench-project', 'location': 'europe-west1'}
+
+        def work(index):
+            for count in range(records):
+                logger.warning('IP Enforcer deleted IP address %s from %s', '10.0.{}.{}'.format(index, count % 256),
+                               action['project'], extra={'audit': dict(action, outcome='deleted', duration=0.05)})
+
+        workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+        started = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        logged = time.time() - started
+        close()
+        return logged, time.time() - started
+    finally:
+        logging.getLogger(name).handlers = []
+        shutil.rmtree(directory)
+
+
+def main(threads=8, records=20000):
+    for setup in (file_handler, queued):
+        logged, written = run(setup, threads, records)
+        print('{:<12} {} threads x {} records: workers done in {:.2f}s, on disk in {:.2f}s'
+              .format(setup.__name__, threads, records, logged, written))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
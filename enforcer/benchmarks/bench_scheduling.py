@@ -0,0 +1,91 @@
+"""
+Simulation of a week of sweeps over projects where a few produce most of the
+violations: every project scanned on every five minute sweep, as deployed,
+against shorter sweeps that only scan the projects scheduling.is_due() picks,
+with the staleness bound set so that they make as many scans as the full
+sweeps. Prints the scans made and how long violations went unremediated.
+
+    python benchmarks/bench_scheduling.py [projects] [hot projects]
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduling import is_due, updated_score  # noqa: E402
+
+HOUR = 3600.0
+DAYS = 7
+# Chance per hour that someone creates an external address in a project
+HOT_RATE = 0.5
+COLD_RATE = 0.002
+# The ip-enforcer.timer interval
+SWEEP_INTERVAL = 300.0
+
+
+def simulate(projects, hot, interval, max_staleness=None, seed=1):
+    rng = random.Random(seed)
+    rates = [HOT_RATE if index < hot else COLD_RATE for index in range(projects)]
+    history = [None] * projects
+    violated_at = [None] * projects
+    delays = {'hot': [], 'cold': []}
+    scans = 0
+
+    now = 0.0
+    while now < DAYS * 24 * HOUR:
+        for index in range(projects):
+            if violated_at[index] is None and rng.random() < rates[index] * interval / HOUR:
+                violated_at[index] = now - rng.random() * interval
+            if max_staleness is not None and not is_due(history[index], now, max_staleness):
+                continue
+            scans += 1
+            violation = violated_at[index] is not None
+            if violation:
+                delays['hot' if index < hot else 'cold'].append(now - violated_at[index])
+                violated_at[index] = None
+            previous = history[index]
+            violations, churn = updated_score(previous, violation, 2 if violation else 0, now)
+            history[index] = {'scanned_at': now, 'retry_at': None, 'violations': violations, 'churn': churn,
+                              'updated_at': now}
+        now += interval
+    return scans, delays
+
+
+def describe(delays):
+    if not delays:
+        return 'none'
+    delays = sorted(delays)
+    return 'mean {:.0f}s, p95 {:.0f}s over {}'.format(sum(delays) / len(delays),
+                                                      delays[int(len(delays) * 0.95)], len(delays))
+
+
+def matched_staleness(projects, hot, interval, budget):
+    ''' Bisects for the staleness bound at which adaptive sweeps every interval
+        seconds make as many scans as budget. '''
+    low, high = interval, 24 * HOUR
+    for _ in range(12):
+        middle = (low * high) ** 0.5
+        if simulate(projects, hot, interval, middle)[0] > budget:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def report(name, scans, delays):
+    print('{:<28} {:.0f} scans/hour; hot violations: {}; cold violations: {}'
+          .format(name, scans / (DAYS * 24.0), describe(delays['hot']), describe(delays['cold'])))
+
+
+def main(projects=1000, hot=50):
+    budget, delays = simulate(projects, hot, SWEEP_INTERVAL)
+    report('full sweep every {:.0f}s'.format(SWEEP_INTERVAL), budget, delays)
+    for interval in (60.0, 30.0):
+        max_staleness = matched_staleness(projects, hot, interval, budget)
+        scans, delays = simulate(projects, hot, interval, max_staleness)
+        report('adaptive {:.0f}s, staleness {:.0f}s'.format(interval, max_staleness), scans, delays)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+"""
+Startup benchmark: import time of main.py as reported by python -X importtime,
+and the time from interpreter start to the first compute request being ready
+to send. Pass a discovery document to time building the client from it.
+
+    python benchmarks/bench_startup.py [--discovery-document compute.v1.json]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ENFORCER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+FIRST_CALL = '''
+import time
+started = time.time()
+import main
+from google.auth.credentials import AnonymousCredentials
+service = main.build_compute_service(credentials=AnonymousCredentials())
+service.addresses().aggregatedList(project='bench')
+print(time.time() - started)
+'''
+
+
+def import_time(env):
+    ''' Cumulative import time of main in microseconds, from -X importtime. '''
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ENFORCER_DIR, env=env,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'main':
+            return int(fields[1])
+    raise RuntimeError('main not found in importtime output')
+
+
+def first_call_time(env):
+    output = subprocess.run([sys.executable, '-c', FIRST_CALL], cwd=ENFORCER_DIR, env=env,
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--discovery-document', help='compute v1 discovery document to build the client from')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, IP_ENFORCER_PROJECT_ID='bench')
+    imports = sorted(import_time(env) for _ in range(args.repeat))
+    print('import main: median {:.1f}ms'.format(imports[len(imports) // 2] / 1000.0))
+
+    if args.discovery_document:
+        env['IP_ENFORCER_DISCOVERY_DOCUMENT'] = os.path.abspath(args.discovery_document)
+        calls = sorted(first_call_time(env) for _ in range(args.repeat))
+        print('start to first request: median {:.1f}ms'.format(calls[len(calls) // 2] * 1000.0))
+
+
+if __name__ == '__main__':
+    main()
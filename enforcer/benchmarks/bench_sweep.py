@@ -0,0 +1,133 @@
+"""
+Sweep benchmark: runs scan_projects against the fake API server in a separate
+process and reports sweep time, requests made and peak Python memory of the
+enforcer. Arguments after -- are passed on to benchmarks/fake_api.py.
+
+    python benchmarks/bench_sweep.py --projects 1000 --workers 8 -- --latency 0.02 --operation-time 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from urllib.request import Request, urlopen
+
+ENFORCER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ENFORCER_DIR)
+
+
+def start_fake_api(args):
+    ''' Starts fake_api.py and returns the process and its root URL. '''
+    process = subprocess.Popen([sys.executable, os.path.join(ENFORCER_DIR, 'benchmarks', 'fake_api.py')] + args,
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('listening on '):
+        process.kill()
+        raise RuntimeError('fake API did not start: {}'.format(line))
+    return process, line.split()[-1]
+
+
+def fetch(root_url, path, method='GET'):
+    with urlopen(Request(root_url + path, method=method, data=b'' if method == 'POST' else None)) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def method_latencies(metrics):
+    ''' Summarises the calls, mean latency and retries of each API method from
+        a metrics delta. '''
+    methods = {}
+    for labels, histogram in metrics['api_request_duration_seconds']['samples'].items():
+        if histogram['count']:
+            methods[labels.split('=', 1)[1]] = {'calls': histogram['count'], 'retries': 0,
+                                                'mean_ms': round(histogram['sum'] / histogram['count'] * 1000, 1)}
+    for labels, count in metrics['api_retries']['samples'].items():
+        method = dict(label.split('=', 1) for label in labels.split(','))['method']
+        if method in methods:
+            methods[method]['retries'] += count
+    return methods
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    fake_args = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--addresses', type=int, default=10, help='addresses per project')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--sweeps', type=int, default=1, help='consecutive sweeps sharing one state store')
+    parser.add_argument('--rate-limit', type=float, help='enforcer calls per second across all projects')
+    parser.add_argument('--project-rate-limit', type=float, help='enforcer calls per second per project')
+    parser.add_argument('--profile', metavar='PATH', help='profile the first sweep into a pstats file')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    process, root_url = start_fake_api(['--projects', str(args.projects), '--addresses', str(args.addresses)] +
+                                       fake_args)
+    state_dir = tempfile.mkdtemp(prefix='bench-sweep-')
+    try:
+        document = os.path.join(state_dir, 'compute.v1.json')
+        with open(document, 'w') as document_file:
+            json.dump(fetch(root_url, 'discovery/v1/apis/compute/v1/rest'), document_file)
+        os.environ.update(IP_ENFORCER_DISCOVERY_DOCUMENT=document, IP_ENFORCER_PROJECT_ID='bench',
+                          IP_ENFORCER_STATE_DIR=state_dir)
+
+        import main as enforcer
+        from google.auth.credentials import AnonymousCredentials
+        from metrics import SweepProfiler, default_registry, delta
+        from ratelimit import configure
+        from state import StateStore
+        configure(args.rate_limit, args.project_rate_limit)
+        build_compute_service = enforcer.build_compute_service
+        enforcer.build_compute_service = lambda credentials=None: build_compute_service(AnonymousCredentials())
+
+        projects = fetch(root_url, '_fake/projects')
+        reports = []
+        with StateStore(os.path.join(state_dir, 'state.db')) as store:
+            for sweep in range(args.sweeps):
+                fetch(root_url, '_fake/reset', 'POST')
+                profiler = SweepProfiler(args.profile) if args.profile and not sweep else None
+                before = default_registry().snapshot()
+                tracemalloc.start()
+                started = time.time()
+                summary = enforcer.scan_projects(projects['projects'], args.workers, store=store, profiler=profiler)
+                elapsed = time.time() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                if profiler is not None:
+                    profiler.dump()
+                metrics = delta(default_registry().snapshot(), before)
+                stats = fetch(root_url, '_fake/stats')
+                reports.append({'sweep': sweep + 1, 'seconds': round(elapsed, 3), 'projects': summary['projects'],
+                                'remediated': len(summary['remediated']), 'errors': len(summary['errors']),
+                                'http_requests': stats.get('http_requests', 0), 'api_calls': stats.get('calls', 0),
+                                'rate_limited': stats.get('rate_limited', 0),
+                                'response_mb': round(stats.get('response_bytes', 0) / 1024.0 / 1024.0, 2),
+                                'peak_memory_mb': round(peak / 1024.0 / 1024.0, 2),
+                                'methods': method_latencies(metrics)})
+        remaining = fetch(root_url, '_fake/projects')['external_addresses']
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        print(json.dumps({'sweeps': reports, 'external_addresses_before': projects['external_addresses'],
+                          'external_addresses_after': remaining}, indent=2))
+        return
+    print('{} projects, {} external addresses before, {} after'.format(args.projects,
+                                                                       projects['external_addresses'], remaining))
+    for report in reports:
+        print('sweep {sweep}: {seconds:.2f}s, {http_requests} HTTP requests ({api_calls} API calls, '
+              '{response_mb:.1f}MB), '
+              '{rate_limited} rate limited, peak memory {peak_memory_mb:.1f}MB, {remediated} remediated, '
+              '{errors} errors'.format(**report))
+        for method, latency in sorted(report['methods'].items()):
+            print('  {:<40} {calls:>6} calls, mean {mean_ms:.1f}ms, {retries} retried'.format(method, **latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,561 @@
+"""
+Local stand-in for the Compute Engine, Cloud Storage and Resource Manager
+endpoints the enforcer calls, for scale benchmarks and end-to-end tests.
+
+Serves addresses.aggregatedList (paged, with equality filters and field
+masks), the address, forwarding rule, instance and router deletes,
+zone/region/global operations get and wait, Compute batch requests, storage
+object metadata and media, Resource Manager v1 projects.list and a discovery
+document describing the Compute methods, so a real googleapiclient client can
+be pointed at it. Latency, error rate, a per-project rate limit answering 429
+with Retry-After and operation completion time are configurable, and the
+projects are generated from the tests/fixtures address payloads.
+
+    python benchmarks/fake_api.py --projects 1000 --addresses 10 [--port 8080]
+"""
+import os
+import re
+import sys
+import json
+import copy
+import time
+import random
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, quote, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+TEMPLATES = ('address-reserved-regional.json', 'address-reserved-global.json', 'address-inuse-global.json',
+             'address-inuse-regional-forwarding-rule.json', 'address-inuse-regional-instance.json',
+             'address-inuse-regional-router.json')
+RESOURCE_ROOT = 'https://www.googleapis.com/compute/v1/'
+FOLDER_ID = '123456789'
+RETRY_AFTER = 1
+
+_COMPUTE_PATH = re.compile(r'^/compute/v1/projects/(?P<project>[^/]+)/(?P<scope>global|regions/[^/]+|zones/[^/]+)'
+                           r'/(?P<collection>[A-Za-z]+)(?:/(?P<name>[^/]+))?(?P<wait>/wait)?$')
+_AGGREGATED_PATH = re.compile(r'^/compute/v1/projects/(?P<project>[^/]+)/aggregated/addresses$')
+_OBJECT_PATH = re.compile(r'^/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>[^/]+)$')
+_ADDRESS_MASK = re.compile(r'items/\*/addresses\(([^)]*)\)')
+_PROJECT_PATH = re.compile(r'/projects/([^/]+)')
+_FILTER = re.compile(r'^\s*\(?\s*(\w+)\s*(=|!=|eq|ne)\s*"?([^")]+?)"?\s*\)?\s*$')
+
+
+def _resource_path(url):
+    ''' Strips a resource URL down to scope/collection/name. '''
+    return url.split('/projects/', 1)[1].split('/', 1)[1]
+
+
+def _load_templates():
+    templates = []
+    for name in TEMPLATES:
+        with open(os.path.join(FIXTURES, name)) as fixture:
+            for scope, scoped_list in json.load(fixture).items():
+                templates.extend((scope, item) for item in scoped_list['addresses'])
+    return templates
+
+
+def generate_addresses(project, count, rng, internal_ratio=0.2, templates=None):
+    """
+    Generates count addresses for a project by cloning the fixture payloads with
+    unique names and IPs, plus internal addresses in the given ratio
+    :return: List of (scope, address) tuples
+    """
+    templates = templates or _load_templates()
+    addresses = []
+    for index in range(count):
+        scope, template = rng.choice(templates)
+        item = copy.deepcopy(template)
+        item['name'] = '{}-{}'.format(template['name'], index)
+        item['address'] = '10.{}.{}.{}'.format(index // 65536 % 256, index // 256 % 256, index % 256)
+        item['selfLink'] = '{}projects/{}/{}/addresses/{}'.format(RESOURCE_ROOT, project, scope, item['name'])
+        if 'region' in item:
+            item['region'] = '{}projects/{}/{}'.format(RESOURCE_ROOT, project, scope)
+        item['users'] = ['{}projects/{}/{}-{}'.format(RESOURCE_ROOT, project, _resource_path(user), index)
+                         for user in item.get('users', [])]
+        if not item['users']:
+            item.pop('users')
+        if scope != 'global' and rng.random() < internal_ratio:
+            item['addressType'] = 'INTERNAL'
+        addresses.append((scope, item))
+    return addresses
+
+
+def discovery_document(root_url):
+    ''' Describes the Compute methods the fake serves, rooted at root_url. '''
+
+    def method(id_, path, http_method, order, query=(), response='Operation'):
+        parameters = dict((name, {'type': 'string', 'location': 'path', 'required': True}) for name in order)
+        for name in query:
+            parameters[name] = {'type': 'integer' if name == 'maxResults' else 'string', 'location': 'query'}
+        return {'id': 'compute.' + id_, 'path': path, 'httpMethod': http_method, 'parameters': parameters,
+                'parameterOrder': list(order), 'response': {'$ref': response}}
+
+    def delete(collection, scope, key):
+        if scope:
+            return method(collection + '.delete', 'projects/{project}/%ss/{%s}/%s/{%s}' % (scope, scope, collection, key),
+                          'DELETE', ('project', scope, key))
+        return method(collection + '.delete', 'projects/{project}/global/%s/{%s}' % (collection[6].lower() +
+                      collection[7:], key), 'DELETE', ('project', key))
+
+    def operations(collection, scope):
+        prefix = 'projects/{project}/%ss/{%s}/operations/{operation}' % (scope, scope) if scope \
+            else 'projects/{project}/global/operations/{operation}'
+        order = ('project', scope, 'operation') if scope else ('project', 'operation')
+        return {'methods': {'get': method(collection + '.get', prefix, 'GET', order),
+                            'wait': method(collection + '.wait', prefix + '/wait', 'POST', order)}}
+
+    paging = ('filter', 'maxResults', 'pageToken', 'orderBy')
+    return {
+        'kind': 'discovery#restDescription', 'discoveryVersion': 'v1', 'id': 'compute:v1', 'name': 'compute',
+        'version': 'v1', 'protocol': 'rest', 'rootUrl': root_url, 'servicePath': 'compute/v1/',
+        'baseUrl': root_url + 'compute/v1/', 'batchPath': 'batch/compute/v1',
+        'parameters': {'fields': {'type': 'string', 'location': 'query'},
+                       'alt': {'type': 'string', 'location': 'query', 'default': 'json'},
+                       'quotaUser': {'type': 'string', 'location': 'query'}},
+        'schemas': {
+            'Operation': {'id': 'Operation', 'type': 'object'},
+            'Address': {'id': 'Address', 'type': 'object'},
+            'AddressList': {'id': 'AddressList', 'type': 'object',
+                            'properties': {'nextPageToken': {'type': 'string'}}},
+            'AddressAggregatedList': {'id': 'AddressAggregatedList', 'type': 'object',
+                                      'properties': {'nextPageToken': {'type': 'string'}}},
+        },
+        'resources': {
+            'addresses': {'methods': {
+                'aggregatedList': method('addresses.aggregatedList', 'projects/{project}/aggregated/addresses',
+                                         'GET', ('project',), paging + ('includeAllScopes',),
+                                         'AddressAggregatedList'),
+                'list': method('addresses.list', 'projects/{project}/regions/{region}/addresses', 'GET',
+                               ('project', 'region'), paging, 'AddressList'),
+                'get': method('addresses.get', 'projects/{project}/regions/{region}/addresses/{address}', 'GET',
+                              ('project', 'region', 'address'), response='Address'),
+                'delete': delete('addresses', 'region', 'address')}},
+            'globalAddresses': {'methods': {
+                'list': method('globalAddresses.list', 'projects/{project}/global/addresses', 'GET',
+                               ('project',), paging, 'AddressList'),
+                'get': method('globalAddresses.get', 'projects/{project}/global/addresses/{address}', 'GET',
+                              ('project', 'address'), response='Address'),
+                'delete': delete('globalAddresses', None, 'address')}},
+            'forwardingRules': {'methods': {'delete': delete('forwardingRules', 'region', 'forwardingRule')}},
+            'globalForwardingRules': {'methods': {'delete': delete('globalForwardingRules', None,
+                                                                   'forwardingRule')}},
+            'instances': {'methods': {'delete': delete('instances', 'zone', 'instance')}},
+            'routers': {'methods': {'delete': delete('routers', 'region', 'router')}},
+            'zoneOperations': operations('zoneOperations', 'zone'),
+            'regionOperations': operations('regionOperations', 'region'),
+            'globalOperations': operations('globalOperations', None),
+        },
+    }
+
+
+def _error(status, reason, message):
+    return status, {'error': {'code': status, 'message': message, 'errors': [{'reason': reason,
+                                                                             'message': message}]}}
+
+
+class FakeGcp(object):
+    """
+    In-memory state and request handling behind the fake API server. Deleting a
+    forwarding rule, instance or router starts an operation that completes
+    operation_time seconds later and only then frees the addresses it used;
+    deleting an address that is still in use fails like the real API does.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, operation_time=0.0, page_size=500,
+                 seed=0, rate_limit=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.operation_time = operation_time
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.root_url = 'http://127.0.0.1/'
+        self.stats = Counter()
+        self.projects = OrderedDict()
+        self.objects = {}
+        self._operations = {}
+        self._operation_ids = 0
+        self._buckets = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+
+    def add_project(self, project, addresses, folder_id=FOLDER_ID):
+        ''' Adds a project holding (scope, address) tuples and the resources using them. '''
+        with self._lock:
+            scopes = OrderedDict()
+            resources = set()
+            for scope, item in addresses:
+                scopes.setdefault(scope, OrderedDict())[item['name']] = item
+                for user in item.get('users', []):
+                    resources.add(_resource_path(user))
+            self.projects[project] = {'addresses': scopes, 'resources': resources, 'folder': folder_id}
+
+    def populate(self, projects, addresses_per_project, internal_ratio=0.2, prefix='bench-project'):
+        templates = _load_templates()
+        for index in range(projects):
+            project = '{}-{:05d}'.format(prefix, index)
+            self.add_project(project, generate_addresses(project, addresses_per_project, self._rng, internal_ratio,
+                                                         templates))
+
+    def put_object(self, bucket, name, data):
+        with self._lock:
+            generation = self.objects.get((bucket, name), {}).get('generation', 0) + 1
+            self.objects[(bucket, name)] = {'data': data, 'generation': generation}
+
+    def external_addresses(self, project=None):
+        ''' Counts the external addresses left, in one project or in all. '''
+        with self._lock:
+            self._advance()
+            projects = [self.projects[project]] if project else self.projects.values()
+            return sum(1 for state in projects for scoped in state['addresses'].values()
+                       for item in scoped.values() if item['addressType'] == 'EXTERNAL')
+
+    def handle(self, method, path, body, content_type=''):
+        """
+        Handles one HTTP request
+        :return: Tuple of status, content type and body bytes
+        """
+        self.stats['http_requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+
+        if url.path == '/batch/compute/v1' and method == 'POST':
+            self.stats['batch_requests'] += 1
+            return self._batch(body.decode('utf-8'), content_type)
+        if url.path.startswith('/_fake/'):
+            return self._control(method, url.path)
+
+        status, payload = self._call(method, url.path, query)
+        if isinstance(payload, bytes):
+            return status, 'application/octet-stream', payload
+        body = json.dumps(payload).encode('utf-8')
+        self.stats['response_bytes'] += len(body)
+        return status, 'application/json; charset=UTF-8', body
+
+    def _control(self, method, path):
+        with self._lock:
+            if path == '/_fake/stats':
+                payload = dict(self.stats)
+            elif path == '/_fake/reset' and method == 'POST':
+                self.stats.clear()
+                payload = {}
+            elif path == '/_fake/projects':
+                payload = {'projects': list(self.projects), 'external_addresses': self.external_addresses()}
+            else:
+                return 404, 'text/plain', b'Not Found'
+        return 200, 'application/json', json.dumps(payload).encode('utf-8')
+
+    def _batch(self, body, content_type):
+        message = Parser().parsestr('Content-Type: {}\r\n\r\n{}'.format(content_type, body))
+        boundary = 'batch_fake_{}'.format(self._rng.randint(0, 1 << 30))
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            request_line = request.split('\n', 1)[0].strip()
+            method, target = request_line.split(' ')[:2]
+            url = urlparse(target)
+            query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+            status, payload = self._call(method, url.path, query)
+            parts.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+                         'HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=UTF-8\r\n{}\r\n{}\r\n'
+                         .format(boundary, part['Content-ID'][1:-1], status, 'OK' if status < 300 else 'Error',
+                                 'Retry-After: {}\r\n'.format(RETRY_AFTER) if status == 429 else '',
+                                 json.dumps(payload)))
+        body = ''.join(parts) + '--{}--\r\n'.format(boundary)
+        self.stats['response_bytes'] += len(body)
+        return 200, 'multipart/mixed; boundary={}'.format(boundary), body.encode('utf-8')
+
+    def _call(self, method, path, query):
+        self.stats['calls'] += 1
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.stats['injected_errors'] += 1
+            return _error(self.error_status, 'backendError', 'Injected error')
+        if self.rate_limit and self._rate_limited(path):
+            self.stats['rate_limited'] += 1
+            return _error(429, 'rateLimitExceeded', 'Rate Limit Exceeded')
+
+        with self._lock:
+            self._advance()
+            if path == '/discovery/v1/apis/compute/v1/rest':
+                return 200, discovery_document(self.root_url)
+            match = _AGGREGATED_PATH.match(path)
+            if match and method == 'GET':
+                self.stats['addresses.aggregatedList'] += 1
+                return self._aggregated_list(match.group('project'), query)
+            match = _COMPUTE_PATH.match(path)
+            if match:
+                return self._compute(method, match.groupdict(), query)
+            match = _OBJECT_PATH.match(path)
+            if match and method == 'GET':
+                return self._object(match.group('bucket'), match.group('name'), query)
+            if path == '/v1/projects' and method == 'GET':
+                return self._list_projects(query)
+        return _error(404, 'notFound', 'Unknown path {}'.format(path))
+
+    def _rate_limited(self, path):
+        ''' Token bucket of rate_limit calls per second for each project. '''
+        match = _PROJECT_PATH.search(path)
+        if match is None:
+            return False
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(match.group(1), (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - updated) * self.rate_limit)
+            limited = tokens < 1
+            self._buckets[match.group(1)] = (tokens if limited else tokens - 1, now)
+        return limited
+
+    def _aggregated_list(self, project, query):
+        state = self.projects.get(project)
+        if state is None:
+            return _error(404, 'notFound', 'The resource \'projects/{}\' was not found'.format(project))
+
+        matches = self._filter(query)
+        if matches is None:
+            return _error(400, 'invalid', 'Invalid filter {}'.format(query['filter']))
+        items = [(scope, item) for scope, scoped in state['addresses'].items() for item in scoped.values()
+                 if matches(item)]
+
+        start = int(query.get('pageToken') or 0)
+        size = min(int(query.get('maxResults') or self.page_size), self.page_size)
+        response = {'kind': 'compute#addressAggregatedList', 'id': 'projects/{}/aggregated/addresses'.format(project),
+                    'items': OrderedDict()}
+        for scope, item in items[start:start + size]:
+            response['items'].setdefault(scope, {'addresses': []})['addresses'].append(item)
+        response['items']['regions/us-east1'] = {'warning': {'code': 'NO_RESULTS_ON_PAGE',
+                                                             'message': 'There are no results for scope '
+                                                                        '\'regions/us-east1\' on this page.'}}
+        if start + size < len(items):
+            response['nextPageToken'] = str(start + size)
+        if query.get('fields'):
+            response = self._mask(response, query['fields'])
+        return 200, response
+
+    def _filter(self, query):
+        ''' Returns a predicate for an equality filter, or None if it is invalid. '''
+        if not query.get('filter'):
+            return lambda item: True
+        match = _FILTER.match(query['filter'])
+        if match is None:
+            return None
+        key, operator, value = match.groups()
+        return lambda item: (str(item.get(key)) == value) == (operator in ('=', 'eq'))
+
+    def _mask(self, response, fields):
+        ''' Applies a partial response mask of the items/*/addresses(...) form. '''
+        match = _ADDRESS_MASK.search(fields)
+        keep = set(match.group(1).split(',')) if match else None
+        masked = dict((key, response[key]) for key in ('nextPageToken',) if key in response and key in fields)
+        masked['items'] = OrderedDict()
+        for scope, scoped in response['items'].items():
+            if keep is not None and 'addresses' in scoped:
+                masked['items'][scope] = {'addresses': [dict((key, value) for key, value in item.items() if key in keep)
+                                                        for item in scoped['addresses']]}
+        return masked
+
+    def _compute(self, method, match, query):
+        project, scope, collection, name = match['project'], match['scope'], match['collection'], match['name']
+        state = self.projects.get(project)
+        if state is None:
+            return _error(404, 'notFound', 'The resource \'projects/{}\' was not found'.format(project))
+
+        if collection == 'operations':
+            operation = self._operations.get((project, name))
+            if operation is None:
+                return _error(404, 'notFound', 'Operation {} not found'.format(name))
+            if match['wait'] and method == 'POST':
+                self.stats['operations.wait'] += 1
+                return 200, self._wait(operation)
+            self.stats['operations.get'] += 1
+            return 200, operation['resource']
+
+        if method == 'GET' and collection == 'addresses' and name:
+            self.stats['addresses.get'] += 1
+            item = state['addresses'].get(scope, {}).get(name)
+            if item is None:
+                return _error(404, 'notFound', 'Address {} not found'.format(name))
+            return 200, item
+        if method == 'GET' and collection == 'addresses':
+            self.stats['addresses.list'] += 1
+            matches = self._filter(query)
+            if matches is None:
+                return _error(400, 'invalid', 'Invalid filter {}'.format(query['filter']))
+            items = [item for item in state['addresses'].get(scope, {}).values() if matches(item)]
+            return 200, {'kind': 'compute#addressList', 'items': items}
+
+        if method != 'DELETE' or not name:
+            return _error(405, 'badRequest', 'Unsupported {} {}'.format(method, collection))
+        self.stats['{}.delete'.format(collection)] += 1
+
+        if collection == 'addresses':
+            item = state['addresses'].get(scope, {}).get(name)
+            if item is None:
+                return _error(404, 'notFound', 'Address {} not found'.format(name))
+            if item.get('users'):
+                return _error(400, 'resourceInUseByAnotherResource',
+                              'The address resource \'{}\' is already being used by \'{}\''.format(name,
+                                                                                                   item['users'][0]))
+            del state['addresses'][scope][name]
+            return 200, self._operation(project, scope, name, collection, done=True)
+
+        resource = '{}/{}/{}'.format(scope, collection, name)
+        if resource not in state['resources']:
+            return _error(404, 'notFound', 'The resource \'{}\' was not found'.format(resource))
+        state['resources'].discard(resource)
+        return 200, self._operation(project, scope, name, collection, resource=resource)
+
+    def _operation(self, project, scope, name, collection, resource=None, done=False):
+        self._operation_ids += 1
+        operation_name = 'operation-{}'.format(self._operation_ids)
+        body = {'kind': 'compute#operation', 'name': operation_name, 'operationType': 'delete',
+                'status': 'DONE' if done or not self.operation_time else 'RUNNING',
+                'targetLink': '{}projects/{}/{}/{}/{}'.format(RESOURCE_ROOT, project, scope, collection, name),
+                'selfLink': '{}projects/{}/{}/operations/{}'.format(RESOURCE_ROOT, project, scope, operation_name)}
+        if scope != 'global':
+            body[scope.split('/')[0][:-1]] = '{}projects/{}/{}'.format(RESOURCE_ROOT, project, scope)
+        operation = {'resource': body, 'project': project, 'target': resource,
+                     'done_at': time.time() + (0 if done else self.operation_time)}
+        self._operations[(project, operation_name)] = operation
+        if body['status'] == 'DONE':
+            self._complete(operation)
+        return dict(body)
+
+    def _advance(self):
+        now = time.time()
+        for operation in self._operations.values():
+            if operation['resource']['status'] != 'DONE' and operation['done_at'] <= now:
+                operation['resource']['status'] = 'DONE'
+                self._complete(operation)
+
+    def _complete(self, operation):
+        if operation['target'] is None:
+            return
+        suffix = '/' + operation['target']
+        for scoped in self.projects[operation['project']]['addresses'].values():
+            for item in scoped.values():
+                users = [user for user in item.get('users', []) if not user.endswith(suffix)]
+                if len(users) != len(item.get('users', [])):
+                    item['users'] = users
+                    if not users:
+                        item['status'] = 'RESERVED'
+                        del item['users']
+
+    def _wait(self, operation):
+        ''' Blocks like operations.wait, for up to two minutes. '''
+        remaining = min(operation['done_at'] - time.time(), 120)
+        if remaining > 0:
+            self._lock.release()
+            try:
+                time.sleep(remaining)
+            finally:
+                self._lock.acquire()
+            self._advance()
+        return operation['resource']
+
+    def _object(self, bucket, name, query):
+        stored = self.objects.get((bucket, name))
+        if stored is None:
+            return _error(404, 'notFound', 'No such object: {}/{}'.format(bucket, name))
+        self.stats['objects.get'] += 1
+        if query.get('alt') == 'media':
+            return 200, stored['data']
+        return 200, {'kind': 'storage#object', 'bucket': bucket, 'name': name, 'size': str(len(stored['data'])),
+                     'generation': str(stored['generation']), 'etag': 'etag-{}'.format(stored['generation']),
+                     'mediaLink': '{}download/storage/v1/b/{}/o/{}?alt=media'.format(self.root_url, bucket,
+                                                                                     quote(name, safe=''))}
+
+    def _list_projects(self, query):
+        self.stats['projects.list'] += 1
+        folder = None
+        match = re.search(r'parent\.id:(\S+)', query.get('filter', ''))
+        if match:
+            folder = match.group(1)
+        projects = [project for project, state in self.projects.items() if folder in (None, state['folder'])]
+        start = int(query.get('pageToken') or 0)
+        size = int(query.get('pageSize') or 500)
+        response = {'projects': [{'projectId': project, 'name': project, 'lifecycleState': 'ACTIVE',
+                                  'parent': {'type': 'folder', 'id': self.projects[project]['folder']}}
+                                 for project in projects[start:start + size]]}
+        if start + size < len(projects):
+            response['nextPageToken'] = str(start + size)
+        return 200, response
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, small bodies would wait on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, content_type, payload = self.server.fake.handle(self.command, self.path, body,
+                                                                self.headers.get('Content-Type', ''))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            self.send_header('Retry-After', str(RETRY_AFTER))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(fake, port=0):
+    """
+    Serves a FakeGcp on 127.0.0.1 from a background thread
+    :return: The HTTPServer, call shutdown() to stop it
+    """
+    server = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+    server.fake = fake
+    fake.root_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, name='fake-api')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local fake of the GCP APIs used by the IP enforcer.')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--addresses', type=int, default=10, help='addresses per project')
+    parser.add_argument('--internal-ratio', type=float, default=0.2)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls failing')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--operation-time', type=float, default=0.0, help='seconds until an operation is DONE')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--rate-limit', type=float, help='calls per second per project before answering 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fake = FakeGcp(args.latency, args.error_rate, args.error_status, args.operation_time, args.page_size, args.seed,
+                   args.rate_limit)
+    fake.populate(args.projects, args.addresses, args.internal_ratio)
+    server = serve(fake, args.port)
+    print('listening on {}'.format(fake.root_url))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import os
+import time
+import errno
+import fcntl
+import signal
+import logging
+import threading
+
+_log = logging.getLogger('ip-enforcer.daemon')
+
+
+class SweepScheduler(object):
+    """
+    Runs a sweep function every interval seconds inside a long-running process.
+    Sweeps start at a fixed rate; one that overruns the interval is followed
+    straight away by the next, and a sweep is never started while another is
+    still in progress.
+    """
+
+    def __init__(self, sweep, interval):
+        self._sweep = sweep
+        self._interval = interval
+        self._running = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self.sweeps = 0
+
+    def run_once(self):
+        ''' Runs a sweep unless one is already in progress, returning whether it ran. '''
+        if not self._running.acquire(False):
+            _log.warning('IP Enforcer sweep already in progress, not starting another.')
+            return False
+        try:
+            self.sweeps += 1
+            self._sweep()
+        except Exception as e:
+            _log.error('IP Enforcer sweep failed: %s', e)
+        finally:
+            self._running.release()
+        return True
+
+    def run_forever(self):
+        next_run = time.time()
+        while not self._stopped.is_set():
+            delay = next_run - time.time()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                if self._stopped.is_set():
+                    break
+
+            started = time.time()
+            self.run_once()
+            next_run = started + self._interval
+            if time.time() > next_run:
+                _log.warning('IP Enforcer sweep took %.0fs, longer than the %ss interval.',
+                             time.time() - started, self._interval)
+
+    def trigger(self):
+        ''' Starts the next sweep now instead of waiting for the interval. '''
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def install_signal_handlers(self):
+        ''' SIGTERM and SIGINT stop the scheduler after the current sweep, SIGHUP
+            triggers an immediate sweep. '''
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.trigger())
+
+
+class SweepLock(object):
+    """
+    File lock held for the length of a sweep, so a second enforcer process,
+    such as a oneshot run started while the last one is still going, does not
+    sweep the same projects at the same time. The kernel releases the lock
+    when its holder exits, however it exits.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+
+    def acquire(self):
+        ''' Takes the lock unless another process holds it, returning whether it was taken. '''
+        directory = os.path.dirname(self._path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self._path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        lock_file.truncate(0)
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def holder(self):
+        ''' Returns the pid of the process that last took the lock, if known. '''
+        try:
+            with open(self._path) as lock_file:
+                return int(lock_file.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
@@ -0,0 +1,67 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+_log = logging.getLogger('ip-enforcer.discovery')
+
+DOCUMENT_TTL = 24 * 60 * 60
+BUNDLED_DOCUMENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery', 'compute.v1.json')
+
+_bundled = {}
+_bundled_lock = threading.Lock()
+
+
+class DiscoveryDocumentCache(object):
+    """
+    File cache for discovery documents, implementing the get/set interface that
+    googleapiclient's discovery.build accepts as its cache argument. Documents
+    older than ttl seconds are fetched again.
+    """
+
+    def __init__(self, directory, ttl=DOCUMENT_TTL):
+        self._directory = directory
+        self._ttl = ttl
+
+    def _path(self, url):
+        return os.path.join(self._directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self._ttl:
+                return None
+            with open(path) as document:
+                return document.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, url, content):
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self._directory, delete=False) as document:
+                document.write(content)
+            os.rename(document.name, self._path(url))
+        except (IOError, OSError) as e:
+            _log.warning('Could not cache discovery document %s: %s', url, e)
+
+
+def bundled_document(path=None):
+    """
+    Returns the discovery document shipped with the enforcer, read once per
+    process, or None if the image does not include one. The text is returned
+    rather than a parsed dict because building a client mutates the document
+    :param path: Document path, defaults to IP_ENFORCER_DISCOVERY_DOCUMENT or
+        discovery/compute.v1.json next to this module
+    """
+    path = path or os.environ.get('IP_ENFORCER_DISCOVERY_DOCUMENT', BUNDLED_DOCUMENT)
+    with _bundled_lock:
+        if path not in _bundled:
+            try:
+                with open(path) as document:
+                    _bundled[path] = document.read()
+            except (IOError, OSError):
+                _bundled[path] = None
+        return _bundled[path]
@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_log = logging.getLogger('ip-enforcer.events')
+
+EVENT_WORKERS = 4
+DEDUP_WINDOW = 60.0
+POLL_INTERVAL = 1.0
+# A failed remediation is tried again after RETRY_INTERVAL seconds, doubling up
+# to MAX_RETRY_INTERVAL, and given up after MAX_ATTEMPTS: the next sweep finds
+# whatever an event could not remediate.
+MAX_ATTEMPTS = 5
+RETRY_INTERVAL = 5.0
+MAX_RETRY_INTERVAL = 300.0
+
+# Audit log methods that can put an external address in use, by the kind of
+# resource they create or change.
+_METHOD_KINDS = {
+    'addresses.insert': 'addresses',
+    'globalAddresses.insert': 'globalAddresses',
+    'instances.insert': 'instances',
+    'instances.addAccessConfig': 'instances',
+    'instances.updateAccessConfig': 'instances',
+    'forwardingRules.insert': 'forwardingRules',
+    'globalForwardingRules.insert': 'globalForwardingRules',
+    'routers.insert': 'routers',
+    'routers.patch': 'routers',
+    'routers.update': 'routers',
+}
+
+
+def _resource_event(resource_name):
+    ''' Splits projects/p/(global|regions/r|zones/z)/collection/name into an event. '''
+    parts = resource_name.strip('/').split('/')
+    if len(parts) == 5 and parts[0] == 'projects' and parts[2] == 'global':
+        kind = 'global' + parts[3][0].upper() + parts[3][1:]
+        return {'project': parts[1], 'kind': kind, 'location': 'global', 'name': parts[4]}
+    if len(parts) == 6 and parts[0] == 'projects' and parts[2] in ('regions', 'zones'):
+        return {'project': parts[1], 'kind': parts[4], 'location': parts[3], 'name': parts[5]}
+    return None
+
+
+def parse_event(data):
+    """
+    Reads an event from a Cloud Audit Log entry, as a log sink publishes it to
+    Pub/Sub, or from a plain {"project", "kind", "location", "name"} object.
+    Entries for failed calls, for the start of a long running operation and for
+    methods that cannot expose an address are ignored
+    :return: Dict with the project, kind, location and name, or None
+    """
+    entry = json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+    if 'protoPayload' not in entry:
+        if entry.get('kind') in _METHOD_KINDS.values() and entry.get('project') and entry.get('name'):
+            return dict((key, entry.get(key)) for key in ('project', 'kind', 'location', 'name'))
+        return None
+
+    payload = entry['protoPayload']
+    method = '.'.join(payload.get('methodName', '').split('.')[-2:])
+    if method not in _METHOD_KINDS or payload.get('status', {}).get('code', 0):
+        return None
+    operation = entry.get('operation', {})
+    if operation.get('first') and not operation.get('last'):
+        return None
+    event = _resource_event(payload.get('resourceName', ''))
+    if event is None or event['kind'] != _METHOD_KINDS[method]:
+        return None
+    return event
+
+
+class _Message(object):
+    def __init__(self, data, ack=None, nack=None):
+        self.data = data
+        self._ack = ack
+        self._nack = nack
+
+    def ack(self):
+        if self._ack is not None:
+            self._ack()
+
+    def nack(self):
+        if self._nack is not None:
+            self._nack()
+
+
+class QueueSource(object):
+    ''' Delivers messages put on a queue.Queue, for tests and in-process producers,
+        to a handler on the executor's threads. A nacked message is put back on
+        the queue. '''
+
+    def __init__(self, messages=None, workers=EVENT_WORKERS):
+        self.messages = messages if messages is not None else queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='events')
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, handler):
+        self._thread = threading.Thread(target=self._run, args=(handler,), name='event-source')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, handler):
+        while not self._stopped.is_set():
+            try:
+                data = self.messages.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            self.executor.submit(handler, _Message(data, nack=lambda data=data: self.messages.put(data)))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.executor.shutdown(wait=True)
+
+
+class FileSource(QueueSource):
+    ''' Delivers each line appended to a JSONL file, following it like tail -f. '''
+
+    def __init__(self, path, workers=EVENT_WORKERS, poll_interval=POLL_INTERVAL):
+        super(FileSource, self).__init__(workers=workers)
+        self._path = path
+        self._poll_interval = poll_interval
+        self._reader = None
+
+    def start(self, handler):
+        self._reader = threading.Thread(target=self._follow, name='event-file')
+        self._reader.daemon = True
+        self._reader.start()
+        super(FileSource, self).start(handler)
+
+    def _follow(self):
+        offset = os.path.getsize(self._path) if os.path.exists(self._path) else 0
+        while not self._stopped.is_set():
+            try:
+                if os.path.getsize(self._path) < offset:
+                    offset = 0
+                with open(self._path) as events_file:
+                    events_file.seek(offset)
+                    for line in iter(events_file.readline, ''):
+                        if not line.endswith('\n'):
+                            break
+                        offset += len(line.encode('utf-8'))
+                        if line.strip():
+                            self.messages.put(line)
+            except (IOError, OSError):
+                pass
+            self._stopped.wait(self._poll_interval)
+
+    def stop(self):
+        super(FileSource, self).stop()
+        if self._reader is not None:
+            self._reader.join()
+
+
+class PubSubSource(object):
+    ''' Delivers messages from a Pub/Sub subscription over streaming pull, to a
+        handler on the executor's threads. Needs the google-cloud-pubsub package. '''
+
+    def __init__(self, subscription, workers=EVENT_WORKERS):
+        self._subscription = subscription
+        self._workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='events')
+        self._future = None
+
+    def start(self, handler):
+        from google.cloud import pubsub_v1
+        from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+        subscriber = pubsub_v1.SubscriberClient()
+        flow_control = pubsub_v1.types.FlowControl(max_messages=self._workers * 10)
+        self._future = subscriber.subscribe(self._subscription, callback=handler, flow_control=flow_control,
+                                            scheduler=ThreadScheduler(executor=self.executor))
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+        self.executor.shutdown(wait=True)
+
+
+def event_source(spec):
+    ''' Builds a source from pubsub:projects/p/subscriptions/s or file:/path. '''
+    scheme, _, target = spec.partition(':')
+    if scheme == 'pubsub' and target:
+        return PubSubSource(target)
+    elif scheme == 'file' and target:
+        return FileSource(target)
+    raise ValueError('Unknown event source {}, expected pubsub:<subscription> or file:<path>'.format(spec))
+
+
+class EventProcessor(object):
+    """
+    Handles messages from an event source: parses each into an event, drops
+    repeats of an event seen within dedup_window seconds and events for
+    projects out of scope, and passes the rest to remediate. Messages are acked
+    once handled. Messages that arrive before the scope is known are held until
+    it is, and a failed remediation is retried after a backoff up to
+    max_attempts times before its message is acked and left to the sweep. Held
+    messages are not acked, and are nacked for redelivery on close
+    :param in_scope: Callable returning the set of projects in scope, or None
+        while it is not known
+    :param executor: Executor that held messages are handled on again once
+        due, normally the source's; the processor runs its own without one
+    """
+
+    def __init__(self, remediate, in_scope, dedup_window=DEDUP_WINDOW, max_attempts=MAX_ATTEMPTS,
+                 retry_interval=RETRY_INTERVAL, max_retry_interval=MAX_RETRY_INTERVAL, poll_interval=POLL_INTERVAL,
+                 executor=None):
+        self._remediate = remediate
+        self._in_scope = in_scope
+        self._dedup_window = dedup_window
+        self._max_attempts = max_attempts
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._poll_interval = poll_interval
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(
+            max_workers=EVENT_WORKERS, thread_name_prefix='event-retry')
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._held = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.handled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._held)
+
+    def _seen(self, event):
+        key = (event['project'], event['kind'], event['location'], event['name'])
+        now = time.time()
+        with self._lock:
+            if len(self._recent) > 10000:
+                self._recent = dict((k, t) for k, t in self._recent.items() if now - t < self._dedup_window)
+            if now - self._recent.get(key, 0) < self._dedup_window:
+                return True
+            self._recent[key] = now
+        return False
+
+    def _forget(self, event):
+        with self._lock:
+            self._recent.pop((event['project'], event['kind'], event['location'], event['name']), None)
+
+    def __call__(self, message):
+        try:
+            event = parse_event(message.data)
+        except (ValueError, KeyError, AttributeError) as e:
+            _log.warning('Dropping malformed event: %s', e)
+            message.ack()
+            return
+        if event is None:
+            message.ack()
+            return
+        self._handle(message, event, 0)
+
+    def _handle(self, message, event, attempt):
+        scope = self._in_scope()
+        if scope is None:
+            self._hold(message, event, attempt, self._poll_interval)
+            return
+        if event['project'] not in scope or self._seen(event):
+            message.ack()
+            return
+
+        try:
+            self._remediate(event)
+        except Exception as e:
+            self._forget(event)
+            attempt += 1
+            if attempt >= self._max_attempts:
+                _log.error('Remediating %s %s in %s failed %s time(s), leaving it to the next sweep: %s',
+                           event['kind'], event['name'], event['project'], attempt, e)
+                message.ack()
+                return
+            _log.warning('Remediating %s %s in %s failed, trying again: %s', event['kind'], event['name'],
+                         event['project'], e)
+            self._hold(message, event, attempt,
+                       min(self._retry_interval * 2 ** (attempt - 1), self._max_retry_interval))
+            return
+        with self._lock:
+            self.handled += 1
+        message.ack()
+
+    def _hold(self, message, event, attempt, delay):
+        with self._condition:
+            if self._closed:
+                message.nack()
+                return
+            self._held.append({'message': message, 'event': event, 'attempt': attempt,
+                               'not_before': time.time() + delay})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-retry')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def close(self):
+        ''' Stops retrying and nacks the messages still held, for redelivery. '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.time()
+                due = [entry for entry in self._held if entry['not_before'] <= now]
+                while not due and not self._closed:
+                    if self._held:
+                        self._condition.wait(min(entry['not_before'] for entry in self._held) - now)
+                    else:
+                        self._condition.wait()
+                    now = time.time()
+                    due = [entry for entry in self._held if entry['not_before'] <= now]
+                if self._closed:
+                    held, self._held = self._held, []
+                    break
+                self._held = [entry for entry in self._held if entry['not_before'] > now]
+            for entry in due:
+                try:
+                    self._executor.submit(self._handle, entry['message'], entry['event'], entry['attempt'])
+                except RuntimeError:
+                    entry['message'].nack()
+        for entry in held:
+            entry['message'].nack()
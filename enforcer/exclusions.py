@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import deque
+
+_log = logging.getLogger('ip-enforcer.exclusions')
+
+# Exclusions containing any of these are matched as regular expressions, as
+# project_ids_list() has always joined them into one pattern.
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+_CACHE_SIZE = 4
+
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class ExclusionIndex(object):
+    """
+    Matches project ids against a set of exclusions, where a project is excluded
+    if any exclusion occurs anywhere in its id. Literal exclusions are compiled
+    into an Aho-Corasick automaton, so a lookup costs one pass over the project
+    id however many exclusions there are; exclusions using regex syntax are
+    precompiled into a single pattern.
+    """
+
+    def __init__(self, exclusions):
+        literals = set()
+        patterns = []
+        for exclusion in exclusions:
+            exclusion = str(exclusion)
+            if _REGEX_CHARS.intersection(exclusion):
+                patterns.append(exclusion)
+            else:
+                literals.add(exclusion)
+
+        self._match_all = '' in literals
+        self._pattern = re.compile('|'.join(patterns)) if patterns else None
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [False]
+        for literal in literals:
+            self._add(literal)
+        self._link()
+
+    def _add(self, literal):
+        state = 0
+        for char in literal:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(False)
+            state = following
+        self._output[state] = True
+
+    def _link(self):
+        ''' Sets the failure link of every state breadth first, so each state
+            also reports the matches of its longest proper suffix. '''
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                self._output[following] = self._output[following] or self._output[self._fail[following]]
+                queue.append(following)
+
+    def matches(self, project_id):
+        if self._match_all:
+            return True
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for char in project_id:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return self._pattern is not None and self._pattern.search(project_id) is not None
+
+
+def exclusions_digest(exclusions):
+    return hashlib.sha256('\n'.join(str(exclusion) for exclusion in exclusions).encode('utf-8')).hexdigest()
+
+
+def exclusion_index(exclusions, digest=None):
+    """
+    Returns the ExclusionIndex for a set of exclusions, building it only the
+    first time that content is seen
+    :param digest: Content hash of the exclusions, computed if not given
+    :return: ExclusionIndex
+    """
+    if digest is None:
+        digest = exclusions_digest(exclusions)
+    with _index_cache_lock:
+        index = _index_cache.get(digest)
+        if index is None:
+            index = ExclusionIndex(exclusions)
+            if len(_index_cache) >= _CACHE_SIZE:
+                _index_cache.clear()
+            _index_cache[digest] = index
+    return index
+
+
+def parse_exclusions(lines):
+    ''' Yields the first value of each JSON object in a JSONL stream. '''
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield list(json.loads(line).values())[0]
+
+
+def _read_meta(path):
+    try:
+        with open(path + '.meta') as meta_file:
+            return json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _read_cache(path):
+    meta = _read_meta(path)
+    if meta is None:
+        raise IOError('No cached copy of {}'.format(path))
+    with open(path) as data_file:
+        return meta, list(parse_exclusions(data_file))
+
+
+def load_exclusions(bucket, blob_name, cache_dir):
+    """
+    Returns the exclusions held in a JSONL blob, keeping a local copy in
+    cache_dir keyed by the blob's generation and ETag. The blob is only
+    downloaded when either has changed, and is parsed line by line from the
+    local copy. If the bucket cannot be reached the last good copy is used
+    :return: List of exclusions
+    """
+    path = os.path.join(cache_dir, blob_name)
+    try:
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            raise LookupError('Exclusions file {} not found'.format(blob_name))
+        meta = {'generation': blob.generation, 'etag': blob.etag}
+
+        with _loaded_lock:
+            loaded = _loaded.get(path)
+        if loaded is not None and loaded[0] == meta:
+            return list(loaded[1])
+        if _read_meta(path) == meta:
+            with open(path) as data_file:
+                exclusions = list(parse_exclusions(data_file))
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            download = tempfile.NamedTemporaryFile(dir=cache_dir, delete=False)
+            try:
+                with download:
+                    blob.download_to_file(download)
+                with open(download.name) as data_file:
+                    exclusions = list(parse_exclusions(data_file))
+                os.rename(download.name, path)
+            except Exception:
+                os.remove(download.name)
+                raise
+            with open(path + '.meta', 'w') as meta_file:
+                json.dump(meta, meta_file)
+            _log.info('Downloaded exclusions file %s generation %s', blob_name, meta['generation'])
+    except Exception as e:
+        try:
+            meta, exclusions = _read_cache(path)
+        except (IOError, OSError, ValueError):
+            raise e
+        _log.warning('Using cached exclusions file %s generation %s, bucket unavailable: %s',
+                     blob_name, meta['generation'], e)
+
+    with _loaded_lock:
+        _loaded[path] = (meta, exclusions)
+    return list(exclusions)
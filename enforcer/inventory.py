@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ratelimit import execute_request
+
+_log = logging.getLogger('ip-enforcer.inventory')
+
+INVENTORY_TTL = 60 * 60
+FOLDER_WORKERS = 4
+# Folder listings expire within this fraction either side of the ttl, so a
+# large tree is refreshed a few folders at a time rather than all at once.
+TTL_JITTER = 0.2
+
+
+def folder_projects(client, folder_id):
+    ''' Yields the ids of the active projects directly inside a folder, filtered
+        by the Resource Manager API rather than after listing every project. '''
+    for project in client.list_projects({'parent.type': 'folder', 'parent.id': folder_id,
+                                         'lifecycleState': 'ACTIVE'}):
+        yield project.project_id
+
+
+def subfolders(service, folder_id):
+    ''' Yields the ids of the folders directly inside a folder, from a Resource
+        Manager v2 client. '''
+    folders = service.folders()
+    request = folders.list(parent='folders/{}'.format(folder_id))
+    while request is not None:
+        response = execute_request(request)
+        for folder in response.get('folders', []):
+            yield folder['name'].split('/', 1)[1]
+        request = folders.list_next(previous_request=request, previous_response=response)
+
+
+class ProjectInventory(object):
+    """
+    Lists the projects under a folder and all of its subfolders. Folders are
+    listed concurrently and project ids are yielded as each page arrives. Every
+    folder's listing is cached on disk for about ttl seconds, so a sweep only
+    lists the folders whose cached copy has expired and reads the rest from the
+    cache; a folder that cannot be listed falls back to its expired copy.
+    """
+
+    def __init__(self, path, list_projects, list_subfolders, ttl=INVENTORY_TTL, workers=FOLDER_WORKERS):
+        self._path = path
+        self._list_projects = list_projects
+        self._list_subfolders = list_subfolders
+        self._ttl = ttl
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._folders = self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as inventory_file:
+                return json.load(inventory_file)['folders']
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+
+    def save(self):
+        try:
+            directory = os.path.dirname(self._path)
+            os.makedirs(directory, exist_ok=True)
+            with self._lock, tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as inventory_file:
+                json.dump({'folders': self._folders}, inventory_file)
+            os.rename(inventory_file.name, self._path)
+        except (IOError, OSError) as e:
+            _log.warning('Could not save project inventory %s: %s', self._path, e)
+
+    def _cached(self, folder_id, fresh=True):
+        with self._lock:
+            entry = self._folders.get(folder_id)
+        if entry is not None and (not fresh or entry['expires'] > time.time()):
+            return entry
+        return None
+
+    def _visit(self, folder_id, results):
+        ''' Lists one folder onto the results queue: its subfolders first, so
+            they are walked while its projects are still being listed. '''
+        entry = self._cached(folder_id)
+        if entry is not None:
+            for subfolder in entry['subfolders']:
+                results.put(('folder', subfolder))
+            for project_id in entry['projects']:
+                results.put(('project', project_id))
+            results.put(('done', folder_id))
+            return
+
+        sent = set()
+        try:
+            folders = list(self._list_subfolders(folder_id))
+            for subfolder in folders:
+                results.put(('folder', subfolder))
+            projects = []
+            for project_id in self._list_projects(folder_id):
+                projects.append(project_id)
+                sent.add(project_id)
+                results.put(('project', project_id))
+        except Exception as e:
+            entry = self._cached(folder_id, fresh=False)
+            if entry is None:
+                results.put(('error', e))
+                return
+            _log.warning('Could not list folder %s, using its inventory from %.0fs ago: %s',
+                         folder_id, time.time() - entry['listed_at'], e)
+            for subfolder in entry['subfolders']:
+                results.put(('folder', subfolder))
+            for project_id in entry['projects']:
+                if project_id not in sent:
+                    results.put(('project', project_id))
+            results.put(('done', folder_id))
+            return
+
+        now = time.time()
+        with self._lock:
+            self._folders[folder_id] = {'projects': projects, 'subfolders': folders, 'listed_at': now,
+                                        'expires': now + self._ttl * random.uniform(1 - TTL_JITTER, 1 + TTL_JITTER)}
+        results.put(('done', folder_id))
+
+    def projects(self, folder_id):
+        """
+        Walks a folder tree, saving the refreshed inventory once the walk is done
+        :return: Generator of project ids, each yielded once
+        """
+        results = queue.Queue()
+        pool = ThreadPoolExecutor(max_workers=max(1, self._workers), thread_name_prefix='inventory')
+        seen_folders = {folder_id}
+        seen_projects = set()
+        pending = 1
+        try:
+            pool.submit(self._visit, folder_id, results)
+            while pending:
+                kind, value = results.get()
+                if kind == 'project' and value not in seen_projects:
+                    seen_projects.add(value)
+                    yield value
+                elif kind == 'folder' and value not in seen_folders:
+                    seen_folders.add(value)
+                    pending += 1
+                    pool.submit(self._visit, value, results)
+                elif kind == 'done':
+                    pending -= 1
+                elif kind == 'error':
+                    raise value
+        finally:
+            pool.shutdown(wait=False)
+
+        with self._lock:
+            # Forget folders that have left the tree since the last walk
+            for cached in [cached for cached in self._folders if cached not in seen_folders]:
+                del self._folders[cached]
+        self.save()
+        _log.info('Project inventory of folder %s: %s project(s) in %s folder(s).',
+                  folder_id, len(seen_projects), len(seen_folders))
@@ -1,319 +1,1040 @@
+import os
+import argparse
 import time
-import json
-import re
+import socket
 import logging
-import requests
-from sys import stdout
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 from os import environ
-from googleapiclient import discovery
-from google.cloud import storage, resource_manager
-from pprint import pprint
+from audit import configure as configure_logging
+from batching import BatchDispatcher
+from daemon import SweepLock, SweepScheduler
+from events import EventProcessor, event_source
+from discovery_documents import DiscoveryDocumentCache, bundled_document
+from exclusions import exclusion_index, load_exclusions
+from inventory import ProjectInventory, folder_projects, subfolders
+from metrics import SweepProfiler, default_registry, delta, write_summary
+from operations import OperationTracker, wait_for_operation
+from ratelimit import configure as configure_rate_limits, execute_request
+from scheduling import HOT_SCORE, is_due, updated_score
+from sharding import BucketLeaseStore, Shard, read_membership
+from state import StateStore, address_fingerprints, diff_snapshot, external_addresses, fingerprint, \
+    select_due
 
 __METADATA_URL = 'http://metadata.google.internal/computeMetadata/v1/'
 __METADATA_HEADERS = {'Metadata-Flavor': 'Google'}
 __EXCLUSIONS_FILE_NAME = 'exclusion.jsonl'
 __NON_EIM_EXCLUSIONS = ["xpn"]
+__METADATA_TIMEOUT = float(environ.get('IP_ENFORCER_METADATA_TIMEOUT', 2))
+__SCAN_WORKERS = int(environ.get('IP_ENFORCER_SCAN_WORKERS', 8))
+__REMEDIATION_WORKERS = int(environ.get('IP_ENFORCER_REMEDIATION_WORKERS', 4))
+__RETRY_INTERVAL = int(environ.get('IP_ENFORCER_RETRY_INTERVAL', 900))
+__RATE_LIMIT = float(environ.get('IP_ENFORCER_RATE_LIMIT', 20))
+__PROJECT_RATE_LIMIT = float(environ.get('IP_ENFORCER_PROJECT_RATE_LIMIT', 10))
+__LEASE_TTL = int(environ.get('IP_ENFORCER_LEASE_TTL', 900))
+__INVENTORY_TTL = int(environ.get('IP_ENFORCER_INVENTORY_TTL', 3600))
+# Seconds after it started within which an interrupted sweep is resumed rather than started over
+__RESUME_WINDOW = int(environ.get('IP_ENFORCER_RESUME_WINDOW', 3600))
+# Longest a project may go unscanned when sweeps skip projects with a low score; 0 scans every project every sweep
+__MAX_STALENESS = int(environ.get('IP_ENFORCER_MAX_STALENESS', 0))
+__HOT_SCORE = float(environ.get('IP_ENFORCER_HOT_SCORE', HOT_SCORE))
+__METRICS_FILE = environ.get('IP_ENFORCER_METRICS_FILE')
+__SUMMARY_FILE = environ.get('IP_ENFORCER_SUMMARY_FILE')
+# The file config/fluentd/ocean-ip-enforcer.conf tails
+__LOG_FILE = environ.get('IP_ENFORCER_LOG_FILE', '/var/log/ocean-ip-enforcer.log')
+__EXTERNAL_ADDRESS_FILTER = 'addressType = EXTERNAL'
+__ADDRESS_FIELDS = 'items/*/addresses(name,address,status,region,users,addressType),nextPageToken'
+__ADDRESS_LIST_FIELDS = 'items(name,address,status,region,users,addressType),nextPageToken'
+__ADDRESS_GET_FIELDS = 'name,address,status,region,users,addressType'
+__thread_local = threading.local()
+__remediation_pool = None
+__remediation_pool_lock = threading.Lock()
+__function_project_id = None
 
 
 def get_logger(name, log_file, debug=False):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    file_stream = logging.FileHandler(log_file)
+    ''' Sets up the logger and its children to write JSON lines to log_file
+        from a background thread, returning the logger. '''
+    configure_logging(name, log_file, debug)
+    return logging.getLogger(name)
 
-    fmt = logging.Formatter('%(asctime)s [%(threadName)s] '
-                            '[%(name)s] %(levelname)s: %(message)s')
-    file_stream.setFormatter(fmt)
-    logger.addHandler(file_stream)
-    if debug:
-        debug_stream = logging.StreamHandler(stdout)
-        debug_stream.setFormatter(fmt)
-        logger.addHandler(debug_stream)
-        logger.setLevel(logging.DEBUG)
 
-    return logger
-
-
-__log = get_logger(__name__, 'ip-enforcer.log', False)
+__log = logging.getLogger('ip-enforcer')
 
 
 def __get_metadata_path_param(metadata_param):
     ''' Takes parameter to be added to metadata_url path to retrieve either
         a project id (project/project-id) or an instance id (instance/id) '''
+    import requests
+
     url = __METADATA_URL + metadata_param
-    response = requests.get(url, headers=__METADATA_HEADERS)
+    response = requests.get(url, headers=__METADATA_HEADERS, timeout=__METADATA_TIMEOUT)
+    response.raise_for_status()
     return str(response.text)
 
 
-__FUNCTION_PROJECT_ID = __get_metadata_path_param('project/project-id')
+def function_project_id():
+    ''' Returns the project the enforcer is deployed in. Taken from
+        IP_ENFORCER_PROJECT_ID if set, otherwise looked up on the metadata
+        server the first time it is needed. '''
+    global __function_project_id
+    if __function_project_id is None:
+        __function_project_id = environ.get('IP_ENFORCER_PROJECT_ID') or \
+            __get_metadata_path_param('project/project-id')
+    return __function_project_id
 
 
-def exclusions_from_bucket():
+def state_dir():
+    ''' Directory holding the enforcer's local caches and state between runs. '''
+    return environ.get('IP_ENFORCER_STATE_DIR', '/var/lib/ip-enforcer')
+
+
+def exclusions_from_bucket(client=None):
     """
-    Pulls exceptions file from Cloud storage and returns the content as a list of exclusions
+    Pulls exceptions file from Cloud storage and returns the content as a list of exclusions.
+    The file is cached in the state directory and only downloaded again when it changes
+    :param client: Storage client to reuse, a new one is created if not given
     :return: List of JSON
     """
-    client = storage.Client()
-    bucket = client.bucket(__FUNCTION_PROJECT_ID + '-data-files')
-    blob = bucket.get_blob(__EXCLUSIONS_FILE_NAME)
-    blob_as_string = blob.download_as_string()
-    list_of_dicts = blob_as_string.splitlines()
-    list_of_exclusions = []
-    for line in list_of_dicts:
-        line_dict = json.loads(line)
-        values = list(line_dict.values())
-        list_of_exclusions.append(values[0])
+    if client is None:
+        from google.cloud import storage
+        client = storage.Client()
+    bucket = client.bucket(function_project_id() + '-data-files')
+    list_of_exclusions = load_exclusions(bucket, __EXCLUSIONS_FILE_NAME, state_dir())
     list_of_exclusions.extend(__NON_EIM_EXCLUSIONS)
     return list_of_exclusions
 
 
-def project_ids_list(folder_id):
-    projects_to_exclude = exclusions_from_bucket()
-    client = resource_manager.Client()
-    project_filter = {'parent.type': 'folder', 'parent.id': folder_id}
-    projects = list(client.list_projects())
-    project_ids = []
-    for project in projects:
-        if not re.search(r".*({}).*".format("|".join(projects_to_exclude)), project.project_id):
-            project_ids.append(project.project_id)
-    return project_ids
+def project_ids_list(folder_id, client=None, storage_client=None):
+    """
+    Lists the projects in a folder and its subfolders, less the exclusions. The
+    folder tree is walked concurrently and cached in the state directory, so
+    only folders whose cached listing has expired are listed again
+    :return: Generator of project ids, yielded as they are listed
+    """
+    index = exclusion_index(exclusions_from_bucket(storage_client))
+    if client is None:
+        from google.cloud import resource_manager
+        client = resource_manager.Client()
+    inventory = ProjectInventory(os.path.join(state_dir(), 'inventory.json'),
+                                 lambda folder: folder_projects(client, folder),
+                                 lambda folder: subfolders(get_thread_folders_service(), folder),
+                                 __INVENTORY_TTL)
+    for project_id in inventory.projects(folder_id):
+        if not index.matches(project_id):
+            yield project_id
+
+
+def iter_addresses(service, project):
+    """
+    Pages through addresses.aggregatedList for the external addresses of a
+    project. The API applies the addressType filter and returns only the fields
+    the enforcer reads, without the per-scope warnings. Rate limit and
+    transient errors are retried; a page that still fails raises rather than
+    leaving the project half listed
+    :return: Generator of (scope, address) tuples
+    """
+    addresses = service.addresses()
+    request = addresses.aggregatedList(project=project, filter=__EXTERNAL_ADDRESS_FILTER, fields=__ADDRESS_FIELDS)
+
+    while request is not None:
+        response = execute_request(request, project)
+        for scope, addresses_scoped_list in response.get('items', {}).items():
+            for item in addresses_scoped_list.get('addresses', []):
+                yield scope, item
+        request = addresses.aggregatedList_next(previous_request=request, previous_response=response)
 
 
 def get_addresses(service, project):
-    request = service.addresses().aggregatedList(project=project)
+    """
+    Groups the external addresses of a project by scope
+    :return: Dict of scope to AddressesScopedList
+    """
     addresses = {}
+    for scope, item in iter_addresses(service, project):
+        addresses.setdefault(scope, {'addresses': []})['addresses'].append(item)
+    return addresses
 
-    while request is not None:
+
+def event_addresses(service, event):
+    """
+    Looks up the external addresses an insert event concerns: the address
+    itself for an address insert, or for a new instance, forwarding rule or
+    router the external addresses in its region that it uses, so only that one
+    region is listed rather than the whole project
+    :return: Dict of scope to AddressesScopedList, like get_addresses()
+    """
+    project, kind, location, name = event['project'], event['kind'], event['location'], event['name']
+    if kind in ('globalAddresses', 'globalForwardingRules'):
+        scope = 'global'
+    elif kind == 'instances':
+        scope = 'regions/' + location.rsplit('-', 1)[0]
+    else:
+        scope = 'regions/' + location
+
+    if kind in ('addresses', 'globalAddresses'):
+        if scope == 'global':
+            request = service.globalAddresses().get(project=project, address=name, fields=__ADDRESS_GET_FIELDS)
+        else:
+            request = service.addresses().get(project=project, region=location, address=name,
+                                              fields=__ADDRESS_GET_FIELDS)
         try:
-            response = request.execute()
+            items = [execute_request(request, project)]
+        except Exception as e:
+            # Deleted again before the event arrived
+            if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                return {}
+            raise
+    else:
+        if kind == 'instances':
+            resource = '/projects/{}/zones/{}/instances/{}'.format(project, location, name)
+        elif kind == 'globalForwardingRules':
+            resource = '/projects/{}/global/forwardingRules/{}'.format(project, name)
+        else:
+            resource = '/projects/{}/regions/{}/{}/{}'.format(project, location, kind, name)
+        collection = service.globalAddresses() if scope == 'global' else service.addresses()
+        arguments = {'project': project, 'filter': __EXTERNAL_ADDRESS_FILTER, 'fields': __ADDRESS_LIST_FIELDS}
+        if scope != 'global':
+            arguments['region'] = scope.split('/')[1]
+        items = []
+        request = collection.list(**arguments)
+        while request is not None:
+            response = execute_request(request, project)
+            items.extend(item for item in response.get('items', [])
+                         if any(user.endswith(resource) for user in item.get('users', [])))
+            request = collection.list_next(previous_request=request, previous_response=response)
+
+    items = [item for item in items if item.get('addressType') == 'EXTERNAL']
+    return {scope: {'addresses': items}} if items else {}
+
+
+def enforce_event(service, event, tracker=None, dispatcher=None):
+    """
+    Remediates the resource named in an insert event without listing the rest
+    of its project, deleting any external address it holds and the resources
+    using it. Lookups and deletes that fail raise, so the event can be
+    redelivered
+    :return: Dict with the project id, the delete response and any error
+    """
+    result = {'project': event['project'], 'response': None, 'error': None}
+    addresses = event_addresses(service, event)
+    if addresses:
+        __log.info("IP Enforcer remediating %(kind)s %(name)s in %(project)s from an insert event.", event)
+        result['response'], failures = delete_addresses(service, event['project'], addresses, tracker=tracker,
+                                                        dispatcher=dispatcher)
+        if failures:
+            raise RuntimeError('Could not delete {} resource(s) in {}: {}'
+                               .format(len(failures), event['project'], '; '.join(failures)))
+    return result
+
+
+def __consumer_action(project, user, regional):
+    ''' Builds the delete action for a resource using an address from its URL,
+        or returns None when the resource type is not supported. '''
+    location, consumer_type, consumer_name = user.split('/')[-3:]
+    if consumer_type == "forwardingRules" and not regional:
+        kind = 'globalForwardingRules'
+    elif consumer_type in ("forwardingRules", "instances", "routers"):
+        kind = consumer_type
+    else:
+        return None
+    return {'kind': kind, 'project': project, 'location': location, 'name': consumer_name}
+
+
+def plan_remediation(project, addresses):
+    """
+    Turns get_addresses() output into chains of delete actions. The resources
+    using an address (forwarding rule, instance or router) are deleted before
+    the address itself, and addresses sharing a resource land in one chain so
+    that chains are independent of each other.
+    :return: List of chains, each a dependency ordered list of action dicts
+    """
+    chains = []
+    owners = {}
+
+    for scope, scoped_list in addresses.items():
+        location = 'global' if scope == 'global' else scope.split('/', 1)[1]
+        for item in scoped_list.get('addresses', ()):
+            if item['addressType'] != 'EXTERNAL':
+                continue
+            regional = item.get('region')
+            consumers = []
+            if item['status'] == 'IN_USE':
+                consumers = [__consumer_action(project, user, regional) for user in item.get('users', ())]
+                if None in consumers:
+                    __log.error("IP Enforcer: The IP address %s is in use on %s which is not supported.",
+                                item.get('address'), ", ".join(item['users']),
+                                extra={'audit': {'event': 'remediation', 'action': 'skip', 'project': project,
+                                                 'resource': '{}/{}'.format(location, item['name']),
+                                                 'address': item.get('address'), 'outcome': 'unsupported'}})
+                    continue
+            action = {'kind': 'addresses' if regional else 'globalAddresses', 'project': project,
+                      'location': location, 'name': item['name'], 'address': item.get('address'),
+                      'consumers': [consumer['name'] for consumer in consumers]}
+
+            chain = None
+            for consumer in consumers:
+                other = owners.get((consumer['kind'], consumer['location'], consumer['name']))
+                if other is None or other is chain:
+                    continue
+                if chain is None:
+                    chain = other
+                else:
+                    chain['consumers'].update(other['consumers'])
+                    chain['addresses'].extend(other['addresses'])
+                    for key in other['consumers']:
+                        owners[key] = chain
+                    chains.remove(other)
+            if chain is None:
+                chain = {'consumers': OrderedDict(), 'addresses': []}
+                chains.append(chain)
+
+            for consumer in consumers:
+                key = (consumer['kind'], consumer['location'], consumer['name'])
+                chain['consumers'].setdefault(key, consumer)
+                owners[key] = chain
+            chain['addresses'].append(action)
+
+    return [list(chain['consumers'].values()) + chain['addresses'] for chain in chains]
+
+
+def execute_action(service, action, tracker=None):
+    ''' Issues the delete for a single planned action. Deletes of resources
+        using an address are waited on so the address is free afterwards. '''
+    kind = action['kind']
+    project = action['project']
+    location = action['location']
+    name = action['name']
+
+    if kind == 'globalAddresses':
+        return delete_global_address_reservation(service, project, name)
+    elif kind == 'addresses':
+        return delete_address_reservation(service, project, location, name)
+
+    __log.info("IP Enforcer deleting resource %s from %s.", name, project)
+    if kind == 'globalForwardingRules':
+        operation = delete_global_forwarding_rule(service, project, name)
+        return wait_for_global_operation(service, project, operation['name'], tracker)
+    elif kind == 'forwardingRules':
+        operation = delete_regional_forwarding_rule(service, project, location, name)
+        return wait_for_regional_operation(service, project, location, operation['name'], tracker)
+    elif kind == 'instances':
+        operation = delete_compute_instance(service, project, location, name)
+        return wait_for_zonal_operation(service, project, location, operation['name'], tracker)
+    elif kind == 'routers':
+        operation = delete_cloud_router(service, project, location, name)
+        return wait_for_regional_operation(service, project, location, operation['name'], tracker)
+    raise ValueError('Unsupported action {}'.format(kind))
+
+
+def delete_request(service, action):
+    ''' Builds, without executing, the delete request for a planned action. '''
+    kind = action['kind']
+    project = action['project']
+    location = action['location']
+    name = action['name']
+
+    if kind == 'globalAddresses':
+        return service.globalAddresses().delete(project=project, address=name)
+    elif kind == 'addresses':
+        return service.addresses().delete(project=project, region=location, address=name)
+    elif kind == 'globalForwardingRules':
+        return service.globalForwardingRules().delete(project=project, forwardingRule=name)
+    elif kind == 'forwardingRules':
+        return service.forwardingRules().delete(project=project, region=location, forwardingRule=name)
+    elif kind == 'instances':
+        return service.instances().delete(project=project, zone=location, instance=name)
+    elif kind == 'routers':
+        return service.routers().delete(project=project, region=location, router=name)
+    raise ValueError('Unsupported action {}'.format(kind))
+
+
+def __audit(action, outcome, started, error=None):
+    ''' Builds the structured audit event logged with the outcome of a delete. '''
+    event = {'event': 'remediation', 'action': 'delete', 'project': action['project'],
+             'resource': '{}/{}/{}'.format(action['kind'], action['location'], action['name']),
+             'address': action.get('address'), 'outcome': outcome, 'duration': round(time.time() - started, 3)}
+    if error is not None:
+        event['error'] = str(error)
+    return {'audit': event}
+
+
+def __log_deleted(action, started):
+    if action['kind'] not in ('addresses', 'globalAddresses'):
+        __log.info("IP Enforcer deleted resource %s from %s.", action['name'], action['project'],
+                   extra=__audit(action, 'deleted', started))
+    elif action['consumers']:
+        __log.warning("IP Enforcer deleted IP address %s and attached resource %s from %s",
+                      action['address'], ", ".join(action['consumers']), action['project'],
+                      extra=__audit(action, 'deleted', started))
+    else:
+        __log.warning('IP Enforcer deleted IP address %s from %s', action['address'], action['project'],
+                      extra=__audit(action, 'deleted', started))
+
+
+def __log_failed(action, started, error):
+    ''' Logs a failed delete, returning it as a failure message for the run summary. '''
+    __log.error("IP Enforcer could not delete %s %s from %s: %s", action['kind'], action['name'], action['project'],
+                error, extra=__audit(action, 'failed', started, error))
+    return '{} {}: {}'.format(action['kind'], action['name'], error)
 
-            for name, addresses_scoped_list in response['items'].items():
-                value = {k: v for (k, v) in addresses_scoped_list.items() if k == "addresses"}
-                if value:
-                    addresses[name] = addresses_scoped_list
 
-            request = service.addresses().aggregatedList_next(previous_request=request, previous_response=response)
+def __merge_results(results):
+    ''' Joins the (responses, failures) pairs of several chains into one. '''
+    responses, failures = [], []
+    for chain_responses, chain_failures in results:
+        responses.extend(chain_responses)
+        failures.extend(chain_failures)
+    return responses, failures
+
+
+def execute_chain(service, chain, tracker=None):
+    """
+    Runs the actions of one chain in order, stopping at the first failure since
+    the addresses further down the chain are still in use
+    :return: Tuple of the list of address delete responses and the list of
+        failed deletes
+    """
+    responses = []
+    for action in chain:
+        started = time.time()
+        try:
+            response = execute_action(service, action, tracker)
+        except Exception as e:
+            return responses, [__log_failed(action, started, e)]
+
+        __log_deleted(action, started)
+        if action['kind'] in ('addresses', 'globalAddresses'):
+            responses.append(response)
+    return responses, []
+
+
+def __advance_chain(chain, responses, dispatcher, tracker, future):
+    ''' Submits the next action of a chain to the dispatcher and schedules the
+        rest of the chain from the completion callbacks, so no thread is held
+        while deletes and operations are in flight. Whatever fails along the way
+        resolves the chain's future with the failure. '''
+    if not chain:
+        future.set_result((responses, []))
+        return
+    action = chain[0]
+    started = time.time()
+
+    def finished(result):
+        try:
+            result.result()
+            __log_deleted(action, started)
         except Exception as e:
-            __log.error(e)
+            future.set_result((responses, [__log_failed(action, started, e)]))
             return
+        __advance_chain(chain[1:], responses, dispatcher, tracker, future)
 
-    return addresses
+    def deleted(result):
+        kind = action['kind']
+        try:
+            response = result.result()
+            if kind in ('addresses', 'globalAddresses'):
+                __log_deleted(action, started)
+                responses.append(response)
+            elif kind == 'instances':
+                tracker.track(action['project'], response['name'], zone=action['location']).add_done_callback(finished)
+            elif kind == 'globalForwardingRules':
+                tracker.track(action['project'], response['name']).add_done_callback(finished)
+            else:
+                tracker.track(action['project'], response['name'],
+                              region=action['location']).add_done_callback(finished)
+        except Exception as e:
+            future.set_result((responses, [__log_failed(action, started, e)]))
+            return
+        if kind in ('addresses', 'globalAddresses'):
+            __advance_chain(chain[1:], responses, dispatcher, tracker, future)
 
+    if action['kind'] not in ('addresses', 'globalAddresses'):
+        __log.info("IP Enforcer deleting resource %s from %s.", action['name'], action['project'])
+    try:
+        submitted = dispatcher.submit(lambda service: delete_request(service, action))
+    except Exception as e:
+        future.set_result((responses, [__log_failed(action, started, e)]))
+        return
+    submitted.add_done_callback(deleted)
 
-def delete_addresses(service, project, addresses):
-    for k, v in addresses.items():
 
-        if k == "global":
-            region = k
-        else:
-            region = k.split('/')[1]
-
-        for item in v['addresses']:
-            if item['addressType'] == "EXTERNAL":
-
-                status = item['status']
-                regional = item.get('region')
-                address = item["address"]
-                name = item['name']
-
-                if status == "IN_USE":
-                    zone = item["users"][0].split('/')[-3]
-                    consumer_type = item["users"][0].split('/')[-2]
-                    consumer_name = item["users"][0].split('/')[-1]
-
-                if status == "RESERVED" and not regional:
-                    __log.info("IP Enforcer deleting IP address {} from {} global reservation.".format(address, project))
-                    try:
-                        response = delete_global_address_reservation(service, project, name)
-                        _log.warning('IP Enforcer deleted IP address {} from {}'.format(address, project))
-                        return response
-                    except Exception as e:
-                        __log.error(e)
-
-                elif status == "RESERVED" and regional:
-                    __log.info("IP Enforcer deleting IP address {} from {}".format(address, project))
-                    try:
-                        # delete_address_reservation(service, project, region, name)
-                        response = service.addresses().delete(project=project, region=region, address=address).execute()
-                        _log.warning('IP Enforcer deleted IP address {} from {}'.format(address, project))
-                        return response
-                    except Exception as e:
-                        __log.error(e)
-
-                elif status == "IN_USE" and consumer_type == "forwardingRules":
-                    if not regional:
-                        try:
-                            __log.info("IP Enforcer deleting resource {} from {}.".format(consumer_name, project))
-                            operation = delete_global_forwarding_rule(service, project, consumer_name)
-                            wait_for_global_operation(service, project, operation['name'])
-                            response = delete_global_address_reservation(service, project, name)
-                            # TODO: Need if success then log success message (for each case below)
-                            __log.warning("IP Enforcer deleted IP address {} and "
-                                          "attached resource {} from {}".format(address, consumer_name, project))
-                            return response
-                        except Exception as e:
-                            __log.error(e)
-                    else:
-                        try:
-                            __log.info("IP Enforcer deleting resource {} from {}.".format(consumer_name, project))
-                            operation = delete_regional_forwarding_rule(service, project, zone, consumer_name)
-                            wait_for_regional_operation(service, project, zone, operation['name'])
-                            response = delete_address_reservation(service, project, region, item['name'])
-                            __log.warning("IP Enforcer deleted IP address {} and attached resource {} from {}"
-                                          .format(address, consumer_name, project))
-                            return response
-                        except Exception as e:
-                            __log.error(e)
-
-                # TODO: Add functionality for instance groups.
-                elif status == "IN_USE" and consumer_type == "instances":
-                    try:
-                        __log.info("IP Enforcer deleting resource {} from {}.".format(consumer_name, project))
-                        operation = delete_compute_instance(service, project, zone, consumer_name)
-                        wait_for_zonal_operation(service, project, zone, operation['name'])
-                        response = delete_address_reservation(service, project, region, item['name'])
-                        __log.warning("IP Enforcer deleted IP address {} and attached resource {} from {}"
-                                      .format(address, consumer_name, project))
-                        return response
-                    except Exception as e:
-                        __log.error(e)
-
-                elif status == "IN_USE" and consumer_type == "routers":
-                    try:
-                        __log.info("IP Enforcer deleting resource {} from {}.".format(consumer_name, project))
-                        operation = delete_cloud_router(service, project, zone, consumer_name)
-                        wait_for_regional_operation(service, project, zone, operation['name'])
-                        response = delete_address_reservation(service, project, region, item['name'])
-                        __log.warning("IP Enforcer deleted IP address {} and attached resource {} from {}"
-                                      .format(address, consumer_name, project))
-                        return response
-                    except Exception as e:
-                        __log.error(e)
+def execute_plan_batched(plan, dispatcher, tracker):
+    """
+    Executes every chain of a remediation plan at once. Deletes go through the
+    BatchDispatcher, so the first actions of all chains share batch requests,
+    and each chain moves on as soon as the tracker reports its operation DONE
+    :return: Tuple of the list of address delete responses and the list of
+        failed deletes
+    """
+    futures = []
+    for chain in plan:
+        future = Future()
+        __advance_chain(chain, [], dispatcher, tracker, future)
+        futures.append(future)
+    return __merge_results(future.result() for future in futures)
 
-                else:
-                    __log.error(
-                        "IP Enforcer: The IP address {} is in use on {} which is not supported.".format(address, zone))
-                return response
+
+def __get_remediation_pool():
+    global __remediation_pool
+    with __remediation_pool_lock:
+        if __remediation_pool is None:
+            __remediation_pool = ThreadPoolExecutor(max_workers=__REMEDIATION_WORKERS,
+                                                    thread_name_prefix='remediate')
+    return __remediation_pool
+
+
+def execute_plan(service, plan, service_factory=None, tracker=None, dispatcher=None):
+    """
+    Executes the chains of a remediation plan. With a dispatcher and tracker the
+    chains are driven through batched requests; with a service_factory they run
+    concurrently on the shared remediation pool, each worker using the client
+    the factory returns; otherwise they run in turn on the given service.
+    :return: Tuple of the list of address delete responses and the list of
+        failed deletes
+    """
+    if dispatcher is not None and tracker is not None:
+        return execute_plan_batched(plan, dispatcher, tracker)
+    if service_factory is None or len(plan) < 2:
+        return __merge_results(execute_chain(service, chain, tracker) for chain in plan)
+
+    pool = __get_remediation_pool()
+    futures = [pool.submit(lambda c: execute_chain(service_factory(), c, tracker), chain) for chain in plan]
+    return __merge_results(future.result() for future in futures)
+
+
+def delete_addresses(service, project, addresses, service_factory=None, tracker=None, dispatcher=None):
+    """
+    Plans and executes the deletion of every external address in a project,
+    along with the resources using them
+    :return: Tuple of the list of address delete responses and the list of
+        failed deletes
+    """
+    plan = plan_remediation(project, addresses)
+    __log.info("IP Enforcer planned %s delete chain(s) in %s.", len(plan), project)
+    return execute_plan(service, plan, service_factory, tracker, dispatcher)
 
 
 # TODO: Each delete should be carried out in a try / except with logging.
 def delete_address_reservation(service, project, region, address):
-    return service.addresses().delete(
+    return execute_request(service.addresses().delete(
         project=project,
         region=region,
-        address=address).execute()
+        address=address), project)
 
 
 def delete_global_address_reservation(service, project, address):
-    return service.globalAddresses().delete(
+    return execute_request(service.globalAddresses().delete(
         project=project,
-        address=address).execute()
+        address=address), project)
 
 
 def delete_cloud_router(service, project, region, router):
-    return service.routers().delete(
+    return execute_request(service.routers().delete(
         project=project,
         region=region,
-        router=router).execute()
+        router=router), project)
 
 
 def delete_compute_instance(service, project, zone, name):
-    return service.instances().delete(
+    return execute_request(service.instances().delete(
         project=project,
         zone=zone,
-        instance=name).execute()
+        instance=name), project)
 
 
 def delete_global_forwarding_rule(service, project, name):
-    return service.globalForwardingRules().delete(
+    return execute_request(service.globalForwardingRules().delete(
         project=project,
-        forwardingRule=name).execute()
+        forwardingRule=name), project)
 
 
-def delete_regional_forwarding_rule(service, project, zone, name):
-    return service.forwardingRules().delete(
+def delete_regional_forwarding_rule(service, project, region, name):
+    return execute_request(service.forwardingRules().delete(
         project=project,
-        zone=zone,
-        forwardingRule=name).execute()
+        region=region,
+        forwardingRule=name), project)
 
 
-def wait_for_zonal_operation(service, project, zone, operation):
+def wait_for_zonal_operation(service, project, zone, operation, tracker=None):
     __log.info('IP Enforcer waiting for zonal operation to finish...')
-    while True:
-        result = service.zoneOperations().get(
-            project=project,
-            zone=zone,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            __log.info("done.")
-            if 'error' in result:
-                __log.error(result['error'])
-                raise Exception(result['error'])
-            return result
-
-        time.sleep(1)
+    if tracker is not None:
+        return tracker.track(project, operation, zone=zone).result()
+    return wait_for_operation(service, project, operation, zone=zone)
 
 
-def wait_for_regional_operation(service, project, region, operation):
+def wait_for_regional_operation(service, project, region, operation, tracker=None):
     __log.info('IP Enforcer waiting for regional operation to finish...')
-    while True:
-        result = service.regionOperations().get(
-            project=project,
-            region=region,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            __log.info("done.")
-            if 'error' in result:
-                __log.error(result['error'])
-                raise Exception(result['error'])
-            return result
+    if tracker is not None:
+        return tracker.track(project, operation, region=region).result()
+    return wait_for_operation(service, project, operation, region=region)
 
-        time.sleep(1)
 
-
-def wait_for_global_operation(service, project, operation):
+def wait_for_global_operation(service, project, operation, tracker=None):
     __log.info('IP Enforcer waiting for global operation to finish...')
-    while True:
-        result = service.globalOperations().get(
-            project=project,
-            operation=operation).execute()
-
-        if result['status'] == 'DONE':
-            __log.info("done.")
-            if 'error' in result:
-                __log.error(result['error'])
-                raise Exception(result['error'])
+    if tracker is not None:
+        return tracker.track(project, operation).result()
+    return wait_for_operation(service, project, operation)
+
+
+def build_compute_service(credentials=None):
+    ''' Builds a compute client from the discovery document shipped with the
+        image, or else from one cached in the state directory for a day, so
+        the document is not downloaded for every client. '''
+    from googleapiclient import discovery
+
+    document = bundled_document()
+    if document is not None:
+        return discovery.build_from_document(document, credentials=credentials)
+    return discovery.build('compute', 'v1', credentials=credentials,
+                           cache=DiscoveryDocumentCache(os.path.join(state_dir(), 'discovery')))
+
+
+def get_thread_folders_service():
+    ''' Returns the Resource Manager v2 client owned by the calling thread, for
+        listing folders. '''
+    service = getattr(__thread_local, 'folders_service', None)
+    if service is None:
+        from googleapiclient import discovery
+        service = discovery.build('cloudresourcemanager', 'v2',
+                                  cache=DiscoveryDocumentCache(os.path.join(state_dir(), 'discovery')))
+        __thread_local.folders_service = service
+    return service
+
+
+def get_thread_service():
+    ''' Returns the compute client owned by the calling thread, building it on
+        first use. The httplib2 transport behind discovery.build is not
+        thread-safe, so clients are never shared between scan workers. '''
+    service = getattr(__thread_local, 'service', None)
+    if service is None:
+        service = build_compute_service()
+        __thread_local.service = service
+    return service
+
+
+def __incremental_addresses(store, project, addresses, result):
+    ''' Narrows a project's addresses to those due for remediation according
+        to its last snapshot. Returns None when the project is unchanged, along
+        with the snapshot to record once remediation has run. '''
+    external = external_addresses(addresses)
+    current = address_fingerprints(external)
+    project_fingerprint = fingerprint(sorted(current.items()))
+    now = time.time()
+
+    last = store.project(project)
+    if last is not None and last['fingerprint'] == project_fingerprint and \
+            (last['retry_at'] is None or last['retry_at'] > now):
+        result['delta'] = {'new': 0, 'changed': 0, 'removed': 0, 'unchanged': len(current)}
+        return None, None
+
+    previous = store.addresses(project) if last is not None else {}
+    delta = diff_snapshot(previous, current)
+    result['delta'] = dict((k, len(v)) for k, v in delta.items())
+    if delta['new'] or delta['changed'] or delta['removed']:
+        __log.info("IP Enforcer found %s new, %s changed and %s removed external address(es) in %s.",
+                   len(delta['new']), len(delta['changed']), len(delta['removed']), project)
+
+    due, snapshot = select_due(previous, current, now, __RETRY_INTERVAL)
+    selected = {}
+    for key in due:
+        scope, item = external[key]
+        selected.setdefault(scope, {'addresses': []})['addresses'].append(item)
+    return selected, (project_fingerprint, snapshot)
+
+
+def enforce_project(service, project, tracker=None, dispatcher=None, store=None):
+    """
+    Lists the addresses of a single project and remediates any external ones.
+    With a StateStore only addresses that are new, changed or due a retry since
+    the last snapshot are remediated, and unchanged projects are skipped
+    :return: Dict with the project id, the delete response, any error, which
+        includes deletes that failed, and the delta against the last snapshot
+    """
+    result = {'project': project, 'response': None, 'error': None, 'unchanged': False, 'delta': None}
+    if tracker is not None:
+        # Deletes still in flight in the project, such as those re-attached from an interrupted run, finish
+        # before its addresses are listed, so the resources they delete are not deleted again
+        wait(tracker.pending(project))
+    try:
+        addresses = get_addresses(service, project)
+    except Exception as e:
+        __log.error('Unable to list addresses in %s: %s', project, e)
+        result['error'] = 'Unable to list addresses in {}: {}'.format(project, e)
+        return result
+
+    snapshot = None
+    if store is not None:
+        addresses, snapshot = __incremental_addresses(store, project, addresses, result)
+        if snapshot is None:
+            result['unchanged'] = True
+            store.touch(project)
             return result
 
-        time.sleep(1)
-
-
-def main():
-    service = discovery.build('compute', 'v1', cache_discovery=False, credentials=None)
-
-    __log.info("Starting IP Enforcer...")
+    failures = []
+    if addresses:
+        result['response'], failures = delete_addresses(service, project, addresses,
+                                                        service_factory=get_thread_service, tracker=tracker,
+                                                        dispatcher=dispatcher)
+    else:
+        __log.info("No external addresses found in %s.", project)
+    if failures:
+        result['error'] = 'Could not delete {} resource(s) in {}: {}'.format(len(failures), project,
+                                                                             '; '.join(failures))
+
+    if snapshot is not None:
+        outcome = 'clean' if not addresses else 'remediated' if result['response'] and not failures else 'failed'
+        store.record(project, snapshot[0], snapshot[1], outcome, __RETRY_INTERVAL)
+    return result
+
+
+def __log_reattached(operation, future):
+    try:
+        result = future.result()
+    except Exception as e:
+        __log.error("IP Enforcer operation %s in %s, left in flight by an interrupted run, failed: %s",
+                    operation['operation'], operation['project'], e)
+        return
+    audit = {'event': 'remediation', 'action': 'delete', 'project': operation['project'],
+             'operation': operation['operation'], 'outcome': 'deleted'}
+    if result.get('targetLink'):
+        location, collection, name = result['targetLink'].split('/')[-3:]
+        audit['resource'] = '{}/{}/{}'.format(collection, location, name)
+    __log.info("IP Enforcer operation %s in %s, left in flight by an interrupted run, finished.",
+               operation['operation'], operation['project'], extra={'audit': audit})
+
+
+def __reattach_operations(tracker):
+    ''' Polls again the operations an interrupted run left in flight, instead
+        of the sweep issuing their deletes a second time. '''
+    for operation, future in tracker.reattach():
+        __log.info("IP Enforcer re-attaching to operation %s in %s.", operation['operation'], operation['project'])
+        future.add_done_callback(lambda done, operation=operation: __log_reattached(operation, done))
+
+
+def __update_score(store, result):
+    ''' Adds what a scan found to the project's score: a violation when it had
+        external addresses to remediate, and the addresses that changed. '''
+    delta = result['delta'] or {}
+    violations, churn = updated_score(store.score(result['project']), result['response'] is not None,
+                                      delta.get('new', 0) + delta.get('changed', 0) + delta.get('removed', 0),
+                                      time.time())
+    store.record_score(result['project'], violations, churn)
+
+
+def scan_projects(projects, workers=__SCAN_WORKERS, store=None, tracker=None, dispatcher=None, pool=None,
+                  profiler=None, sweep=None):
+    """
+    Fans enforce_project out across projects on a bounded pool of workers, each
+    with its own compute client, and merges the per-project results. Deletes
+    from every project share one BatchDispatcher and their operations are
+    polled by one shared OperationTracker. The tracker, dispatcher and pool are
+    created for this scan unless long-lived ones are passed in. With a
+    StateStore, operations it journalled as in flight are re-attached first,
+    every project's score is updated from its scan, and with a sweep id every
+    project enforced without an error is checkpointed in it. With a
+    SweepProfiler every project's scan is profiled
+    :return: Run summary dict
+    """
+    summary = {'projects': 0, 'remediated': [], 'clean': [], 'unchanged': [], 'errors': {}, 'durations': {},
+               'delta': {'new': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}}
+    registry = default_registry()
 
-    if __FUNCTION_PROJECT_ID == 'gcp-core-team':
+    def scan(project):
+        started = time.time()
+        try:
+            return enforce_project(get_thread_service(), project, tracker, dispatcher, store)
+        finally:
+            seconds = time.time() - started
+            summary['durations'][project] = round(seconds, 3)
+            registry.observe('project_sweep_duration_seconds', seconds)
+
+    if profiler is not None:
+        scan = profiler.wrap(scan)
+
+    with ExitStack() as stack:
+        if tracker is None:
+            tracker = stack.enter_context(OperationTracker(build_compute_service, journal=store))
+        if dispatcher is None:
+            dispatcher = stack.enter_context(BatchDispatcher(build_compute_service))
+        __reattach_operations(tracker)
+        if pool is None:
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='scan'))
+
+        futures = {pool.submit(scan, project): project for project in projects}
+        for future in as_completed(futures):
+            project = futures[future]
+            summary['projects'] += 1
+            try:
+                result = future.result()
+            except Exception as e:
+                __log.error("IP Enforcer failed to scan %s: %s", project, e)
+                summary['errors'][project] = str(e)
+                continue
+
+            for k, v in (result['delta'] or {}).items():
+                summary['delta'][k] += v
+            if store is not None and result['delta'] is not None:
+                __update_score(store, result)
+            if result['error']:
+                summary['errors'][project] = result['error']
+                continue
+            # Only projects enforced without an error are skipped if this sweep is resumed
+            if sweep is not None:
+                store.finish_project(sweep, project)
+            if result['unchanged']:
+                summary['unchanged'].append(project)
+            elif result['response']:
+                summary['remediated'].append(project)
+            else:
+                summary['clean'].append(project)
+
+    return summary
+
+
+def resolve_projects(resource_client=None, storage_client=None):
+    ''' Returns the projects to enforce for the project the enforcer is deployed in. '''
+    deployment_project_id = function_project_id()
+    if deployment_project_id == 'gcp-core-team':
         projects = [ "gcp-core-team-test" ]
-    elif __FUNCTION_PROJECT_ID == 'gcp-core-team':
+    elif deployment_project_id == 'gcp-core-team':
         folder_id = "123456789"
-        projects = project_ids_list(folder_id)
-    elif __FUNCTION_PROJECT_ID == 'hsbc-6320774-enforcer-prod':
+        projects = project_ids_list(folder_id, resource_client, storage_client)
+    elif deployment_project_id == 'hsbc-6320774-enforcer-prod':
         folder_id = "123456789"
-        projects = project_ids_list(folder_id)
+        projects = project_ids_list(folder_id, resource_client, storage_client)
     else:
-        __log.error(__FUNCTION_PROJECT_ID + ' is not a valid deployment project')
-        raise ValueError(__FUNCTION_PROJECT_ID + ' is not a valid deployment project')
+        __log.error('%s is not a valid deployment project', deployment_project_id)
+        raise ValueError(deployment_project_id + ' is not a valid deployment project')
+    return projects
+
+
+def build_shard(args, storage_client=None):
+    """
+    Builds the Shard this instance sweeps from --shard-index/--shard-count or a
+    membership file, with its lease kept in the deployment project's data bucket
+    :return: Shard, or None when the instance sweeps every project
+    """
+    if args.membership_file:
+        members = read_membership(args.membership_file)
+        member = args.shard_name
+    elif args.shard_count:
+        members = ['shard-{}'.format(index) for index in range(args.shard_count)]
+        member = members[args.shard_index]
+    else:
+        return None
+
+    if storage_client is None:
+        from google.cloud import storage
+        storage_client = storage.Client()
+    leases = BucketLeaseStore(storage_client.bucket(function_project_id() + '-data-files'))
+    return Shard(member, members, leases, args.lease_ttl)
 
+
+def __record_scope(projects, scope):
+    ''' Passes projects through, storing every one of them in scope['projects']
+        once the listing is complete. '''
+    listed = set()
     for project in projects:
-        addresses = get_addresses(service, project)
-        if addresses:
-            delete_addresses(service, project, addresses)
+        listed.add(project)
+        yield project
+    scope['projects'] = frozenset(listed)
+
+
+def __due_projects(projects, store, deferred):
+    ''' Passes through the projects due a scan this sweep according to their
+        score and last scan, counting the others in deferred['projects']. '''
+    now = time.time()
+    history = store.schedule()
+    for project in projects:
+        if is_due(history.get(project), now, __MAX_STALENESS, __HOT_SCORE):
+            yield project
         else:
-            __log.info("No external addresses found in {}.".format(project))
+            deferred['projects'] += 1
+
+
+def __write_run(summary, started, before):
+    ''' Records a finished sweep in the metrics, then writes them out as an
+        OpenMetrics textfile and the run summary, with what this run added to
+        the metrics, as JSON. '''
+    registry = default_registry()
+    finished = time.time()
+    registry.inc('sweeps', result='failure' if summary['errors'] else 'success')
+    registry.set('sweep_duration_seconds', finished - started)
+    registry.set('last_sweep_timestamp_seconds', finished)
+    for outcome in ('remediated', 'clean', 'unchanged', 'errors'):
+        registry.set('sweep_projects', len(summary[outcome]), outcome=outcome)
+    registry.set('sweep_projects', summary['deferred'], outcome='deferred')
+
+    summary['started_at'] = started
+    summary['seconds'] = round(finished - started, 3)
+    summary['metrics'] = delta(registry.snapshot(), before)
+    registry.write_textfile(__METRICS_FILE or os.path.join(state_dir(), 'ip-enforcer.prom'))
+    write_summary(__SUMMARY_FILE or os.path.join(state_dir(), 'last-run.json'), summary)
+
+
+def run_sweep(store, resource_client=None, storage_client=None, shard=None, scope=None, profiler=None, **kwargs):
+    """
+    Runs one sweep over every project in scope, or this shard's share of them,
+    logs its summary and writes its metrics. When a scope dict is given, the
+    full set of projects in scope is kept in it for the event processor. With a
+    SweepProfiler the sweep is profiled on its own thread and on every thread
+    that scans a project. A sweep that was interrupted less than the resume
+    window ago carries on from its checkpoint, and a lock file in the state
+    directory keeps a second process from sweeping at the same time. Extra
+    keyword arguments are passed on to scan_projects
+    :return: Run summary dict, or None if another process is already sweeping
+    """
+    lock = SweepLock(os.path.join(state_dir(), 'sweep.lock'))
+    if not lock.acquire():
+        __log.warning("IP Enforcer sweep already running in process %s, not starting another.", lock.holder())
+        return None
+    try:
+        return __profiled_sweep(store, resource_client, storage_client, shard, scope, profiler, **kwargs)
+    finally:
+        lock.release()
+
+
+def __profiled_sweep(store, resource_client, storage_client, shard, scope, profiler, **kwargs):
+    if profiler is None:
+        return __sweep(store, resource_client, storage_client, shard, scope, **kwargs)
+    try:
+        return profiler.wrap(__sweep)(store, resource_client, storage_client, shard, scope, profiler=profiler,
+                                      **kwargs)
+    finally:
+        profiler.dump()
+
+
+def __sweep(store, resource_client, storage_client, shard, scope, **kwargs):
+    __log.info("Starting IP Enforcer...")
+    started = time.time()
+    before = default_registry().snapshot()
+    projects = resolve_projects(resource_client, storage_client)
+    if scope is not None:
+        projects = __record_scope(projects, scope)
+    if shard is not None:
+        projects = shard.assign(projects)
+    checkpoint = store.begin_sweep(__RESUME_WINDOW) if store is not None else None
+    if checkpoint is not None and checkpoint['done']:
+        __log.info("IP Enforcer resuming the sweep started at %s, %s project(s) already done.",
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(checkpoint['started_at'])),
+                   len(checkpoint['done']))
+        projects = (project for project in projects if project not in checkpoint['done'])
+    deferred = {'projects': 0}
+    if store is not None and __MAX_STALENESS > 0:
+        projects = __due_projects(projects, store, deferred)
+
+    summary = scan_projects(projects, store=store, sweep=checkpoint and checkpoint['id'], **kwargs)
+    summary['resumed'] = len(checkpoint['done']) if checkpoint is not None else 0
+    summary['deferred'] = deferred['projects']
+    if checkpoint is not None:
+        store.finish_sweep(checkpoint['id'])
+    __log.info("IP Enforcer scanned %s project(s): %s remediated, %s clean, %s unchanged, %s failed, "
+               "%s deferred.", summary['projects'], len(summary['remediated']), len(summary['clean']),
+               len(summary['unchanged']), len(summary['errors']), summary['deferred'])
+    __log.info("IP Enforcer delta: %(new)s new, %(changed)s changed, %(removed)s removed, "
+               "%(unchanged)s unchanged external address(es).", summary['delta'])
+    for project, error in sorted(summary['errors'].items()):
+        __log.error("IP Enforcer could not enforce %s: %s", project, error)
+
+    __write_run(summary, started, before)
+    if summary['errors']:
+        __log.error("IP Enforcer FAILURE")
+    else:
+        __log.info("IP Enforcer SUCCESS")
+    return summary
 
-    __log.info("IP Enforcer SUCCESS")
+
+def run_daemon(interval, workers=__SCAN_WORKERS, shard=None, events=None, profile=None):
+    """
+    Sweeps every interval seconds until SIGTERM, keeping the state store, API
+    clients, operation tracker, batch dispatcher and scan workers (and with them
+    their credentials and HTTP connections) alive between sweeps. With an event
+    source, insert events are remediated as they arrive and the sweeps only
+    reconcile whatever the events missed. Events are not split between shards,
+    since each is delivered to just one subscriber. With a profile path the
+    first sweep is profiled into it
+    """
+    __log.info("Starting IP Enforcer daemon, sweeping every %ss...", interval)
+    scope = {'projects': None}
+    profilers = [SweepProfiler(profile)] if profile else []
+    with ExitStack() as stack:
+        store = stack.enter_context(StateStore(os.path.join(state_dir(), 'state.db')))
+        tracker = stack.enter_context(OperationTracker(build_compute_service, journal=store))
+        dispatcher = stack.enter_context(BatchDispatcher(build_compute_service))
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='scan'))
+        from google.cloud import resource_manager, storage
+
+        resource_client = resource_manager.Client()
+        storage_client = storage.Client()
+        if events is not None:
+            source = event_source(events)
+            stack.callback(source.stop)
+            processor = stack.enter_context(EventProcessor(
+                lambda event: enforce_event(get_thread_service(), event, tracker, dispatcher),
+                lambda: scope['projects'], executor=source.executor))
+            source.start(processor)
+            __log.info("IP Enforcer remediating insert events from %s.", events)
+        scheduler = SweepScheduler(lambda: run_sweep(store, resource_client, storage_client, shard, scope,
+                                                     profilers.pop() if profilers else None, tracker=tracker,
+                                                     dispatcher=dispatcher, pool=pool), interval)
+        scheduler.install_signal_handlers()
+        scheduler.run_forever()
+    __log.info("IP Enforcer daemon stopped after %s sweep(s).", scheduler.sweeps)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Removes external IP addresses from projects in scope.')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and sweep on an internal schedule instead of once')
+    parser.add_argument('--interval', type=int, default=int(environ.get('IP_ENFORCER_INTERVAL', 300)),
+                        help='seconds between the start of sweeps in daemon mode (default: 300)')
+    parser.add_argument('--workers', type=int, default=__SCAN_WORKERS,
+                        help='number of projects scanned concurrently')
+    parser.add_argument('--events', default=environ.get('IP_ENFORCER_EVENTS'),
+                        help='in daemon mode, also remediate insert events from pubsub:<subscription> or '
+                             'file:<path>, the sweeps becoming a reconciliation backstop')
+    parser.add_argument('--debug', action='store_true', help='also print log messages to stdout')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='profile a sweep (the first one in daemon mode) with cProfile into a pstats file')
+    parser.add_argument('--shard-index', type=int, help='this instance\'s shard, from 0 to --shard-count - 1')
+    parser.add_argument('--shard-count', type=int, help='number of instances sharing the projects')
+    parser.add_argument('--membership-file',
+                        help='file naming every instance sharing the projects, one per line, instead of a count')
+    parser.add_argument('--shard-name', default=socket.gethostname(),
+                        help='this instance\'s name in the membership file (default: hostname)')
+    parser.add_argument('--lease-ttl', type=int, default=__LEASE_TTL,
+                        help='seconds after its last sweep before a shard\'s projects are taken over (default: 900)')
+    args = parser.parse_args(argv)
+
+    if args.events and not args.daemon:
+        parser.error('--events needs --daemon')
+    if args.events and args.events.split(':', 1)[0] not in ('pubsub', 'file'):
+        parser.error('--events must be pubsub:<subscription> or file:<path>')
+    if args.shard_count is not None and args.membership_file:
+        parser.error('--shard-count and --membership-file are mutually exclusive')
+    if (args.shard_index is None) != (args.shard_count is None):
+        parser.error('--shard-index and --shard-count must be given together')
+    if args.shard_count is not None and not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be between 0 and {}'.format(args.shard_count - 1))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    get_logger('ip-enforcer', __LOG_FILE, args.debug)
+    # Compute API calls per second, shared by every worker and per target project
+    configure_rate_limits(__RATE_LIMIT, __PROJECT_RATE_LIMIT)
+    shard = build_shard(args)
+    if args.daemon:
+        run_daemon(args.interval, args.workers, shard, args.events, args.profile)
+        return
+
+    with StateStore(os.path.join(state_dir(), 'state.db')) as store:
+        run_sweep(store, shard=shard, profiler=SweepProfiler(args.profile) if args.profile else None,
+                  workers=args.workers)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,236 @@
+import os
+import json
+import bisect
+import pstats
+import cProfile
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+_log = logging.getLogger('ip-enforcer.metrics')
+
+PREFIX = 'ip_enforcer'
+# Seconds, from a batched call answered in a few milliseconds to a blocking
+# operations.wait that runs to its limit.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SWEEP_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of counters, gauges and histograms, each family
+    declared once with describe() and sampled per label set. Counters and
+    histograms accumulate for the life of the process; snapshot() and delta()
+    give what one run added.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = OrderedDict()
+        self._samples = {}
+
+    def describe(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self._families:
+                self._families[name] = (kind, help_text, tuple(buckets))
+                self._samples[name] = OrderedDict()
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            samples = self._samples[name]
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._samples[name][self._key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            samples = self._samples[name]
+            histogram = samples.get(key)
+            if histogram is None:
+                histogram = samples[key] = _Histogram(self._families[name][2])
+            histogram.observe(value)
+
+    def snapshot(self):
+        """
+        Copies every sample, keyed by family and then by label string
+        :return: Dict of family to {'type', 'samples'}
+        """
+        snapshot = OrderedDict()
+        with self._lock:
+            for name, (kind, _, bounds) in self._families.items():
+                samples = OrderedDict()
+                for key, value in self._samples[name].items():
+                    label = ','.join('{}={}'.format(k, v) for k, v in key)
+                    if kind == 'histogram':
+                        value = {'buckets': dict(zip([str(bound) for bound in bounds] + ['+Inf'], value.counts)),
+                                 'sum': value.sum, 'count': value.count}
+                    samples[label] = value
+                snapshot[name] = {'type': kind, 'samples': samples}
+        return snapshot
+
+    def openmetrics(self):
+        ''' Renders every family in the OpenMetrics text format. '''
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, bounds) in self._families.items():
+                family = '{}_{}'.format(PREFIX, name)
+                lines.append('# TYPE {} {}'.format(family, kind))
+                lines.append('# HELP {} {}'.format(family, help_text))
+                for key, value in self._samples[name].items():
+                    if kind == 'histogram':
+                        cumulative = 0
+                        for bound, count in zip([repr(float(bound)) for bound in bounds] + ['+Inf'], value.counts):
+                            cumulative += count
+                            lines.append('{}_bucket{} {}'.format(family, _labels(key + (('le', bound),)),
+                                                                 cumulative))
+                        lines.append('{}_sum{} {!r}'.format(family, _labels(key), value.sum))
+                        lines.append('{}_count{} {}'.format(family, _labels(key), value.count))
+                    else:
+                        suffix = '_total' if kind == 'counter' else ''
+                        lines.append('{}{}{} {!r}'.format(family, suffix, _labels(key), value))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        ''' Replaces path with the current metrics, for the node exporter's
+            textfile collector. '''
+        _write_atomic(path, self.openmetrics())
+
+
+def _labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in key) + '}'
+
+
+def _write_atomic(path, text):
+    try:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as output:
+            output.write(text)
+        os.chmod(output.name, 0o644)
+        os.rename(output.name, path)
+    except (IOError, OSError) as e:
+        _log.warning('Could not write %s: %s', path, e)
+
+
+def delta(after, before):
+    ''' Subtracts one snapshot from a later one, leaving gauges at their later
+        value, so a long-lived process can report what a single run did. '''
+    result = OrderedDict()
+    for name, family in after.items():
+        previous = before.get(name, {}).get('samples', {})
+        samples = OrderedDict()
+        for label, value in family['samples'].items():
+            old = previous.get(label)
+            if family['type'] == 'gauge' or old is None:
+                samples[label] = value
+            elif family['type'] == 'histogram':
+                samples[label] = {'buckets': dict((bound, count - old['buckets'][bound])
+                                                  for bound, count in value['buckets'].items()),
+                                  'sum': value['sum'] - old['sum'], 'count': value['count'] - old['count']}
+            else:
+                samples[label] = value - old
+        result[name] = {'type': family['type'], 'samples': samples}
+    return result
+
+
+def write_summary(path, summary):
+    ''' Replaces path with a run summary as JSON. '''
+    _write_atomic(path, json.dumps(summary, indent=2, sort_keys=True, default=str) + '\n')
+
+
+class SweepProfiler(object):
+    """
+    Profiles one sweep with cProfile. cProfile only sees the thread it is
+    enabled on, so every function run through wrap() is profiled on its own
+    thread and the results are merged into a single pstats file by dump().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._profiles.append(profile)
+        return profiled
+
+    def dump(self):
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        _log.info('Sweep profile of %s thread run(s) written to %s', len(profiles), self.path)
+
+
+_registry = Metrics()
+_registry.describe('api_requests', 'counter', 'API calls made, by method and HTTP status.')
+_registry.describe('api_retries', 'counter', 'API calls retried, by method and reason.')
+_registry.describe('api_request_duration_seconds', 'histogram', 'API call latency, by method.')
+_registry.describe('project_sweep_duration_seconds', 'histogram', 'Time to enforce one project.', SWEEP_BUCKETS)
+_registry.describe('sweeps', 'counter', 'Sweeps run, by result.')
+_registry.describe('sweep_duration_seconds', 'gauge', 'Duration of the last sweep.')
+_registry.describe('sweep_projects', 'gauge', 'Projects in the last sweep, by outcome.')
+_registry.describe('last_sweep_timestamp_seconds', 'gauge', 'Unix time the last sweep finished.')
+
+
+def default_registry():
+    return _registry
+
+
+def request_method(request):
+    ''' The API method a googleapiclient request calls, e.g. compute.addresses.delete. '''
+    method = getattr(request, 'methodId', None)
+    return method if isinstance(method, str) else 'unknown'
+
+
+def error_status(error):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    return str(status) if status is not None else 'error'
+
+
+def record_call(method, seconds, status='200', registry=None):
+    registry = registry or _registry
+    registry.inc('api_requests', method=method, code=status)
+    registry.observe('api_request_duration_seconds', seconds, method=method)
+
+
+def record_retry(method, reason, registry=None):
+    (registry or _registry).inc('api_retries', method=method, reason=reason)
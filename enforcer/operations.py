@@ -0,0 +1,251 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future
+from batching import send_batch
+from ratelimit import execute_request
+
+_log = logging.getLogger('ip-enforcer.operations')
+
+DEFAULT_DEADLINE = 600.0
+INITIAL_INTERVAL = 1.0
+MAX_INTERVAL = 16.0
+
+
+class OperationError(Exception):
+    ''' Raised when a compute operation finishes with an error. '''
+
+
+class OperationTimeout(Exception):
+    ''' Raised when a compute operation is not DONE before its deadline. '''
+
+
+def operations_resource(service, zone=None, region=None):
+    ''' Returns the zoneOperations, regionOperations or globalOperations
+        resource for the scope an operation runs in, with its scope argument. '''
+    if zone:
+        return service.zoneOperations(), {'zone': zone}
+    elif region:
+        return service.regionOperations(), {'region': region}
+    return service.globalOperations(), {}
+
+
+def operation_request(service, project, operation, zone=None, region=None):
+    resource, scope = operations_resource(service, zone, region)
+    return resource.get(project=project, operation=operation, **scope)
+
+
+def operation_done(result):
+    ''' Returns True once an operation is DONE, raising OperationError if it
+        finished with an error. '''
+    if result['status'] != 'DONE':
+        return False
+    if 'error' in result:
+        raise OperationError(result['error'])
+    return True
+
+
+def wait_for_operation(service, project, operation, zone=None, region=None, deadline=DEFAULT_DEADLINE):
+    """
+    Blocks the calling thread until a single operation is DONE. Uses the API's
+    blocking operations.wait where the client exposes it, otherwise polls with
+    exponential backoff
+    :return: The finished operation
+    """
+    resource, scope = operations_resource(service, zone, region)
+    blocking = hasattr(resource, 'wait')
+    method = resource.wait if blocking else resource.get
+    expires = time.time() + deadline
+    interval = INITIAL_INTERVAL
+
+    while True:
+        result = execute_request(method(project=project, operation=operation, **scope), project)
+        if operation_done(result):
+            return result
+
+        remaining = expires - time.time()
+        if remaining <= 0:
+            raise OperationTimeout('Operation {} in {} did not finish within {}s'
+                                   .format(operation, project, deadline))
+        if not blocking:
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_INTERVAL)
+
+
+class OperationTracker(object):
+    """
+    Tracks in-flight zone, region and global operations for many callers at
+    once. Callers register an operation with track() and get a future back; a
+    single background thread polls every pending operation, each on its own
+    exponential backoff, sending the polls that fall due together as one batch
+    request, and resolves the future once the operation is DONE, failed or past
+    its deadline. With a journal (a StateStore) every operation is recorded
+    until it has finished, so one left in flight by a run that was killed, or
+    still running at its deadline, can be re-attached with reattach().
+    """
+
+    def __init__(self, service_factory, deadline=DEFAULT_DEADLINE,
+                 initial_interval=INITIAL_INTERVAL, max_interval=MAX_INTERVAL, journal=None):
+        self._service_factory = service_factory
+        self._journal = journal
+        self._deadline = deadline
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending)
+
+    def track(self, project, operation, zone=None, region=None):
+        """
+        Registers an operation to be polled. Registering an operation that is
+        already pending returns the existing future
+        :return: Future resolving to the finished operation
+        """
+        key = (project, zone, region, operation)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('OperationTracker is closed')
+            entry = self._pending.get(key)
+            if entry is None:
+                now = time.time()
+                entry = {'project': project, 'operation': operation, 'zone': zone, 'region': region,
+                         'future': Future(), 'interval': self._initial_interval,
+                         'next_poll': now, 'expires': now + self._deadline}
+                self._pending[key] = entry
+                self._journal_call('add_operation', entry)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='operation-tracker')
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._condition.notify()
+            return entry['future']
+
+    def pending(self, project):
+        ''' Returns the futures of the operations being polled in a project. '''
+        with self._condition:
+            return [entry['future'] for entry in self._pending.values() if entry['project'] == project]
+
+    def reattach(self):
+        """
+        Tracks every operation in the journal that is not already being polled
+        :return: List of (operation, future) pairs, the operation a dict of its
+            project, name, zone and region
+        """
+        if self._journal is None:
+            return []
+        reattached = []
+        for operation in self._journal.operations():
+            key = (operation['project'], operation['zone'], operation['region'], operation['operation'])
+            with self._condition:
+                if key in self._pending:
+                    continue
+            reattached.append((operation, self.track(operation['project'], operation['operation'],
+                                                     operation['zone'], operation['region'])))
+        return reattached
+
+    def close(self):
+        ''' Stops accepting operations and waits for the pending ones to resolve. '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _due(self):
+        with self._condition:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                    continue
+                now = time.time()
+                due = [entry for entry in self._pending.values() if entry['next_poll'] <= now]
+                if due:
+                    return due
+                self._condition.wait(min(entry['next_poll'] for entry in self._pending.values()) - now)
+
+    def _run(self):
+        try:
+            service = self._service_factory()
+        except Exception as e:
+            _log.error('Operation tracker could not build a compute client: %s', e)
+            with self._condition:
+                pending = list(self._pending.values())
+                self._thread = None
+            for entry in pending:
+                self._resolve(entry, error=e)
+            return
+
+        while True:
+            due = self._due()
+            if due is None:
+                return
+            requests = [operation_request(service, entry['project'], entry['operation'], entry['zone'],
+                                          entry['region']) for entry in due]
+            for entry, (result, error) in zip(due, send_batch(service, requests)):
+                if error is not None:
+                    self._failed_poll(entry, error)
+                else:
+                    self._polled(entry, result)
+
+    def _polled(self, entry, result):
+        try:
+            done = operation_done(result)
+        except OperationError as e:
+            self._resolve(entry, error=e)
+            return
+        if done:
+            self._resolve(entry, result=result)
+        else:
+            self._backoff(entry)
+
+    def _failed_poll(self, entry, error):
+        if getattr(getattr(error, 'resp', None), 'status', None) == 404:
+            self._resolve(entry, error=error)
+        else:
+            _log.warning('Polling operation %s in %s failed: %s', entry['operation'], entry['project'], error)
+            self._backoff(entry)
+
+    def _backoff(self, entry):
+        now = time.time()
+        if now >= entry['expires']:
+            self._resolve(entry, error=OperationTimeout('Operation {} in {} did not finish within {}s'
+                                                        .format(entry['operation'], entry['project'],
+                                                                self._deadline)))
+            return
+        with self._condition:
+            entry['next_poll'] = min(now + entry['interval'], entry['expires'])
+            entry['interval'] = min(entry['interval'] * 2, self._max_interval)
+
+    def _journal_call(self, method, entry):
+        if self._journal is None:
+            return
+        try:
+            getattr(self._journal, method)(entry['project'], entry['operation'], entry['zone'], entry['region'])
+        except Exception as e:
+            _log.warning('Could not journal operation %s in %s: %s', entry['operation'], entry['project'], e)
+
+    def _resolve(self, entry, result=None, error=None):
+        with self._condition:
+            self._pending.pop((entry['project'], entry['zone'], entry['region'], entry['operation']), None)
+            # An operation that timed out, or could not be polled, may still be running
+            if error is None or isinstance(error, OperationError) or \
+                    getattr(getattr(error, 'resp', None), 'status', None) == 404:
+                self._journal_call('remove_operation', entry)
+        if error is not None:
+            entry['future'].set_exception(error)
+        else:
+            entry['future'].set_result(result)
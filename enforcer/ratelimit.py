@@ -0,0 +1,208 @@
+import re
+import time
+import random
+import logging
+import threading
+from email.utils import mktime_tz, parsedate_tz
+from metrics import error_status, record_call, record_retry, request_method
+
+_log = logging.getLogger('ip-enforcer.ratelimit')
+
+MAX_RETRIES = 5
+INITIAL_BACKOFF = 1.0
+MAX_BACKOFF = 32.0
+
+# 403 reasons Compute returns when a rate quota, rather than a permission, is exhausted.
+_RATE_LIMIT_REASONS = frozenset(('rateLimitExceeded', 'userRateLimitExceeded'))
+_RETRYABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+_PROJECT = re.compile(r'/projects/([^/?]+)')
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at rate tokens per second up to capacity. A rate of
+    None never runs out.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self._rate = rate
+        self._capacity = float(capacity or rate or 1)
+        self._tokens = self._capacity
+        self._updated = time.time()
+        self._paused_until = 0.0
+
+    def reserve(self, tokens=1):
+        ''' Takes tokens, letting the balance go negative, and returns how long
+            the caller has to wait before using them. Caller holds the lock. '''
+        now = time.time()
+        wait = max(self._paused_until - now, 0.0)
+        if self._rate is None:
+            return wait
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        self._tokens -= tokens
+        if self._tokens < 0:
+            wait = max(wait, -self._tokens / self._rate)
+        return wait
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.time() + seconds)
+
+
+class RateLimiter(object):
+    """
+    Shares a global request budget and a per-project budget between every
+    thread making Compute API calls. acquire() blocks until both buckets have
+    room, and pause() holds back a project, or everything, after the API
+    answers with a rate limit error.
+    """
+
+    def __init__(self, rate=None, project_rate=None, burst=None, project_burst=None):
+        self._global = TokenBucket(rate, burst)
+        self._project_rate = project_rate
+        self._project_burst = project_burst
+        self._projects = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, project):
+        bucket = self._projects.get(project)
+        if bucket is None:
+            bucket = self._projects[project] = TokenBucket(self._project_rate, self._project_burst)
+        return bucket
+
+    @property
+    def project_burst(self):
+        ''' Most calls one project may make at once, or None when unlimited. '''
+        if self._project_rate is None:
+            return None
+        return max(int(self._project_burst or self._project_rate), 1)
+
+    def acquire(self, project=None, tokens=1):
+        ''' Blocks until tokens calls may be made against project, returning the time waited. '''
+        return self.acquire_all({project: tokens})
+
+    def acquire_all(self, calls):
+        ''' Blocks until every project in a dict of project to call count may
+            make its calls, as for a batch request, returning the time waited. '''
+        with self._lock:
+            wait = self._global.reserve(sum(calls.values()))
+            for project, tokens in calls.items():
+                if project is not None:
+                    wait = max(wait, self._bucket(project).reserve(tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds, project=None):
+        with self._lock:
+            (self._bucket(project) if project is not None else self._global).pause(seconds)
+
+
+_limiter = RateLimiter()
+
+
+def configure(rate=None, project_rate=None, burst=None, project_burst=None):
+    ''' Replaces the process-wide limiter used when callers do not pass one. '''
+    global _limiter
+    _limiter = RateLimiter(rate, project_rate, burst, project_burst)
+    return _limiter
+
+
+def default_limiter():
+    return _limiter
+
+
+def request_project(request):
+    ''' Returns the project a Compute request targets, from its URI. '''
+    match = _PROJECT.search(str(getattr(request, 'uri', '')))
+    return match.group(1) if match else None
+
+
+def _status(error):
+    return getattr(getattr(error, 'resp', None), 'status', None)
+
+
+def _reason(error):
+    details = getattr(error, 'error_details', None)
+    if details:
+        return details[0].get('reason') if isinstance(details, list) and isinstance(details[0], dict) else None
+    content = getattr(error, 'content', b'')
+    match = re.search(br'"reason"\s*:\s*"(\w+)"', content if isinstance(content, bytes) else content.encode('utf-8'))
+    return match.group(1).decode('utf-8') if match else None
+
+
+def is_rate_limited(error):
+    status = _status(error)
+    return status == 429 or (status == 403 and _reason(error) in _RATE_LIMIT_REASONS)
+
+
+def is_retryable(error):
+    return is_rate_limited(error) or _status(error) in _RETRYABLE_STATUSES
+
+
+def retry_after(error):
+    ''' Returns the delay a Retry-After header on the error's response asks
+        for, in seconds, or None. '''
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        date = parsedate_tz(value)
+        return max(mktime_tz(date) - time.time(), 0.0) if date else None
+
+
+def backoff(attempt, initial=INITIAL_BACKOFF, maximum=MAX_BACKOFF):
+    ''' Full jitter exponential backoff for the given retry attempt. '''
+    return random.uniform(0, min(maximum, initial * 2 ** attempt))
+
+
+def retry_delay(error, attempt):
+    """
+    Decides whether a failed call is retried
+    :return: Seconds to wait before the next attempt, or None to give up
+    """
+    if not is_retryable(error):
+        return None
+    requested = retry_after(error)
+    if requested is not None:
+        return requested + random.uniform(0, INITIAL_BACKOFF)
+    return backoff(attempt)
+
+
+def execute_request(request, project=None, limiter=None, retries=MAX_RETRIES):
+    """
+    Executes a Compute API request once the rate limiter allows it, retrying
+    rate limit errors and transient server errors with jittered backoff, or
+    after the delay given in Retry-After. Rate limit errors also pause the
+    request's project in the limiter so other threads back off with it
+    :return: The response
+    """
+    limiter = limiter or _limiter
+    project = project or request_project(request)
+    method = request_method(request)
+    attempt = 0
+    while True:
+        limiter.acquire(project)
+        started = time.time()
+        try:
+            response = request.execute()
+        except Exception as e:
+            record_call(method, time.time() - started, error_status(e))
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt >= retries:
+                raise
+            _log.warning('Compute request for %s failed (%s), retry %s of %s in %.1fs.',
+                         project, _status(e), attempt + 1, retries, delay)
+            if is_rate_limited(e):
+                record_retry(method, 'rate_limited')
+                limiter.pause(delay, project)
+            else:
+                record_retry(method, 'transient')
+                time.sleep(delay)
+            attempt += 1
+            continue
+        record_call(method, time.time() - started)
+        return response
@@ -0,0 +1,57 @@
+# Seconds for a project's violation and churn counts to halve, so a project
+# that has stayed clean for a while cools down again.
+HALF_LIFE = 2 * 86400
+# An address appearing, changing or going away counts for a quarter of a violation.
+CHURN_WEIGHT = 0.25
+# Projects scoring this much, repeat offenders rather than a project with a
+# single violation, are scanned on every sweep.
+HOT_SCORE = 2.0
+
+
+def decayed(value, elapsed, half_life=HALF_LIFE):
+    return value * 0.5 ** (max(elapsed, 0) / float(half_life))
+
+
+def updated_score(previous, violation, churn, now, half_life=HALF_LIFE):
+    """
+    Decays a project's violation and churn counts to now and adds what its
+    latest scan found
+    :param previous: Dict with the project's violations, churn and updated_at,
+        or None for a project without a score
+    :return: Tuple of the new violations and churn counts
+    """
+    if previous is None:
+        return float(violation), float(churn)
+    elapsed = now - previous['updated_at']
+    return (decayed(previous['violations'], elapsed, half_life) + violation,
+            decayed(previous['churn'], elapsed, half_life) + churn)
+
+
+def score(history, now, half_life=HALF_LIFE):
+    if history.get('updated_at') is None:
+        return 0.0
+    return decayed(history['violations'] + CHURN_WEIGHT * history['churn'], now - history['updated_at'], half_life)
+
+
+def scan_interval(project_score, max_staleness, hot_score=HOT_SCORE):
+    ''' Seconds a project may go between scans: none for a hot project,
+        max_staleness for one without violations or churn, and shorter the
+        higher its score in between. '''
+    if project_score >= hot_score:
+        return 0
+    return max_staleness / (1 + project_score)
+
+
+def is_due(history, now, max_staleness, hot_score=HOT_SCORE, half_life=HALF_LIFE):
+    """
+    Decides whether a project is scanned this sweep: it is when it has never
+    been scanned, an address in it is due a retry, or the interval for its
+    score has passed since its last scan. No project goes unscanned for longer
+    than max_staleness plus the time to the next sweep
+    :param history: Dict from StateStore.schedule(), or None
+    """
+    if history is None:
+        return True
+    if history['retry_at'] is not None and history['retry_at'] <= now:
+        return True
+    return now - history['scanned_at'] >= scan_interval(score(history, now, half_life), max_staleness, hot_score)
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import bisect
+import hashlib
+import logging
+import tempfile
+
+_log = logging.getLogger('ip-enforcer.sharding')
+
+VIRTUAL_NODES = 64
+LEASE_PREFIX = 'leases/'
+
+
+def _hash(key):
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring placing each member at VIRTUAL_NODES points, so a
+    project belongs to the member at the first point after the project's hash.
+    Adding or removing one member only moves the projects between it and its
+    neighbours, about 1/n of them.
+    """
+
+    def __init__(self, members, virtual_nodes=VIRTUAL_NODES):
+        if not members:
+            raise ValueError('A hash ring needs at least one member')
+        self._points = sorted((_hash('{}#{}'.format(member, index)), member)
+                              for member in set(members) for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in self._points]
+
+    def owner(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+def read_membership(path):
+    ''' Reads a membership file, one member name per line, # for comments. '''
+    with open(path) as membership_file:
+        members = [line.split('#', 1)[0].strip() for line in membership_file]
+    return [member for member in members if member]
+
+
+class BucketLeaseStore(object):
+    """
+    Keeps a lease per member as an object under leases/ in a Cloud Storage
+    bucket, the expiry held in the object's metadata so listing the prefix
+    reads every lease at once.
+    """
+
+    def __init__(self, bucket, prefix=LEASE_PREFIX):
+        self._bucket = bucket
+        self._prefix = prefix
+
+    def renew(self, member, expires):
+        blob = self._bucket.blob(self._prefix + member)
+        blob.metadata = {'expires': str(expires)}
+        blob.upload_from_string(json.dumps({'member': member, 'expires': expires}),
+                                content_type='application/json')
+
+    def leases(self):
+        ''' Returns a dict of member to lease expiry time. '''
+        leases = {}
+        for blob in self._bucket.list_blobs(prefix=self._prefix):
+            try:
+                leases[blob.name[len(self._prefix):]] = float((blob.metadata or {})['expires'])
+            except (KeyError, ValueError):
+                _log.warning('Ignoring malformed lease %s', blob.name)
+        return leases
+
+
+class FileLeaseStore(object):
+    ''' Keeps a lease per member as a file in a directory shared by every member. '''
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    def renew(self, member, expires):
+        os.makedirs(self._directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=self._directory, delete=False) as lease:
+            json.dump({'member': member, 'expires': expires}, lease)
+        os.rename(lease.name, os.path.join(self._directory, member + '.lease'))
+
+    def leases(self):
+        leases = {}
+        for name in os.listdir(self._directory) if os.path.isdir(self._directory) else []:
+            if name.endswith('.lease'):
+                try:
+                    with open(os.path.join(self._directory, name)) as lease:
+                        leases[name[:-len('.lease')]] = float(json.load(lease)['expires'])
+                except (IOError, OSError, KeyError, ValueError):
+                    _log.warning('Ignoring malformed lease %s', name)
+        return leases
+
+
+class Shard(object):
+    """
+    One enforcer instance's share of the projects. Every sweep the instance
+    renews its lease for lease_ttl seconds, then hashes the projects over the
+    members whose leases are live, so the projects of a member that stopped
+    renewing are picked up by the others until it comes back. Members that
+    have never taken a lease count as live for lease_ttl seconds after this
+    instance starts, so a fleet starting together does not double up.
+    """
+
+    def __init__(self, member, members, leases=None, lease_ttl=900):
+        if member not in members:
+            raise ValueError('Shard {} is not one of the members {}'.format(member, ', '.join(members)))
+        self.member = member
+        self.members = list(members)
+        self._leases = leases
+        self._lease_ttl = lease_ttl
+        self._started = time.time()
+
+    def live_members(self):
+        ''' Renews this member's lease and returns the members holding one. '''
+        if self._leases is None:
+            return list(self.members)
+        now = time.time()
+        try:
+            self._leases.renew(self.member, now + self._lease_ttl)
+            leases = self._leases.leases()
+        except Exception as e:
+            _log.warning('Could not read shard leases, assuming every member is live: %s', e)
+            return list(self.members)
+
+        live = [member for member in self.members if member == self.member or leases.get(member, 0) > now or
+                (member not in leases and now - self._started < self._lease_ttl)]
+        for member in self.members:
+            if member not in live:
+                _log.warning('Shard %s has no live lease, sharing its projects out.', member)
+        return live
+
+    def assign(self, projects):
+        ''' Filters an iterable of projects down to those this member sweeps. '''
+        live = self.live_members()
+        _log.info('Shard %s sweeping its share of the projects with %s of %s member(s) live.',
+                  self.member, len(live), len(self.members))
+        ring = HashRing(live)
+        return (project for project in projects if ring.owner(project) == self.member)
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    project TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    scanned_at REAL NOT NULL,
+    retry_at REAL,
+    outcome TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS addresses (
+    project TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    attempted_at REAL NOT NULL,
+    PRIMARY KEY (project, key)
+);
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS sweep_projects (
+    sweep INTEGER NOT NULL,
+    project TEXT NOT NULL,
+    PRIMARY KEY (sweep, project)
+);
+CREATE TABLE IF NOT EXISTS operations (
+    project TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    region TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    PRIMARY KEY (project, zone, region, operation)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    project TEXT PRIMARY KEY,
+    violations REAL NOT NULL,
+    churn REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+# Fields of an address that decide whether it changed between runs.
+_ADDRESS_FIELDS = ('address', 'addressType', 'status', 'users')
+
+
+def fingerprint(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def external_addresses(addresses):
+    """
+    Flattens get_addresses() output into the external addresses it holds
+    :return: Dict of scope/name key to (scope, address) tuple
+    """
+    external = {}
+    for scope, scoped_list in addresses.items():
+        for item in scoped_list.get('addresses', []):
+            if item['addressType'] == "EXTERNAL":
+                external['{}/{}'.format(scope, item['name'])] = (scope, item)
+    return external
+
+
+def address_fingerprints(external):
+    return dict((key, fingerprint(dict((field, item.get(field)) for field in _ADDRESS_FIELDS)))
+                for key, (_, item) in external.items())
+
+
+def diff_snapshot(previous, current):
+    """
+    Compares the address fingerprints of a project's last snapshot to the
+    current ones
+    :return: Dict of new, changed, removed and unchanged address keys
+    """
+    delta = {'new': [], 'changed': [], 'removed': [], 'unchanged': []}
+    for key, address_fingerprint in current.items():
+        if key not in previous:
+            delta['new'].append(key)
+        elif previous[key]['fingerprint'] != address_fingerprint:
+            delta['changed'].append(key)
+        else:
+            delta['unchanged'].append(key)
+    delta['removed'] = [key for key in previous if key not in current]
+    return delta
+
+
+def select_due(previous, current, now, retry_interval):
+    """
+    Picks the addresses to remediate: those that are new or changed since the
+    last snapshot, or whose last remediation attempt is older than
+    retry_interval
+    :return: Tuple of the due keys and the snapshot to record after remediation
+    """
+    due = []
+    snapshot = {}
+    for key, address_fingerprint in current.items():
+        last = previous.get(key)
+        if last is not None and last['fingerprint'] == address_fingerprint \
+                and now - last['attempted_at'] < retry_interval:
+            attempted_at = last['attempted_at']
+        else:
+            due.append(key)
+            attempted_at = now
+        snapshot[key] = {'fingerprint': address_fingerprint, 'attempted_at': attempted_at}
+    return due, snapshot
+
+
+class StateStore(object):
+    """
+    SQLite store of what the enforcer saw in each project on its last scan: a
+    fingerprint of the project's external addresses, the outcome, and for each
+    address when remediation was last attempted. It also checkpoints the sweep
+    in progress and journals the operations in flight, so a run that is killed
+    can be picked up where it stopped. Safe to share between scan workers.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def project(self, project):
+        ''' Returns the last scan of a project as a dict, or None if never scanned. '''
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT fingerprint, scanned_at, retry_at, outcome FROM projects WHERE project = ?',
+                (project,)).fetchone()
+        if row is None:
+            return None
+        return {'fingerprint': row[0], 'scanned_at': row[1], 'retry_at': row[2], 'outcome': row[3]}
+
+    def addresses(self, project):
+        ''' Returns the addresses of a project's last snapshot keyed by scope/name. '''
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key, fingerprint, attempted_at FROM addresses WHERE project = ?', (project,)).fetchall()
+        return dict((key, {'fingerprint': address_fingerprint, 'attempted_at': attempted_at})
+                    for key, address_fingerprint, attempted_at in rows)
+
+    def touch(self, project):
+        ''' Marks an unchanged project as scanned, keeping its last outcome. '''
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE projects SET scanned_at = ? WHERE project = ?', (time.time(), project))
+
+    def record(self, project, project_fingerprint, addresses, outcome, retry_interval):
+        """
+        Replaces the snapshot of a project
+        :param addresses: Dict of scope/name key to fingerprint and attempted_at
+        """
+        attempts = [address['attempted_at'] for address in addresses.values()]
+        retry_at = min(attempts) + retry_interval if attempts else None
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?)',
+                                     (project, project_fingerprint, time.time(), retry_at, outcome))
+            self._connection.execute('DELETE FROM addresses WHERE project = ?', (project,))
+            self._connection.executemany('INSERT INTO addresses VALUES (?, ?, ?, ?)',
+                                         [(project, key, address['fingerprint'], address['attempted_at'])
+                                          for key, address in addresses.items()])
+
+    def score(self, project):
+        ''' Returns a project's violation and churn counts as last recorded, or None. '''
+        with self._lock:
+            row = self._connection.execute('SELECT violations, churn, updated_at FROM scores WHERE project = ?',
+                                           (project,)).fetchone()
+        if row is None:
+            return None
+        return {'violations': row[0], 'churn': row[1], 'updated_at': row[2]}
+
+    def record_score(self, project, violations, churn):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)',
+                                     (project, violations, churn, time.time()))
+
+    def schedule(self):
+        """
+        Reads what scheduling needs about every project scanned before, in one
+        query
+        :return: Dict of project to its scanned_at, retry_at, violations, churn
+            and updated_at, the last three None for a project without a score
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT projects.project, scanned_at, retry_at, violations, churn, updated_at '
+                'FROM projects LEFT JOIN scores ON scores.project = projects.project').fetchall()
+        return dict((row[0], {'scanned_at': row[1], 'retry_at': row[2], 'violations': row[3], 'churn': row[4],
+                              'updated_at': row[5]}) for row in rows)
+
+    def begin_sweep(self, resume_window):
+        """
+        Resumes the last sweep if it never finished and started less than
+        resume_window seconds ago, otherwise starts a new one
+        :return: Dict with the sweep id, when it started and the projects it
+            has already done
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT id, started_at FROM sweeps WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1').fetchone()
+            if row is not None and now - row[1] < resume_window:
+                done = self._connection.execute('SELECT project FROM sweep_projects WHERE sweep = ?',
+                                                (row[0],)).fetchall()
+                return {'id': row[0], 'started_at': row[1], 'done': frozenset(project for project, in done)}
+            self._connection.execute('DELETE FROM sweep_projects')
+            self._connection.execute('DELETE FROM sweeps')
+            sweep = self._connection.execute('INSERT INTO sweeps (started_at) VALUES (?)', (now,)).lastrowid
+        return {'id': sweep, 'started_at': now, 'done': frozenset()}
+
+    def finish_project(self, sweep, project):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO sweep_projects VALUES (?, ?)', (sweep, project))
+
+    def finish_sweep(self, sweep):
+        with self._lock, self._connection:
+            self._connection.execute('UPDATE sweeps SET finished_at = ? WHERE id = ?', (time.time(), sweep))
+            self._connection.execute('DELETE FROM sweep_projects WHERE sweep = ?', (sweep,))
+
+    def add_operation(self, project, operation, zone=None, region=None):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?)',
+                                     (project, zone or '', region or '', operation, time.time()))
+
+    def remove_operation(self, project, operation, zone=None, region=None):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM operations WHERE project = ? AND zone = ? AND region = ? AND operation = ?',
+                (project, zone or '', region or '', operation))
+
+    def operations(self):
+        ''' Returns the journalled operations, oldest first. '''
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT project, zone, region, operation, started_at FROM operations ORDER BY started_at').fetchall()
+        return [{'project': project, 'operation': operation, 'zone': zone or None, 'region': region or None,
+                 'started_at': started_at} for project, zone, region, operation, started_at in rows]
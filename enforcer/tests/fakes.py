@@ -0,0 +1,99 @@
+# Standard Library Imports
+import mock
+
+
+class FakeBatch(object):
+    ''' Stand-in for googleapiclient's BatchHttpRequest that executes each added
+        request and routes its response or error to the batch callback. '''
+
+    def __init__(self, callback, calls):
+        self._callback = callback
+        self._calls = calls
+        self._requests = []
+
+    def add(self, request, request_id=None):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        self._calls.append(len(self._requests))
+        for request_id, request in self._requests:
+            try:
+                response = request.execute()
+            except Exception as e:
+                self._callback(request_id, None, e)
+            else:
+                self._callback(request_id, response, None)
+
+
+def batching_service():
+    ''' Returns a MagicMock compute service whose new_batch_http_request hands
+        out FakeBatch objects, recording the size of every batch sent in
+        service.batch_calls. '''
+    service = mock.MagicMock()
+    service.batch_calls = []
+    service.new_batch_http_request.side_effect = lambda callback=None: FakeBatch(callback, service.batch_calls)
+    return service
+
+
+class FakeBlob(object):
+    ''' Stand-in for a google.cloud.storage Blob holding its content in memory. '''
+
+    def __init__(self, name, data, generation=1, bucket=None):
+        self.name = name
+        self.data = data
+        self.generation = generation
+        self.metadata = None
+        self.downloads = 0
+        self._bucket = bucket
+
+    @property
+    def etag(self):
+        return 'etag-{}'.format(self.generation)
+
+    def update(self, data):
+        self.data = data
+        self.generation += 1
+
+    def download_to_file(self, file_obj):
+        self.downloads += 1
+        file_obj.write(self.data)
+
+    def upload_from_string(self, data, content_type=None):
+        self._bucket._check()
+        self.update(data)
+        self._bucket.blobs[self.name] = self
+
+
+class FakeBucket(object):
+    ''' Stand-in for a google.cloud.storage Bucket. Set unreachable to make
+        every call fail as if the bucket could not be reached. '''
+
+    def __init__(self, name):
+        self.name = name
+        self.blobs = {}
+        self.unreachable = False
+
+    def _check(self):
+        if self.unreachable:
+            raise IOError('Bucket {} unreachable'.format(self.name))
+
+    def get_blob(self, name):
+        self._check()
+        return self.blobs.get(name)
+
+    def blob(self, name):
+        return self.blobs.get(name) or FakeBlob(name, None, generation=0, bucket=self)
+
+    def list_blobs(self, prefix=''):
+        self._check()
+        return [blob for name, blob in sorted(self.blobs.items()) if name.startswith(prefix)]
+
+
+class FakeStorageClient(object):
+    ''' Stand-in for google.cloud.storage.Client keeping buckets in memory. '''
+
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name):
+        return self.buckets.setdefault(name, FakeBucket(name))
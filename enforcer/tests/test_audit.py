@@ -0,0 +1,108 @@
+# Standard Library Imports
+import os
+import json
+import shutil
+import logging
+import tempfile
+import logging.handlers
+import threading
+import unittest
+
+# Third Party Imports
+import mock
+
+# Local Imports
+import main
+from audit import JsonFormatter, LogWriter, configure
+
+
+class AuditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ocean-ip-enforcer.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.path) as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_json_format(self):
+        record = logging.makeLogRecord({'name': 'ip-enforcer', 'levelname': 'WARNING', 'msg': 'deleted %s',
+                                        'args': ('1.2.3.4',), 'audit': {'project': 'project-a',
+                                                                        'outcome': 'deleted'}})
+        entry = json.loads(JsonFormatter().format(record))
+        # Assertion (message merged, audit fields at the top level for fluentd)
+        self.assertEqual((entry['severity'], entry['message'], entry['project'], entry['outcome']),
+                         ('WARNING', 'deleted 1.2.3.4', 'project-a', 'deleted'))
+        self.assertTrue(entry['time'].endswith('Z'))
+
+    def test_concurrent_logging(self):
+        writer = configure('ip-enforcer-test', self.path)
+        logger = logging.getLogger('ip-enforcer-test.worker')
+
+        def work(index):
+            for count in range(200):
+                logger.info('worker %s record %s', index, count, extra={'audit': {'worker': index}})
+
+        threads = [threading.Thread(target=work, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.stop()
+        logging.getLogger('ip-enforcer-test').handlers = []
+        entries = self.read()
+        # Assertion (every record written once, each line complete JSON)
+        self.assertEqual(len(entries), 800)
+        self.assertEqual(sorted(set(entry['worker'] for entry in entries)), [0, 1, 2, 3])
+
+    def test_queue_handler_leaves_record_alone(self):
+        writer = configure('ip-enforcer-test', self.path)
+        logger = logging.getLogger('ip-enforcer-test')
+        # Another handler after the queue handler
+        later = logging.handlers.BufferingHandler(10)
+        logger.addHandler(later)
+        try:
+            raise SystemError('quota')
+        except SystemError:
+            logger.exception('could not delete %s', 'ip-1')
+        writer.stop()
+        logger.handlers = []
+        record = later.buffer[0]
+        # Assertion (other handlers still see the arguments and exception as logged)
+        self.assertEqual((record.msg, record.args), ('could not delete %s', ('ip-1',)))
+        self.assertIsNotNone(record.exc_info)
+        entry = self.read()[0]
+        # Assertion (the writer got the merged message and the traceback)
+        self.assertEqual(entry['message'], 'could not delete ip-1')
+        self.assertIn('SystemError: quota', entry['exception'])
+
+    def test_reopens_rotated_file(self):
+        writer = LogWriter(self.path)
+        writer.start()
+        writer.queue.put(logging.makeLogRecord({'msg': 'before'}))
+        writer.stop()
+        os.rename(self.path, self.path + '.1')
+        writer.start()
+        writer.queue.put(logging.makeLogRecord({'msg': 'after'}))
+        writer.stop()
+        # Assertion (records after logrotate moved the file go to a new one)
+        self.assertEqual([entry['message'] for entry in self.read()], ['after'])
+
+    @mock.patch.object(main, 'execute_action')
+    def test_chain_audit_events(self, mock_execute_action):
+        mock_execute_action.side_effect = [{'name': 'operation-1'}, SystemError('quota')]
+        chain = [{'kind': 'routers', 'project': 'project-a', 'location': 'europe-west1', 'name': 'nat'},
+                 {'kind': 'addresses', 'project': 'project-a', 'location': 'europe-west1', 'name': 'ip-1',
+                  'address': '1.2.3.4', 'consumers': ['nat']}]
+        with self.assertLogs('ip-enforcer', level='INFO') as logs:
+            main.execute_chain(mock.MagicMock(), chain)
+        events = [record.audit for record in logs.records if hasattr(record, 'audit')]
+        # Assertion (an audit event for each delete, with its outcome and duration)
+        self.assertEqual([(event['resource'], event['outcome']) for event in events],
+                         [('routers/europe-west1/nat', 'deleted'), ('addresses/europe-west1/ip-1', 'failed')])
+        self.assertEqual(events[1]['address'], '1.2.3.4')
+        self.assertIn('duration', events[0])
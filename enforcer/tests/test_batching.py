@@ -0,0 +1,76 @@
+# Standard Library Imports
+import time
+import unittest
+import mock
+
+# Local Imports
+import batching
+from batching import BatchDispatcher, send_batch
+from fakes import batching_service
+
+
+class BatchingTest(unittest.TestCase):
+
+    def test_send_batch(self):
+        # Mock Discovery API with fake batch support
+        mock_service = batching_service()
+        requests = [mock.MagicMock() for _ in range(5)]
+        for index, request in enumerate(requests):
+            request.execute.return_value = {'name': 'operation-{}'.format(index)}
+        requests[3].execute.side_effect = SystemError()
+        # Make call with a batch size of two
+        results = send_batch(mock_service, requests, max_batch_size=2)
+        # Assertion (two batches and one lone request, responses kept in order)
+        self.assertEqual(mock_service.batch_calls, [2, 2])
+        self.assertEqual(results[0], ({'name': 'operation-0'}, None))
+        self.assertEqual(results[4], ({'name': 'operation-4'}, None))
+        self.assertIsInstance(results[3][1], SystemError)
+
+    def test_dispatcher_coalesces_calls(self):
+        # Mock Discovery API with fake batch support
+        mock_service = batching_service()
+        mock_service.addresses.return_value.delete.return_value.execute.return_value = {'operationType': 'delete'}
+        # Submit calls within one batch window
+        with BatchDispatcher(lambda: mock_service, window=0.5) as dispatcher:
+            futures = [dispatcher.submit(lambda service: service.addresses().delete())
+                       for _ in range(10)]
+            responses = [future.result(timeout=5) for future in futures]
+        # Assertion (all calls sent as a single batch request)
+        self.assertEqual(mock_service.batch_calls, [10])
+        self.assertEqual(responses[0]['operationType'], 'delete')
+
+    @mock.patch('batching.retry_delay', return_value=0.5)
+    def test_dispatcher_retries_without_holding_up_other_calls(self, mock_retry_delay):
+        # Mock Discovery API, one call failing once and one failing every time
+        mock_service = batching_service()
+        flaky, failing, other = (mock.MagicMock(uri=None) for _ in range(3))
+        flaky.execute.side_effect = [SystemError('backendError'), 'flaky']
+        failing.execute.side_effect = SystemError('backendError')
+        other.execute.return_value = 'other'
+        with BatchDispatcher(lambda: mock_service, window=0.01, retries=2) as dispatcher:
+            first = dispatcher.submit(lambda service: flaky)
+            gives_up = dispatcher.submit(lambda service: failing)
+            while not flaky.execute.called:
+                time.sleep(0.01)
+            # Submit another call while the failed ones wait out their backoff
+            second = dispatcher.submit(lambda service: other)
+            # Assertion (sent straight away, not after the retries)
+            self.assertEqual(second.result(timeout=0.3), 'other')
+            self.assertFalse(first.done())
+            self.assertEqual(first.result(timeout=5), 'flaky')
+            self.assertRaises(SystemError, gives_up.result, 5)
+        # Assertion (the failing call was given up after its retries)
+        self.assertEqual(failing.execute.call_count, 3)
+
+    def test_dispatcher_survives_a_failed_group(self):
+        # Mock Discovery API, the first batch failing before any call is sent
+        mock_service = batching_service()
+        request = mock.MagicMock(uri=None)
+        request.execute.return_value = 'sent'
+        with mock.patch.object(batching, 'send_batch', side_effect=[RuntimeError('limiter'), [('sent', None)]]):
+            with BatchDispatcher(lambda: mock_service, window=0.01) as dispatcher:
+                failed = dispatcher.submit(lambda service: request)
+                # Assertion (the calls in the group fail with the error)
+                self.assertRaises(RuntimeError, failed.result, 5)
+                # Assertion (the dispatcher keeps sending later calls)
+                self.assertEqual(dispatcher.submit(lambda service: request).result(timeout=5), 'sent')
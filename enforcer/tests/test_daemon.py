@@ -0,0 +1,62 @@
+# Standard Library Imports
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Local Imports
+from daemon import SweepLock, SweepScheduler
+
+
+class DaemonTest(unittest.TestCase):
+
+    def test_run_forever(self):
+        # Sweep that stops the scheduler on its third run
+        sweeps = []
+
+        def sweep():
+            sweeps.append(1)
+            if len(sweeps) == 3:
+                scheduler.stop()
+
+        scheduler = SweepScheduler(sweep, 0.01)
+        # Make call, bounded by a watchdog in case stop is never reached
+        watchdog = threading.Timer(5, scheduler.stop)
+        watchdog.start()
+        scheduler.run_forever()
+        watchdog.cancel()
+        # Assertion
+        self.assertEqual(scheduler.sweeps, 3)
+
+    def test_no_overlapping_sweeps(self):
+        # Sweep that tries to start another sweep while it is running
+        nested = []
+        scheduler = SweepScheduler(lambda: nested.append(scheduler.run_once()), 300)
+        # Assertion (outer sweep ran, nested one was refused)
+        self.assertTrue(scheduler.run_once())
+        self.assertEqual(nested, [False])
+        self.assertEqual(scheduler.sweeps, 1)
+
+    def test_failed_sweep_does_not_stop_scheduler(self):
+        # Sweep that raises
+        def sweep():
+            raise SystemError()
+
+        scheduler = SweepScheduler(sweep, 300)
+        # Assertion (failure is logged, the lock is released)
+        self.assertTrue(scheduler.run_once())
+        self.assertTrue(scheduler.run_once())
+
+    def test_sweep_lock(self):
+        state_dir = tempfile.mkdtemp()
+        path = os.path.join(state_dir, 'sweep.lock')
+        first, second = SweepLock(path), SweepLock(path)
+        # Assertion (a second holder is refused until the first releases)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertEqual(second.holder(), os.getpid())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+        shutil.rmtree(state_dir)
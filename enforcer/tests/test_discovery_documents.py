@@ -0,0 +1,39 @@
+# Standard Library Imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local Imports
+from discovery_documents import DiscoveryDocumentCache, bundled_document
+
+
+class DiscoveryDocumentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.url = 'https://www.googleapis.com/discovery/v1/apis/compute/v1/rest'
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_round_trip(self):
+        cache = DiscoveryDocumentCache(os.path.join(self.directory, 'discovery'))
+        # Assertion (miss, then hit after set)
+        self.assertIsNone(cache.get(self.url))
+        cache.set(self.url, '{"name": "compute"}')
+        self.assertEqual(cache.get(self.url), '{"name": "compute"}')
+
+    def test_cache_expires(self):
+        # Assertion (a document older than the ttl is a miss)
+        cache = DiscoveryDocumentCache(self.directory, ttl=-1)
+        cache.set(self.url, '{"name": "compute"}')
+        self.assertIsNone(cache.get(self.url))
+
+    def test_bundled_document(self):
+        path = os.path.join(self.directory, 'compute.v1.json')
+        with open(path, 'w') as document:
+            document.write('{"name": "compute"}')
+        # Assertion
+        self.assertEqual(bundled_document(path), '{"name": "compute"}')
+        self.assertIsNone(bundled_document(os.path.join(self.directory, 'missing.json')))
@@ -0,0 +1,166 @@
+# Standard Library Imports
+import os
+import json
+import time
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Third Party Imports
+import mock
+
+# Local Imports
+from events import EventProcessor, FileSource, event_source, parse_event
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class EventsTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(FIXTURES, 'audit-log-instance-insert.json')) as fixture:
+            self.entry = json.load(fixture)
+
+    def message(self, payload):
+        return mock.MagicMock(data=json.dumps(payload).encode('utf-8'))
+
+    def test_parse_audit_log_entry(self):
+        # Assertion (the instance named by the entry)
+        self.assertEqual(parse_event(json.dumps(self.entry)),
+                         {'project': 'python-test-case', 'kind': 'instances', 'location': 'europe-west1-c',
+                          'name': 'gce-instance-1'})
+
+    def test_parse_global_address(self):
+        self.entry['protoPayload']['methodName'] = 'beta.compute.globalAddresses.insert'
+        self.entry['protoPayload']['resourceName'] = 'projects/python-test-case/global/addresses/global-ip'
+        # Assertion (global resources map to the global kinds)
+        self.assertEqual(parse_event(json.dumps(self.entry)),
+                         {'project': 'python-test-case', 'kind': 'globalAddresses', 'location': 'global',
+                          'name': 'global-ip'})
+
+    def test_parse_ignores_unfinished_and_failed_calls(self):
+        self.entry['operation'] = {'id': 'operation-1', 'first': True}
+        # Assertion (the first entry of an operation is skipped, the last one is handled)
+        self.assertIsNone(parse_event(json.dumps(self.entry)))
+        self.entry['operation'] = {'id': 'operation-1', 'last': True}
+        self.entry['protoPayload']['status'] = {'code': 7, 'message': 'PERMISSION_DENIED'}
+        # Assertion (failed calls created nothing)
+        self.assertIsNone(parse_event(json.dumps(self.entry)))
+        # Assertion (methods that cannot expose an address)
+        self.assertIsNone(parse_event(json.dumps({'protoPayload': {'methodName': 'v1.compute.disks.insert',
+                                                                   'resourceName': 'projects/p/zones/z/disks/d'}})))
+
+    def test_processor_remediates_in_scope_events_once(self):
+        remediate = mock.MagicMock()
+        processor = EventProcessor(remediate, lambda: {'python-test-case'})
+        first, repeat, other = self.message(self.entry), self.message(self.entry), self.message(
+            {'project': 'other-project', 'kind': 'addresses', 'location': 'europe-west1', 'name': 'ip'})
+        for message in (first, repeat, other):
+            processor(message)
+        # Assertion (one remediation, every message acknowledged)
+        self.assertEqual(remediate.call_count, 1)
+        self.assertEqual(remediate.call_args[0][0]['name'], 'gce-instance-1')
+        for message in (first, repeat, other):
+            message.ack.assert_called_once_with()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_processor_holds_events_until_scope_is_known(self):
+        remediate = mock.MagicMock()
+        scope = {'projects': None}
+        in_scope = mock.MagicMock(side_effect=lambda: scope['projects'])
+        with EventProcessor(remediate, in_scope, poll_interval=0.1) as processor:
+            message = self.message(self.entry)
+            processor(message)
+            time.sleep(0.35)
+            # Assertion (held back, checked again once per poll interval, until the first sweep lists the scope)
+            self.assertEqual(remediate.call_count, 0)
+            self.assertFalse(message.nack.called or message.ack.called)
+            self.assertLessEqual(in_scope.call_count, 5)
+
+            scope['projects'] = frozenset(['python-test-case'])
+            self.wait_for(lambda: message.ack.called)
+        # Assertion (remediated once the scope is known)
+        remediate.assert_called_once_with(parse_event(json.dumps(self.entry)))
+        message.ack.assert_called_once_with()
+        self.assertFalse(message.nack.called)
+
+    def test_processor_handles_held_events_on_the_executor(self):
+        barrier = threading.Barrier(4, timeout=2)
+        remediate = mock.MagicMock(side_effect=lambda event: barrier.wait())
+        scope = {'projects': None}
+        messages = [self.message({'project': 'python-test-case', 'kind': 'addresses', 'location': 'europe-west1',
+                                  'name': 'ip-{}'.format(index)}) for index in range(4)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            with EventProcessor(remediate, lambda: scope['projects'], poll_interval=0.05,
+                                executor=executor) as processor:
+                for message in messages:
+                    processor(message)
+                scope['projects'] = frozenset(['python-test-case'])
+                self.wait_for(lambda: all(message.ack.called for message in messages))
+        # Assertion (the events held before the first sweep are remediated side by side, not one at a time)
+        self.assertEqual(processor.handled, 4)
+        self.assertEqual(barrier.n_waiting, 0)
+        self.assertFalse(barrier.broken)
+
+    def test_processor_backs_off_and_gives_up_on_persistent_failures(self):
+        remediate = mock.MagicMock(side_effect=SystemError('403'))
+        with EventProcessor(remediate, lambda: {'python-test-case'}, max_attempts=3, retry_interval=0.1) as processor:
+            message = self.message(self.entry)
+            started = time.time()
+            processor(message)
+            self.wait_for(lambda: message.ack.called)
+            elapsed = time.time() - started
+        # Assertion (tried max_attempts times with a doubling backoff in between, not in a tight loop)
+        self.assertEqual(remediate.call_count, 3)
+        self.assertGreaterEqual(elapsed, 0.3)
+        # Assertion (then acked and left to the sweep rather than redelivered)
+        message.ack.assert_called_once_with()
+        self.assertFalse(message.nack.called)
+        self.assertEqual((processor.handled, len(processor)), (0, 0))
+
+    def test_processor_retries_failures_and_nacks_held_messages_on_close(self):
+        remediate = mock.MagicMock(side_effect=[SystemError(), None])
+        processor = EventProcessor(remediate, lambda: {'python-test-case'}, retry_interval=0.05)
+        message = self.message(self.entry)
+        processor(message)
+        self.wait_for(lambda: message.ack.called)
+        # Assertion (a failed remediation is retried after the backoff)
+        self.assertEqual(remediate.call_count, 2)
+        message.ack.assert_called_once_with()
+        self.assertEqual(processor.handled, 1)
+
+        held = self.message({'project': 'python-test-case', 'kind': 'addresses', 'location': 'europe-west1',
+                             'name': 'ip'})
+        remediate.side_effect = SystemError()
+        processor(held)
+        processor.close()
+        # Assertion (messages still waiting for a retry go back to the source)
+        held.nack.assert_called_once_with()
+        self.assertFalse(held.ack.called)
+
+    def test_file_source(self):
+        path = os.path.join(FIXTURES, '..', 'events-test.jsonl')
+        open(path, 'w').close()
+        received = []
+        source = FileSource(path, poll_interval=0.05)
+        source.start(lambda message: received.append(parse_event(message.data)))
+        try:
+            with open(path, 'a') as events_file:
+                events_file.write(json.dumps(self.entry) + '\n')
+            deadline = time.time() + 5
+            while not received and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            source.stop()
+            os.remove(path)
+        # Assertion (lines appended after start are delivered)
+        self.assertEqual([event['name'] for event in received], ['gce-instance-1'])
+
+    def test_event_source(self):
+        self.assertIsInstance(event_source('file:/tmp/events.jsonl'), FileSource)
+        # Assertion (unknown schemes are rejected)
+        self.assertRaises(ValueError, event_source, 'kafka:events')
@@ -0,0 +1,74 @@
+# Standard Library Imports
+import re
+import shutil
+import tempfile
+import unittest
+
+# Local Imports
+from exclusions import ExclusionIndex, exclusion_index, load_exclusions
+from fakes import FakeBlob, FakeStorageClient
+
+
+class ExclusionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exclusions = ['654321', '123456', 'xpn', 'shared', 'hared-vpc']
+        self.projects = ['python-test-case', 'test-xpn', 'eim-123456-prod', 'eim-12345-prod',
+                         'shared-vpc-host', 'sha-red', '']
+        # Local stand-in for the data files bucket
+        with open('tests/fixtures/exclusions.jsonl', 'rb') as file:
+            self.blob = FakeBlob('exclusion.jsonl', file.read())
+        self.bucket = FakeStorageClient().bucket('python-test-case-data-files')
+        self.bucket.blobs[self.blob.name] = self.blob
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_matches_like_regex(self):
+        # Build the index and the pattern project_ids_list used to search with
+        index = ExclusionIndex(self.exclusions)
+        pattern = r".*({}).*".format("|".join(self.exclusions))
+        # Assertion (same decision for every project id)
+        for project in self.projects:
+            self.assertEqual(index.matches(project), bool(re.search(pattern, project)), project)
+
+    def test_regex_exclusions(self):
+        # Exclusions with regex syntax keep their regex meaning
+        index = ExclusionIndex(['^sandbox-', 'xpn'])
+        # Assertion
+        self.assertTrue(index.matches('sandbox-123'))
+        self.assertFalse(index.matches('my-sandbox-123'))
+        self.assertTrue(index.matches('my-xpn-host'))
+
+    def test_exclusion_index_memoized(self):
+        # Assertion (same content returns the same index, new content rebuilds)
+        index = exclusion_index(list(self.exclusions))
+        self.assertIs(exclusion_index(list(self.exclusions)), index)
+        self.assertIsNot(exclusion_index(self.exclusions + ['other']), index)
+
+    def test_load_exclusions_cached(self):
+        # Assertion (first load downloads, unchanged generation does not)
+        self.assertEqual(load_exclusions(self.bucket, self.blob.name, self.cache_dir), ['123456', '654321'])
+        self.assertEqual(load_exclusions(self.bucket, self.blob.name, self.cache_dir), ['123456', '654321'])
+        self.assertEqual(self.blob.downloads, 1)
+        # Assertion (a new generation is downloaded again)
+        self.blob.update(b'{"eimid":"111111"}\n')
+        self.assertEqual(load_exclusions(self.bucket, self.blob.name, self.cache_dir), ['111111'])
+        self.assertEqual(self.blob.downloads, 2)
+
+    def test_load_exclusions_bucket_unreachable(self):
+        # Populate the cache, then lose the bucket
+        load_exclusions(self.bucket, self.blob.name, self.cache_dir)
+        self.bucket.unreachable = True
+        # Assertion (last good copy is used)
+        self.assertEqual(load_exclusions(self.bucket, self.blob.name, self.cache_dir), ['123456', '654321'])
+        # Assertion (no copy to fall back to)
+        self.assertRaises(IOError, load_exclusions, self.bucket, self.blob.name, tempfile.mkdtemp())
+
+    def test_load_exclusions_keeps_last_good_copy(self):
+        # Populate the cache, then publish a corrupt generation
+        load_exclusions(self.bucket, self.blob.name, self.cache_dir)
+        self.blob.update(b'{"eimid": \n')
+        # Assertion (corrupt download is discarded)
+        self.assertEqual(load_exclusions(self.bucket, self.blob.name, self.cache_dir), ['123456', '654321'])
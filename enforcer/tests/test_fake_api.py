@@ -0,0 +1,90 @@
+# Standard Library Imports
+import json
+import random
+import unittest
+
+# Third Party Imports
+import mock
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build_from_document
+
+# Local Imports
+import main
+from benchmarks.fake_api import FakeGcp, discovery_document, generate_addresses, serve
+
+
+class FakeApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeGcp(page_size=4)
+        for project in ('fake-project-1', 'fake-project-2'):
+            self.fake.add_project(project, generate_addresses(project, 10, random.Random(project), internal_ratio=0))
+        self.server = serve(self.fake)
+        document = json.dumps(discovery_document(self.fake.root_url))
+        self.service_factory = lambda: build_from_document(document, credentials=AnonymousCredentials())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_aggregated_list_pages(self):
+        addresses = main.get_addresses(self.service_factory(), 'fake-project-1')
+        # Assertion (three pages of four merged into one result)
+        self.assertEqual(sum(len(scoped.get('addresses', [])) for scoped in addresses.values()), 10)
+        self.assertEqual(self.fake.stats['addresses.aggregatedList'], 3)
+        # Assertion (only the masked fields come back)
+        fields = {'name', 'address', 'status', 'region', 'users', 'addressType'}
+        self.assertTrue(all(set(item) <= fields for scoped in addresses.values() for item in scoped['addresses']))
+
+    def test_internal_addresses_filtered(self):
+        self.fake.add_project('fake-project-3', generate_addresses('fake-project-3', 10, random.Random(3),
+                                                                   internal_ratio=1))
+        addresses = main.get_addresses(self.service_factory(), 'fake-project-3')
+        # Assertion (internal addresses never leave the API)
+        self.assertEqual(sum(len(scoped['addresses']) for scoped in addresses.values()),
+                         self.fake.external_addresses('fake-project-3'))
+        self.assertLess(self.fake.external_addresses('fake-project-3'), 10)
+
+    def test_sweep_removes_external_addresses(self):
+        with mock.patch.object(main, 'build_compute_service', side_effect=lambda credentials=None:
+                               self.service_factory()):
+            summary = main.scan_projects(list(self.fake.projects), 2)
+        # Assertion (every address released, through batched requests)
+        self.assertEqual(sorted(summary['remediated']), ['fake-project-1', 'fake-project-2'])
+        self.assertEqual(self.fake.external_addresses(), 0)
+        self.assertGreater(self.fake.stats['batch_requests'], 0)
+
+    def test_delete_addresses_without_dispatcher(self):
+        state = self.fake.projects['fake-project-2']
+        self.assertTrue(any('/forwardingRules/' in ''.join(item.get('users', []))
+                            for scoped in state['addresses'].values() for item in scoped.values()))
+        service = self.service_factory()
+        addresses = main.get_addresses(service, 'fake-project-2')
+        # Make call on a discovery-built client, one delete at a time
+        _, failures = main.delete_addresses(service, 'fake-project-2', addresses)
+        # Assertion (every address released, forwarding rules included)
+        self.assertEqual(failures, [])
+        self.assertEqual(self.fake.external_addresses('fake-project-2'), 0)
+
+    def test_event_remediates_one_resource(self):
+        state = self.fake.projects['fake-project-1']
+        scope, item = next((scope, item) for scope, scoped in state['addresses'].items() for item in scoped.values()
+                           if '/instances/' in ''.join(item.get('users', [])))
+        zone, _, name = item['users'][0].split('/')[-3:]
+        before = self.fake.external_addresses()
+        with mock.patch.object(main, 'build_compute_service', side_effect=lambda credentials=None:
+                               self.service_factory()):
+            result = main.enforce_event(self.service_factory(), {'project': 'fake-project-1', 'kind': 'instances',
+                                                                 'location': zone, 'name': name})
+        # Assertion (only the instance's address went, found by listing its region alone)
+        self.assertEqual(len(result['response']), 1)
+        self.assertEqual(self.fake.external_addresses(), before - 1)
+        self.assertNotIn(item['name'], state['addresses'][scope])
+        self.assertEqual(self.fake.stats['addresses.aggregatedList'], 0)
+        self.assertEqual(self.fake.stats['addresses.list'], 1)
+
+    def test_event_for_deleted_address(self):
+        result = main.enforce_event(self.service_factory(), {'project': 'fake-project-1', 'kind': 'addresses',
+                                                             'location': 'europe-west1', 'name': 'gone'})
+        # Assertion (nothing to do once the address no longer exists)
+        self.assertIsNone(result['response'])
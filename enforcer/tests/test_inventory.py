@@ -0,0 +1,86 @@
+# Standard Library Imports
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Third Party Imports
+import mock
+
+# Local Imports
+from inventory import INVENTORY_TTL, ProjectInventory, subfolders
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'inventory.json')
+        # Folder 1 holds folders 2 and 3, folder 3 holds folder 4
+        self.tree = {'1': ['2', '3'], '2': [], '3': ['4'], '4': []}
+        self.projects = {'1': ['project-a'], '2': ['project-b', 'project-c'], '3': [], '4': ['project-d']}
+        self.listed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def list_projects(self, folder):
+        self.listed.append(folder)
+        return iter(self.projects[folder])
+
+    def inventory(self, **kwargs):
+        return ProjectInventory(self.path, self.list_projects, lambda folder: iter(self.tree[folder]), **kwargs)
+
+    def test_walks_subfolders(self):
+        # Assertion (projects from every nested folder, each once)
+        self.assertEqual(sorted(self.inventory().projects('1')), ['project-a', 'project-b', 'project-c', 'project-d'])
+        self.assertEqual(sorted(self.listed), ['1', '2', '3', '4'])
+
+    def test_cached_folders_are_not_listed(self):
+        list(self.inventory().projects('1'))
+        self.listed = []
+        # Assertion (a new process reads every folder from the cache)
+        self.assertEqual(sorted(self.inventory().projects('1')), ['project-a', 'project-b', 'project-c', 'project-d'])
+        self.assertEqual(self.listed, [])
+        # Assertion (expired folders are listed again, picking up new projects)
+        self.projects['4'].append('project-e')
+        with mock.patch('inventory.time.time', return_value=time.time() + 2 * INVENTORY_TTL):
+            self.assertIn('project-e', list(self.inventory().projects('1')))
+        self.assertEqual(sorted(self.listed), ['1', '2', '3', '4'])
+
+    def test_failed_folder_uses_expired_copy(self):
+        list(self.inventory().projects('1'))
+        self.projects['2'] = None
+        # Assertion (folder 2 cannot be listed, its last listing stands in)
+        with mock.patch('inventory.time.time', return_value=time.time() + 2 * INVENTORY_TTL):
+            self.assertIn('project-b', list(self.inventory().projects('1')))
+        os.remove(self.path)
+        self.assertRaises(TypeError, list, self.inventory().projects('1'))
+
+    def test_streams_projects(self):
+        release = threading.Event()
+        listed = {'1': ['project-a'], '2': ['project-b']}
+
+        def list_projects(folder):
+            if folder == '2':
+                release.wait(5)
+            return iter(listed[folder])
+
+        projects = ProjectInventory(self.path, list_projects, lambda folder: iter(['2'] if folder == '1' else []))
+        stream = projects.projects('1')
+        # Assertion (the root's project arrives while folder 2 is still listing)
+        self.assertEqual(next(stream), 'project-a')
+        release.set()
+        self.assertEqual(list(stream), ['project-b'])
+
+    def test_subfolders(self):
+        mock_service = mock.MagicMock()
+        mock_folders = mock_service.folders.return_value
+        mock_folders.list.return_value.execute.return_value = {'folders': [{'name': 'folders/2'},
+                                                                           {'name': 'folders/3'}]}
+        mock_folders.list_next.return_value = None
+        # Assertion
+        self.assertEqual(list(subfolders(mock_service, '1')), ['2', '3'])
+        mock_folders.list.assert_called_once_with(parent='folders/1')
@@ -1,15 +1,27 @@
 # Standard Library Imports
+import os
 import json
+import shutil
+import tempfile
+import threading
 import unittest
 import mock
 
 # Third party imports
 from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from httplib2 import Response
 from google.cloud import storage, resource_manager
 
 # Local Imports
 import main
-from main import get_addresses, delete_addresses, exclusions_from_bucket, project_ids_list
+from main import get_addresses, delete_addresses, exclusions_from_bucket, project_ids_list, \
+    get_thread_service, scan_projects, plan_remediation
+from batching import BatchDispatcher
+from daemon import SweepLock
+from operations import OperationTracker
+from state import StateStore
+from fakes import batching_service, FakeBlob, FakeStorageClient
 
 
 class EnforcerTest(unittest.TestCase):
@@ -18,20 +30,29 @@ class EnforcerTest(unittest.TestCase):
         # Mock Project ID
         self.project = "python-test-case"
 
+    @mock.patch.object(main, 'function_project_id')
     @mock.patch.object(storage, 'Client')
-    def test_exclusions_from_bucket(self, mock_client):
-        with open('tests/fixtures/exclusions.jsonl') as file:
+    def test_exclusions_from_bucket(self, mock_client, mock_function_project_id):
+        # Local stand-in for the data files bucket
+        with open('tests/fixtures/exclusions.jsonl', 'rb') as file:
             exclusions = file.read()
-        mock_client.return_value.bucket.return_value.get_blob.return_value.download_as_string.return_value = exclusions
-        mock_client = mock.MagicMock()
-        response = exclusions_from_bucket()
+        mock_function_project_id.return_value = self.project
+        client = FakeStorageClient()
+        client.bucket(self.project + '-data-files').blobs['exclusion.jsonl'] = FakeBlob('exclusion.jsonl', exclusions)
+        mock_client.return_value = client
+        # Cache the file in a temporary state directory
+        state_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'IP_ENFORCER_STATE_DIR': state_dir}):
+            response = exclusions_from_bucket()
+        shutil.rmtree(state_dir)
         self.assertEqual(response[0], '123456')
         self.assertEqual(response[1], '654321')
         self.assertEqual(response[2], 'xpn')
 
+    @mock.patch.object(main, 'get_thread_folders_service')
     @mock.patch.object(resource_manager, 'Client')
     @mock.patch.object(main, 'exclusions_from_bucket')
-    def test_project_ids_list(self, mock_exclusions_from_bucket, mock_client):
+    def test_project_ids_list(self, mock_exclusions_from_bucket, mock_client, mock_folders_service):
         # Import Project class from Google Cloud Resource Manager
         from google.cloud.resource_manager.project import Project
         # Create dummy client object to use in mock projects
@@ -52,10 +73,19 @@ class EnforcerTest(unittest.TestCase):
         projects_list = [mock_project_a, mock_project_b]
         # Mock client.list_projects()
         mock_client.return_value.list_projects.return_value = projects_list
-        mock_client = mock.MagicMock()
+        # Mock folders().list() with no subfolders
+        mock_folders = mock_folders_service.return_value.folders.return_value
+        mock_folders.list.return_value.execute.return_value = {}
+        mock_folders.list_next.return_value = None
         # Execute function and store the output in a variable
         folder_id = "987654321"
-        result = project_ids_list(folder_id)
+        state_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'IP_ENFORCER_STATE_DIR': state_dir}):
+            result = list(project_ids_list(folder_id))
+        shutil.rmtree(state_dir)
+        # Assertion (the folder filter is applied by the API)
+        mock_client.return_value.list_projects.assert_called_once_with(
+            {'parent.type': 'folder', 'parent.id': folder_id, 'lifecycleState': 'ACTIVE'})
         # Assert first return value is 'python-test-case'
         self.assertEqual(result[0], 'python-test-case')
         # Assert length is only one project (one gets excluded)
@@ -79,10 +109,29 @@ class EnforcerTest(unittest.TestCase):
         mock_get_error = mock.MagicMock()
         mock_error = SystemError()
         # Mock aggregatedList Error
-        mock_get_error.aggregatedList.return_value.execute.return_value = mock_error
+        mock_get_error.aggregatedList.return_value.execute.side_effect = mock_error
         mock_service.addresses = mock.MagicMock(return_value=mock_get_error)
-        # Assertion
-        self.assertRaises(SystemError, get_addresses(mock_service, self.project))
+        # Assertion (a failed page fails the listing instead of returning part of it)
+        self.assertRaises(SystemError, get_addresses, mock_service, self.project)
+
+    def test_iter_addresses(self):
+        # Two pages, the second continuing a scope from the first
+        mock_service = mock.MagicMock()
+        mock_addresses = mock_service.addresses.return_value
+        first_page = {'items': {'regions/europe-west1': {'addresses': [{'name': 'ip1'}]}}, 'nextPageToken': 'next'}
+        second_page = {'items': {'regions/europe-west1': {'addresses': [{'name': 'ip2'}]}}}
+        mock_addresses.aggregatedList.return_value.execute.return_value = first_page
+        mock_addresses.aggregatedList_next.return_value.execute.return_value = second_page
+        mock_addresses.aggregatedList_next.side_effect = [mock_addresses.aggregatedList_next.return_value, None]
+        # Assertion (addresses yielded page by page, then grouped by scope)
+        self.assertEqual([item['name'] for _, item in main.iter_addresses(mock_service, self.project)],
+                         ['ip1', 'ip2'])
+        mock_addresses.aggregatedList_next.side_effect = [mock_addresses.aggregatedList_next.return_value, None]
+        self.assertEqual(len(get_addresses(mock_service, self.project)['regions/europe-west1']['addresses']), 2)
+        # Assertion (external addresses filtered and fields masked by the API)
+        mock_addresses.aggregatedList.assert_called_with(
+            project=self.project, filter='addressType = EXTERNAL',
+            fields='items/*/addresses(name,address,status,region,users,addressType),nextPageToken')
 
     @mock.patch.object(discovery, 'build')
     def test_delete_regional_reserved_address(self, mock_service):
@@ -97,9 +146,10 @@ class EnforcerTest(unittest.TestCase):
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.addresses.return_value.delete.return_value.execute.return_value = delete_ip
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
 
     @mock.patch.object(discovery, 'build')
     def test_delete_global_reserved_address(self, mock_service):
@@ -114,9 +164,10 @@ class EnforcerTest(unittest.TestCase):
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.globalAddresses.return_value.delete.return_value.execute.return_value = delete_ip
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
 
     @mock.patch.object(discovery, 'build')
     def test_delete_global_inuse_forwarding_rule_address(self, mock_service):
@@ -127,16 +178,17 @@ class EnforcerTest(unittest.TestCase):
             gce_operation = json.load(json_file)
         # Map imported JSON payload to service.globalForwardingRules().delete() return value
         mock_service.globalForwardingRules.return_value.delete.return_value.execute.return_value = gce_operation
-        mock_service.globalOperations.return_value.get.return_value.execute.return_value = gce_operation
+        mock_service.globalOperations.return_value.wait.return_value.execute.return_value = gce_operation
         # Import get-addresses response JSON data
         with open('tests/fixtures/address-inuse-global.json') as json_file:
             address = json.load(json_file)
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.globalAddresses.return_value.delete.return_value.execute.return_value = gce_operation
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
 
     @mock.patch.object(discovery, 'build')
     def test_delete_regional_inuse_forwarding_rule_address(self, mock_service):
@@ -147,16 +199,17 @@ class EnforcerTest(unittest.TestCase):
             gce_operation = json.load(json_file)
         # Map imported JSON payload to service.globalForwardingRules().delete() return value
         mock_service.forwardingRules.return_value.delete.return_value.execute.return_value = gce_operation
-        mock_service.regionOperations.return_value.get.return_value.execute.return_value = gce_operation
+        mock_service.regionOperations.return_value.wait.return_value.execute.return_value = gce_operation
         # Import get-addresses response JSON data
         with open('tests/fixtures/address-inuse-regional-forwarding-rule.json') as json_file:
             address = json.load(json_file)
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.addresses.return_value.delete.return_value.execute.return_value = gce_operation
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
 
     @mock.patch.object(discovery, 'build')
     def test_delete_regional_inuse_instance_address(self, mock_service):
@@ -167,16 +220,17 @@ class EnforcerTest(unittest.TestCase):
             gce_operation = json.load(json_file)
         # Map imported JSON payload to service.globalForwardingRules().delete() return value
         mock_service.instances.return_value.delete.return_value.execute.return_value = gce_operation
-        mock_service.zoneOperations.return_value.get.return_value.execute.return_value = gce_operation
+        mock_service.zoneOperations.return_value.wait.return_value.execute.return_value = gce_operation
         # Import get-addresses response JSON data
         with open('tests/fixtures/address-inuse-regional-instance.json') as json_file:
             address = json.load(json_file)
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.addresses.return_value.delete.return_value.execute.return_value = gce_operation
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
 
     @mock.patch.object(discovery, 'build')
     def test_delete_regional_inuse_router_address(self, mock_service):
@@ -187,13 +241,299 @@ class EnforcerTest(unittest.TestCase):
             gce_operation = json.load(json_file)
         # Map imported JSON payload to service.routers().delete() return value
         mock_service.routers.return_value.delete.return_value.execute.return_value = gce_operation
-        mock_service.regionOperations.return_value.get.return_value.execute.return_value = gce_operation
+        mock_service.regionOperations.return_value.wait.return_value.execute.return_value = gce_operation
         # Import get-addresses response JSON data
         with open('tests/fixtures/address-inuse-regional-router.json') as json_file:
             address = json.load(json_file)
         # Map imported JSON payload to service.addresses().delete() return value
         mock_service.addresses.return_value.delete.return_value.execute.return_value = gce_operation
         # Make call with mocked return values
-        response = delete_addresses(mock_service, self.project, address)
+        response, failures = delete_addresses(mock_service, self.project, address)
         # Assertion (to test delete
-        self.assertEquals(response['operationType'], 'delete')
+        self.assertEquals(response[0]['operationType'], 'delete')
+        self.assertEqual(failures, [])
+
+    @mock.patch.object(discovery, 'build')
+    def test_get_thread_service(self, mock_build):
+        # Each thread builds its own client and reuses it on later calls
+        mock_build.side_effect = lambda *args, **kwargs: mock.MagicMock()
+        results = [None, None]
+
+        def worker(index):
+            results[index] = (get_thread_service(), get_thread_service())
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Assertion (one build per thread, same client within a thread)
+        self.assertEqual(mock_build.call_count, 2)
+        for first, second in results:
+            self.assertIs(first, second)
+        self.assertIsNot(results[0][0], results[1][0])
+
+    @mock.patch.object(main, 'delete_addresses')
+    @mock.patch.object(main, 'get_addresses')
+    @mock.patch.object(discovery, 'build')
+    def test_scan_projects(self, mock_build, mock_get_addresses, mock_delete_addresses):
+        # Import get-addresses response JSON data
+        with open('tests/fixtures/address-reserved-regional.json') as json_file:
+            address = json.load(json_file)
+        # One project with a violation, one clean, one that fails to list
+        listings = {"project-a": address, "project-b": {}, "project-c": SystemError("listing failed")}
+
+        def get_addresses(service, project):
+            if isinstance(listings[project], Exception):
+                raise listings[project]
+            return listings[project]
+
+        mock_get_addresses.side_effect = get_addresses
+        mock_delete_addresses.return_value = ([{'operationType': 'delete'}], [])
+        # Make call with mocked return values
+        summary = scan_projects(["project-a", "project-b", "project-c"], workers=3)
+        # Assertion (per project results merged into one summary)
+        self.assertEqual(summary['projects'], 3)
+        self.assertEqual(summary['remediated'], ["project-a"])
+        self.assertEqual(summary['clean'], ["project-b"])
+        self.assertEqual(list(summary['errors']), ["project-c"])
+        mock_delete_addresses.assert_called_once_with(mock.ANY, "project-a", address, service_factory=mock.ANY,
+                                                      tracker=mock.ANY, dispatcher=mock.ANY)
+
+    @mock.patch.object(main, 'get_addresses')
+    @mock.patch.object(discovery, 'build')
+    def test_scan_projects_delete_failures(self, mock_build, mock_get_addresses):
+        # Import get-addresses response JSON data
+        with open('tests/fixtures/address-reserved-regional.json') as json_file:
+            mock_get_addresses.return_value = json.load(json_file)
+        # Mock Discovery API, every address delete refused
+        mock_service = batching_service()
+        forbidden = HttpError(Response({'status': 403}), json.dumps(
+            {'error': {'code': 403, 'errors': [{'reason': 'forbidden'}]}}).encode('utf-8'))
+        mock_service.addresses.return_value.delete.return_value.execute.side_effect = forbidden
+        # Make call with mocked return values
+        with mock.patch.object(main, 'build_compute_service', return_value=mock_service):
+            summary = scan_projects(["project-a"], workers=1)
+        # Assertion (the project is reported as failed, not clean)
+        self.assertEqual(summary['clean'], [])
+        self.assertEqual(summary['remediated'], [])
+        self.assertIn('Could not delete 1 resource(s) in project-a', summary['errors']["project-a"])
+
+    def test_plan_remediation(self):
+        # Import service.addresses().aggregatedList() response JSON data
+        with open('tests/fixtures/gce.addresses.aggregatedList.json') as json_file:
+            addresses = json.load(json_file)['items']
+        # Make call with fixture data
+        plan = plan_remediation(self.project, addresses)
+        # Assertion (one chain per address, resources deleted before the address)
+        self.assertEqual(len(plan), 4)
+        kinds = sorted([action['kind'] for action in chain] for chain in plan)
+        self.assertEqual(kinds, [['addresses'], ['globalAddresses'],
+                                 ['globalForwardingRules', 'globalAddresses'], ['routers', 'addresses']])
+
+    def test_plan_remediation_shared_resource(self):
+        # Import get-addresses response JSON data
+        with open('tests/fixtures/address-inuse-regional-router.json') as json_file:
+            addresses = json.load(json_file)
+        # Add a second NAT address on the same router
+        second = dict(addresses['regions/europe-west1']['addresses'][0], name='nat-auto-ip-2', address='1.2.3.4')
+        addresses['regions/europe-west1']['addresses'].append(second)
+        # Make call with fixture data
+        plan = plan_remediation(self.project, addresses)
+        # Assertion (router deleted once, both addresses after it in one chain)
+        self.assertEqual(len(plan), 1)
+        self.assertEqual([action['kind'] for action in plan[0]], ['routers', 'addresses', 'addresses'])
+
+    def test_plan_remediation_every_user(self):
+        # Import get-addresses response JSON data
+        with open('tests/fixtures/address-inuse-regional-forwarding-rule.json') as json_file:
+            addresses = json.load(json_file)
+        # One address behind two forwarding rules
+        item = addresses['regions/europe-west1']['addresses'][0]
+        item['users'].append(item['users'][0].replace('load-balancer', 'load-balancer-udp'))
+        # Make call with fixture data
+        plan = plan_remediation(self.project, addresses)
+        # Assertion (both forwarding rules deleted before the address)
+        self.assertEqual([(action['kind'], action['name']) for action in plan[0]],
+                         [('forwardingRules', 'load-balancer'), ('forwardingRules', 'load-balancer-udp'),
+                          ('addresses', item['name'])])
+
+    @mock.patch.object(discovery, 'build')
+    def test_delete_all_addresses(self, mock_service):
+        # Mock Discovery API
+        mock_service = mock.MagicMock()
+        # Import operation response JSON data
+        with open('tests/fixtures/gce.operation.response.json') as json_file:
+            gce_operation = json.load(json_file)
+        # Every delete and operation poll returns a finished operation
+        for resource in ('addresses', 'globalAddresses', 'globalForwardingRules', 'routers'):
+            getattr(mock_service, resource).return_value.delete.return_value.execute.return_value = gce_operation
+        mock_service.globalOperations.return_value.wait.return_value.execute.return_value = gce_operation
+        mock_service.regionOperations.return_value.wait.return_value.execute.return_value = gce_operation
+        # Import service.addresses().aggregatedList() response JSON data
+        with open('tests/fixtures/gce.addresses.aggregatedList.json') as json_file:
+            addresses = json.load(json_file)['items']
+        # Make call with mocked return values, running chains concurrently
+        response, failures = delete_addresses(mock_service, self.project, addresses,
+                                              service_factory=lambda: mock_service)
+        # Assertion (every external address deleted in a single run)
+        self.assertEqual(len(response), 4)
+        self.assertEqual(failures, [])
+        mock_service.routers.return_value.delete.assert_called_once_with(
+            project=self.project, region='europe-west1', router='python-test')
+
+    def test_delete_all_addresses_batched(self):
+        # Mock Discovery API with fake batch support
+        mock_service = batching_service()
+        # Import operation response JSON data
+        with open('tests/fixtures/gce.operation.response.json') as json_file:
+            gce_operation = json.load(json_file)
+        # Every delete and operation poll returns a finished operation
+        for resource in ('addresses', 'globalAddresses', 'globalForwardingRules', 'routers'):
+            getattr(mock_service, resource).return_value.delete.return_value.execute.return_value = gce_operation
+        mock_service.globalOperations.return_value.get.return_value.execute.return_value = gce_operation
+        mock_service.regionOperations.return_value.get.return_value.execute.return_value = gce_operation
+        # Import service.addresses().aggregatedList() response JSON data
+        with open('tests/fixtures/gce.addresses.aggregatedList.json') as json_file:
+            addresses = json.load(json_file)['items']
+        # Make call through a dispatcher and tracker
+        with OperationTracker(lambda: mock_service) as tracker, \
+                BatchDispatcher(lambda: mock_service, window=0.5) as dispatcher:
+            response, failures = delete_addresses(mock_service, self.project, addresses, tracker=tracker,
+                                                  dispatcher=dispatcher)
+        # Assertion (all four chains started in one batch, every address deleted)
+        self.assertEqual(len(response), 4)
+        self.assertEqual(failures, [])
+        self.assertEqual(mock_service.batch_calls[0], 4)
+
+    def test_delete_addresses_batched_callback_errors(self):
+        # Mock Discovery API with fake batch support
+        mock_service = batching_service()
+        with open('tests/fixtures/gce.operation.response.json') as json_file:
+            gce_operation = json.load(json_file)
+        # The router delete comes back without an operation name
+        mock_service.routers.return_value.delete.return_value.execute.return_value = {}
+        mock_service.globalForwardingRules.return_value.delete.return_value.execute.return_value = gce_operation
+        with open('tests/fixtures/gce.addresses.aggregatedList.json') as json_file:
+            addresses = json.load(json_file)['items']
+        # The tracker is closed, so tracking the forwarding rule delete raises
+        tracker = OperationTracker(lambda: mock_service)
+        tracker.close()
+        results = []
+        with BatchDispatcher(lambda: mock_service, window=0.1) as dispatcher:
+            thread = threading.Thread(target=lambda: results.append(
+                delete_addresses(mock_service, self.project, addresses, tracker=tracker, dispatcher=dispatcher)))
+            thread.daemon = True
+            thread.start()
+            thread.join(10)
+        # Assertion (the call returns, with both chains reported as failed)
+        self.assertFalse(thread.is_alive())
+        _, failures = results[0]
+        self.assertEqual(sorted(failure.split(' ')[0] for failure in failures),
+                         ['globalForwardingRules', 'routers'])
+
+    @mock.patch.object(main, 'delete_addresses')
+    @mock.patch.object(main, 'get_addresses')
+    def test_enforce_project_incremental(self, mock_get_addresses, mock_delete_addresses):
+        # Import get-addresses response JSON data
+        with open('tests/fixtures/address-reserved-regional.json') as json_file:
+            address = json.load(json_file)
+        mock_get_addresses.return_value = address
+        mock_delete_addresses.return_value = ([], [])
+        state_dir = tempfile.mkdtemp()
+        with StateStore(state_dir + '/state.db') as store:
+            # First run remediates the new address
+            first = main.enforce_project(mock.MagicMock(), self.project, store=store)
+            # Second run sees the same address again within the retry interval
+            second = main.enforce_project(mock.MagicMock(), self.project, store=store)
+        shutil.rmtree(state_dir)
+        # Assertion (only the first run plans deletes, the second takes the fast path)
+        self.assertEqual(first['delta']['new'], 1)
+        self.assertFalse(first['unchanged'])
+        self.assertTrue(second['unchanged'])
+        self.assertEqual(second['delta']['unchanged'], 1)
+        self.assertEqual(mock_delete_addresses.call_count, 1)
+
+    @mock.patch.object(main, 'enforce_project')
+    @mock.patch.object(main, 'resolve_projects')
+    @mock.patch.object(discovery, 'build')
+    def test_run_sweep_resumes_checkpoint(self, mock_build, mock_resolve_projects, mock_enforce_project):
+        mock_resolve_projects.return_value = ["project-a", "project-b", "project-c"]
+        mock_enforce_project.side_effect = lambda service, project, *args: {
+            'project': project, 'response': None, 'error': None, 'unchanged': False, 'delta': None}
+        state_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'IP_ENFORCER_STATE_DIR': state_dir}), \
+                StateStore(state_dir + '/state.db') as store:
+            # Sweep killed after enforcing project-a
+            interrupted = store.begin_sweep(3600)
+            store.finish_project(interrupted['id'], "project-a")
+            # Make call, then again while another process holds the sweep lock
+            summary = main.run_sweep(store, workers=2)
+            lock = SweepLock(os.path.join(state_dir, 'sweep.lock'))
+            lock.acquire()
+            overlapping = main.run_sweep(store, workers=2)
+            lock.release()
+            after = store.begin_sweep(3600)
+            # Next sweep, killed after project-b came back with an error and project-c raised
+            def enforce_project(service, project, *args):
+                if project == "project-c":
+                    raise SystemError("scan failed")
+                error = 'Unable to list addresses in project-b' if project == "project-b" else None
+                return {'project': project, 'response': None, 'error': error, 'unchanged': False, 'delta': None}
+
+            mock_enforce_project.side_effect = enforce_project
+            scan_projects(["project-a", "project-b", "project-c"], workers=2, store=store, sweep=after['id'])
+            resumed = store.begin_sweep(3600)
+        shutil.rmtree(state_dir)
+        # Assertion (only the projects left are enforced, and the sweep is finished)
+        self.assertEqual(sorted(call[0][1] for call in mock_enforce_project.call_args_list[:2]),
+                         ["project-b", "project-c"])
+        self.assertEqual(summary['resumed'], 1)
+        self.assertNotEqual(after['id'], interrupted['id'])
+        # Assertion (no sweep while the lock is held)
+        self.assertIsNone(overlapping)
+        # Assertion (projects that failed are not checkpointed, so the resumed sweep enforces them again)
+        self.assertEqual(resumed['id'], after['id'])
+        self.assertEqual(resumed['done'], frozenset(["project-a"]))
+
+    @mock.patch.object(main, '__MAX_STALENESS', 3600)
+    @mock.patch.object(main, 'enforce_project')
+    @mock.patch.object(main, 'resolve_projects')
+    @mock.patch.object(discovery, 'build')
+    def test_run_sweep_defers_cold_projects(self, mock_build, mock_resolve_projects, mock_enforce_project):
+        mock_resolve_projects.return_value = ["hot-project", "cold-project"]
+        mock_enforce_project.side_effect = lambda service, project, *args: {
+            'project': project, 'response': [{}] if project == "hot-project" else None, 'error': None,
+            'unchanged': False, 'delta': {'new': 1 if project == "hot-project" else 0}}
+        state_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'IP_ENFORCER_STATE_DIR': state_dir}), \
+                StateStore(state_dir + '/state.db') as store:
+            # First sweep scans both, the hot project, with two violations already, finding another
+            store.record_score("hot-project", 2.0, 0.0)
+            first = main.run_sweep(store, workers=2)
+            for project in mock_resolve_projects.return_value:
+                store.record(project, 'fingerprint', {}, 'clean', 300)
+            # Second sweep straight after
+            second = main.run_sweep(store, workers=2)
+        shutil.rmtree(state_dir)
+        # Assertion (only the hot project is scanned again, the cold one waits for the staleness bound)
+        self.assertEqual(first['projects'], 2)
+        self.assertEqual(second['projects'], 1)
+        self.assertEqual(second['remediated'], ["hot-project"])
+        self.assertEqual(second['deferred'], 1)
+
+    @mock.patch.object(main, 'function_project_id')
+    def test_build_shard(self, mock_project_id):
+        mock_project_id.return_value = 'gcp-core-team'
+        storage_client = FakeStorageClient()
+        # Make call with shard arguments
+        shard = main.build_shard(main.parse_args(['--shard-index', '1', '--shard-count', '3']), storage_client)
+        # Assertion (named members, lease taken in the data files bucket on assignment)
+        self.assertEqual((shard.member, shard.members), ('shard-1', ['shard-0', 'shard-1', 'shard-2']))
+        shard.assign(['project-a'])
+        self.assertIn('leases/shard-1', storage_client.bucket('gcp-core-team-data-files').blobs)
+        # Assertion (unsharded without shard arguments, inconsistent ones rejected)
+        self.assertIsNone(main.build_shard(main.parse_args([])))
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, main.parse_args, ['--shard-index', '3', '--shard-count', '3'])
+            self.assertRaises(SystemExit, main.parse_args, ['--shard-index', '0'])
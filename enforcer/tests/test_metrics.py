@@ -0,0 +1,104 @@
+# Standard Library Imports
+import os
+import json
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Third Party Imports
+import mock
+
+# Local Imports
+import main
+from metrics import Metrics, SweepProfiler, default_registry, delta
+from ratelimit import RateLimiter, execute_request
+from test_ratelimit import http_error
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.metrics.describe('api_requests', 'counter', 'API calls made.')
+        self.metrics.describe('api_request_duration_seconds', 'histogram', 'API call latency.', (0.1, 1.0))
+        self.metrics.describe('sweep_duration_seconds', 'gauge', 'Duration of the last sweep.')
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_openmetrics(self):
+        self.metrics.inc('api_requests', method='compute.addresses.delete', code='200')
+        self.metrics.observe('api_request_duration_seconds', 0.05, method='compute.addresses.delete')
+        self.metrics.observe('api_request_duration_seconds', 0.5, method='compute.addresses.delete')
+        self.metrics.set('sweep_duration_seconds', 12.5)
+        text = self.metrics.openmetrics()
+        # Assertion (counter samples end in _total, histogram buckets are cumulative, the text ends with EOF)
+        self.assertIn('ip_enforcer_api_requests_total{code="200",method="compute.addresses.delete"} 1', text)
+        self.assertIn('ip_enforcer_api_request_duration_seconds_bucket{method="compute.addresses.delete",le="1.0"} 2',
+                      text)
+        self.assertIn('ip_enforcer_api_request_duration_seconds_count{method="compute.addresses.delete"} 2', text)
+        self.assertIn('ip_enforcer_sweep_duration_seconds 12.5', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_delta(self):
+        self.metrics.inc('api_requests', 3, method='m', code='200')
+        self.metrics.observe('api_request_duration_seconds', 0.5, method='m')
+        before = self.metrics.snapshot()
+        self.metrics.inc('api_requests', 2, method='m', code='200')
+        self.metrics.observe('api_request_duration_seconds', 2.0, method='m')
+        self.metrics.set('sweep_duration_seconds', 4.0)
+        run = delta(self.metrics.snapshot(), before)
+        # Assertion (only what was added since the snapshot)
+        self.assertEqual(run['api_requests']['samples']['code=200,method=m'], 2)
+        self.assertEqual(run['api_request_duration_seconds']['samples']['method=m']['buckets'],
+                         {'0.1': 0, '1.0': 0, '+Inf': 1})
+        self.assertEqual(run['sweep_duration_seconds']['samples'][''], 4.0)
+
+    @mock.patch('ratelimit.time.sleep')
+    def test_execute_request_recorded(self, mock_sleep):
+        request = mock.MagicMock(uri=None, methodId='compute.addresses.delete')
+        request.execute.side_effect = [http_error(503), {'ok': True}]
+        before = default_registry().snapshot()
+        execute_request(request, limiter=RateLimiter())
+        run = delta(default_registry().snapshot(), before)
+        # Assertion (both attempts counted with their status, one retry)
+        self.assertEqual(run['api_requests']['samples']['code=503,method=compute.addresses.delete'], 1)
+        self.assertEqual(run['api_requests']['samples']['code=200,method=compute.addresses.delete'], 1)
+        self.assertEqual(run['api_retries']['samples']['method=compute.addresses.delete,reason=transient'], 1)
+        self.assertEqual(run['api_request_duration_seconds']['samples']['method=compute.addresses.delete']['count'], 2)
+
+    def test_profiler_merges_threads(self):
+        path = os.path.join(self.directory, 'sweep.pstats')
+        profiler = SweepProfiler(path)
+
+        def work():
+            return sum(range(1000))
+
+        thread = threading.Thread(target=profiler.wrap(work))
+        thread.start()
+        thread.join()
+        profiler.wrap(work)()
+        profiler.dump()
+        # Assertion (both threads' calls in one stats file)
+        calls = [stat[1] for func, stat in pstats.Stats(path).stats.items() if func[2] == 'work']
+        self.assertEqual(calls, [2])
+
+    @mock.patch.object(main, 'scan_projects')
+    @mock.patch.object(main, 'resolve_projects')
+    def test_run_sweep_writes_metrics(self, mock_resolve_projects, mock_scan_projects):
+        mock_resolve_projects.return_value = ['project-a']
+        mock_scan_projects.return_value = {'projects': 1, 'remediated': ['project-a'], 'clean': [], 'unchanged': [],
+                                           'errors': {}, 'durations': {'project-a': 1.5},
+                                           'delta': {'new': 1, 'changed': 0, 'removed': 0, 'unchanged': 0}}
+        with mock.patch.dict(os.environ, IP_ENFORCER_STATE_DIR=self.directory):
+            main.run_sweep(None)
+        # Assertion (the textfile and the run summary with its durations and metrics)
+        with open(os.path.join(self.directory, 'ip-enforcer.prom')) as textfile:
+            self.assertIn('ip_enforcer_sweep_projects{outcome="remediated"} 1', textfile.read())
+        with open(os.path.join(self.directory, 'last-run.json')) as summary_file:
+            summary = json.load(summary_file)
+        self.assertEqual(summary['durations'], {'project-a': 1.5})
+        self.assertEqual(summary['metrics']['sweeps']['samples'], {'result=success': 1})
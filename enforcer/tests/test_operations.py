@@ -0,0 +1,101 @@
+# Standard Library Imports
+import json
+import shutil
+import tempfile
+import unittest
+import mock
+
+# Local Imports
+from operations import OperationTracker, OperationError, OperationTimeout, wait_for_operation
+from state import StateStore
+from fakes import batching_service
+
+
+class OperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        # Mock Project ID
+        self.project = "python-test-case"
+        # Import operation response JSON data
+        with open('tests/fixtures/gce.operation.response.json') as json_file:
+            self.done = json.load(json_file)
+        self.running = dict(self.done, status='RUNNING')
+
+    def test_wait_for_operation_uses_blocking_wait(self):
+        # Mock Discovery API
+        mock_service = mock.MagicMock()
+        mock_service.zoneOperations.return_value.wait.return_value.execute.side_effect = [self.running, self.done]
+        # Make call with mocked return values
+        result = wait_for_operation(mock_service, self.project, 'operation-1', zone='europe-west1-b')
+        # Assertion (operations.wait used, no polling through get)
+        self.assertEqual(result['status'], 'DONE')
+        self.assertEqual(mock_service.zoneOperations.return_value.wait.call_count, 2)
+        mock_service.zoneOperations.return_value.get.assert_not_called()
+
+    def test_wait_for_operation_error(self):
+        # Mock Discovery API
+        mock_service = mock.MagicMock()
+        failed = dict(self.done, error={'errors': [{'code': 'RESOURCE_IN_USE'}]})
+        mock_service.globalOperations.return_value.wait.return_value.execute.return_value = failed
+        # Assertion
+        self.assertRaises(OperationError, wait_for_operation, mock_service, self.project, 'operation-1')
+
+    def test_tracker_resolves_operations(self):
+        # Mock Discovery API, operations finish on their second poll
+        mock_service = batching_service()
+        mock_service.regionOperations.return_value.get.return_value.execute.side_effect = [
+            self.running, self.running, self.done, self.done]
+        # Track two operations in one region
+        with OperationTracker(lambda: mock_service, initial_interval=0.01) as tracker:
+            # Hold the poller back until both are registered, so they fall due together
+            with tracker._condition:
+                first = tracker.track(self.project, 'operation-1', region='europe-west1')
+                second = tracker.track(self.project, 'operation-2', region='europe-west1')
+            # Assertion (registering the same operation shares its future)
+            self.assertIs(tracker.track(self.project, 'operation-1', region='europe-west1'), first)
+            self.assertEqual(first.result(timeout=5)['status'], 'DONE')
+            self.assertEqual(second.result(timeout=5)['status'], 'DONE')
+        self.assertEqual(len(tracker), 0)
+        # Assertion (both operations polled together in each batch)
+        self.assertEqual(mock_service.batch_calls, [2, 2])
+
+    def test_tracker_deadline(self):
+        # Mock Discovery API, operation never finishes
+        mock_service = mock.MagicMock()
+        mock_service.globalOperations.return_value.get.return_value.execute.return_value = self.running
+        # Track with a deadline shorter than the backoff
+        with OperationTracker(lambda: mock_service, deadline=0.05, initial_interval=0.01) as tracker:
+            future = tracker.track(self.project, 'operation-1')
+            # Assertion
+            self.assertRaises(OperationTimeout, future.result, 5)
+
+    def test_tracker_reattaches_journalled_operations(self):
+        # Mock Discovery API
+        mock_service = mock.MagicMock()
+        mock_service.zoneOperations.return_value.get.return_value.execute.return_value = self.done
+        state_dir = tempfile.mkdtemp()
+        with StateStore(state_dir + '/state.db') as store:
+            # Operation left in the journal by a run that was killed
+            store.add_operation(self.project, 'operation-1', zone='europe-west1-b')
+            with OperationTracker(lambda: mock_service, initial_interval=0.01, journal=store) as tracker:
+                reattached = tracker.reattach()
+                # Assertion (polled again, then dropped from the journal once DONE)
+                self.assertEqual(len(reattached), 1)
+                self.assertEqual(reattached[0][1].result(timeout=5)['status'], 'DONE')
+            operations = store.operations()
+        shutil.rmtree(state_dir)
+        self.assertEqual(operations, [])
+
+    def test_tracker_keeps_timed_out_operations_in_journal(self):
+        # Mock Discovery API, operation never finishes
+        mock_service = mock.MagicMock()
+        mock_service.globalOperations.return_value.get.return_value.execute.return_value = self.running
+        state_dir = tempfile.mkdtemp()
+        with StateStore(state_dir + '/state.db') as store:
+            with OperationTracker(lambda: mock_service, deadline=0.05, initial_interval=0.01,
+                                  journal=store) as tracker:
+                self.assertRaises(OperationTimeout, tracker.track(self.project, 'operation-1').result, 5)
+            operations = store.operations()
+        shutil.rmtree(state_dir)
+        # Assertion (still running, so left for the next run to re-attach)
+        self.assertEqual([operation['operation'] for operation in operations], ['operation-1'])
@@ -0,0 +1,83 @@
+# Standard Library Imports
+import json
+import time
+import unittest
+
+# Third Party Imports
+import mock
+from googleapiclient.errors import HttpError
+from httplib2 import Response
+
+# Local Imports
+from batching import BatchDispatcher
+from fakes import batching_service
+from ratelimit import RateLimiter, execute_request, is_rate_limited, request_project, retry_after
+
+
+def http_error(status, reason='backendError', headers=None):
+    response = Response(dict(headers or {}, status=status))
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}}).encode('utf-8')
+    return HttpError(response, content)
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        started = time.time()
+        for _ in range(3):
+            limiter.acquire()
+        # Assertion (one call from the burst, then 20 calls per second)
+        self.assertGreaterEqual(time.time() - started, 0.09)
+
+    def test_project_budget(self):
+        limiter = RateLimiter(rate=1000, project_rate=10, project_burst=1)
+        # Assertion (separate projects do not wait on each other, a second call to one does)
+        self.assertEqual(limiter.acquire('project-a'), 0)
+        self.assertEqual(limiter.acquire('project-b'), 0)
+        self.assertGreater(limiter.acquire('project-a'), 0)
+
+    def test_rate_limit_errors(self):
+        # Assertion (429 and rate limit 403s are retried, permission 403s are not)
+        self.assertTrue(is_rate_limited(http_error(429)))
+        self.assertTrue(is_rate_limited(http_error(403, 'rateLimitExceeded')))
+        self.assertFalse(is_rate_limited(http_error(403, 'forbidden')))
+        self.assertEqual(retry_after(http_error(429, headers={'retry-after': '7'})), 7.0)
+
+    @mock.patch('ratelimit.time.sleep')
+    def test_execute_request_retries(self, mock_sleep):
+        request = mock.MagicMock(uri='https://compute.googleapis.com/compute/v1/projects/project-a/global/addresses')
+        request.execute.side_effect = [http_error(503), http_error(429, headers={'retry-after': '2'}), {'ok': True}]
+        # Assertion (the response once the transient and rate limit errors are retried)
+        self.assertEqual(execute_request(request, limiter=self.limiter), {'ok': True})
+        self.assertEqual(request.execute.call_count, 3)
+        # Assertion (Retry-After held back the project, not just this call)
+        self.assertGreaterEqual(self.limiter._bucket('project-a')._paused_until - time.time(), 1.0)
+        self.assertEqual(request_project(request), 'project-a')
+
+    @mock.patch('ratelimit.time.sleep')
+    def test_execute_request_gives_up(self, mock_sleep):
+        request = mock.MagicMock()
+        request.execute.side_effect = http_error(403, 'forbidden')
+        # Assertion (errors that are not rate limits or transient fail straight away)
+        self.assertRaises(HttpError, execute_request, request, limiter=self.limiter)
+        self.assertEqual(request.execute.call_count, 1)
+
+    @mock.patch('ratelimit.backoff', return_value=0.01)
+    def test_dispatcher_retries_failed_calls(self, mock_backoff):
+        mock_service = batching_service()
+        requests = [mock.MagicMock(uri=None) for _ in range(3)]
+        requests[0].execute.return_value = 'first'
+        requests[1].execute.side_effect = [http_error(503), 'second']
+        requests[2].execute.side_effect = SystemError()
+        with BatchDispatcher(lambda: mock_service, window=0.5) as dispatcher:
+            futures = [dispatcher.submit(lambda service, request=request: request) for request in requests]
+            results = [future.exception(timeout=5) or future.result() for future in futures]
+        # Assertion (only the transient failure is sent again, on its own)
+        self.assertEqual(results[:2], ['first', 'second'])
+        self.assertIsInstance(results[2], SystemError)
+        self.assertEqual(mock_service.batch_calls, [3])
+        self.assertEqual(requests[0].execute.call_count, 1)
@@ -0,0 +1,34 @@
+# Standard Library Imports
+import unittest
+
+# Local Imports
+from scheduling import HALF_LIFE, is_due, scan_interval, score, updated_score
+
+
+class SchedulingTest(unittest.TestCase):
+
+    def test_updated_score(self):
+        # Score recorded a half-life ago, then a scan with a violation and two changed addresses
+        previous = {'violations': 2.0, 'churn': 4.0, 'updated_at': 0}
+        violations, churn = updated_score(previous, True, 2, HALF_LIFE)
+        # Assertion (old counts halved, new findings added)
+        self.assertEqual((violations, churn), (2.0, 4.0))
+        self.assertEqual(updated_score(None, False, 3, 0), (0.0, 3.0))
+
+    def test_scan_interval(self):
+        # Assertion (hot projects every sweep, cold ones at the staleness bound)
+        self.assertEqual(scan_interval(2.0, 3600), 0)
+        self.assertEqual(scan_interval(0.0, 3600), 3600)
+        self.assertEqual(scan_interval(1.0, 3600), 1800)
+
+    def test_is_due(self):
+        hot = {'scanned_at': 990, 'retry_at': None, 'violations': 3.0, 'churn': 0.0, 'updated_at': 990}
+        cold = {'scanned_at': 990, 'retry_at': None, 'violations': None, 'churn': None, 'updated_at': None}
+        # Assertion (hot project scanned again straight away, cold one deferred until the staleness bound)
+        self.assertTrue(is_due(hot, 1000, 3600))
+        self.assertFalse(is_due(cold, 1000, 3600))
+        self.assertTrue(is_due(cold, 990 + 3600, 3600))
+        # Assertion (never scanned, or an address due a retry)
+        self.assertTrue(is_due(None, 1000, 3600))
+        self.assertTrue(is_due(dict(cold, retry_at=1000), 1000, 3600))
+        self.assertEqual(score(cold, 1000), 0.0)
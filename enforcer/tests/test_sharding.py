@@ -0,0 +1,81 @@
+# Standard Library Imports
+import shutil
+import tempfile
+import time
+import unittest
+
+# Third Party Imports
+import mock
+
+# Local Imports
+from fakes import FakeBucket
+from sharding import BucketLeaseStore, FileLeaseStore, HashRing, Shard, read_membership
+
+
+class ShardingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.projects = ['project-{}'.format(index) for index in range(2000)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ring_balances_projects(self):
+        ring = HashRing(['shard-0', 'shard-1', 'shard-2', 'shard-3'])
+        counts = {}
+        for project in self.projects:
+            counts[ring.owner(project)] = counts.get(ring.owner(project), 0) + 1
+        # Assertion (every shard within half again of an even share)
+        self.assertEqual(len(counts), 4)
+        self.assertLess(max(counts.values()), 1.5 * len(self.projects) / 4)
+
+    def test_ring_moves_few_projects(self):
+        before = HashRing(['shard-0', 'shard-1', 'shard-2', 'shard-3'])
+        after = HashRing(['shard-0', 'shard-1', 'shard-2', 'shard-3', 'shard-4'])
+        moved = [project for project in self.projects if before.owner(project) != after.owner(project)]
+        # Assertion (only projects taken by the new shard move, about a fifth)
+        self.assertTrue(all(after.owner(project) == 'shard-4' for project in moved))
+        self.assertLess(len(moved), 0.3 * len(self.projects))
+
+    def test_shards_partition_projects(self):
+        members = ['shard-0', 'shard-1', 'shard-2']
+        leases = FileLeaseStore(self.directory)
+        assigned = [list(Shard(member, members, leases).assign(self.projects)) for member in members]
+        # Assertion (every project swept by exactly one shard)
+        self.assertEqual(sorted(sum(assigned, [])), sorted(self.projects))
+
+    def test_expired_lease_is_taken_over(self):
+        members = ['shard-0', 'shard-1']
+        leases = FileLeaseStore(self.directory)
+        leases.renew('shard-1', time.time() - 1)
+        shard = Shard('shard-0', members, leases)
+        # Assertion (shard-1 stopped renewing, so shard-0 sweeps everything)
+        self.assertEqual(list(shard.assign(self.projects)), self.projects)
+        leases.renew('shard-1', time.time() + 60)
+        self.assertLess(len(list(shard.assign(self.projects))), len(self.projects))
+
+    def test_missing_lease_grace(self):
+        shard = Shard('shard-0', ['shard-0', 'shard-1'], FileLeaseStore(self.directory), lease_ttl=60)
+        # Assertion (a member that has not started yet is live for a lease ttl)
+        self.assertEqual(shard.live_members(), ['shard-0', 'shard-1'])
+        with mock.patch('sharding.time.time', return_value=time.time() + 61):
+            self.assertEqual(shard.live_members(), ['shard-0'])
+
+    def test_bucket_leases(self):
+        bucket = FakeBucket('gcp-core-team-data-files')
+        leases = BucketLeaseStore(bucket)
+        leases.renew('shard-0', 100.0)
+        # Assertion (expiry read back from the object metadata)
+        self.assertEqual(leases.leases(), {'shard-0': 100.0})
+        # Assertion (an unreachable bucket leaves every member live)
+        bucket.unreachable = True
+        self.assertEqual(Shard('shard-0', ['shard-0', 'shard-1'], leases).live_members(), ['shard-0', 'shard-1'])
+
+    def test_read_membership(self):
+        path = self.directory + '/members'
+        with open(path, 'w') as membership_file:
+            membership_file.write('# enforcer nodes\nip-enforcer-a\n\nip-enforcer-b  # standby\n')
+        # Assertion
+        self.assertEqual(read_membership(path), ['ip-enforcer-a', 'ip-enforcer-b'])
+        self.assertRaises(ValueError, Shard, 'ip-enforcer-c', read_membership(path))
@@ -0,0 +1,108 @@
+# Standard Library Imports
+import json
+import shutil
+import tempfile
+import unittest
+
+# Local Imports
+from state import StateStore, address_fingerprints, diff_snapshot, external_addresses, select_due
+
+
+class StateTest(unittest.TestCase):
+
+    def setUp(self):
+        # Mock Project ID
+        self.project = "python-test-case"
+        # Import service.addresses().aggregatedList() response JSON data
+        with open('tests/fixtures/gce.addresses.aggregatedList.json') as json_file:
+            self.addresses = json.load(json_file)['items']
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_diff_snapshot(self):
+        # Snapshot of the fixture, then one address released and one changed
+        previous = dict((key, {'fingerprint': value, 'attempted_at': 0})
+                        for key, value in address_fingerprints(external_addresses(self.addresses)).items())
+        self.addresses['regions/us-central1']['addresses'] = []
+        self.addresses['global']['addresses'][0]['status'] = 'IN_USE'
+        current = address_fingerprints(external_addresses(self.addresses))
+        # Make call with both snapshots
+        delta = diff_snapshot(previous, current)
+        # Assertion
+        self.assertEqual(delta['removed'], ['regions/us-central1/ip1'])
+        self.assertEqual(delta['changed'], ['global/global-ip'])
+        self.assertEqual(len(delta['unchanged']), 2)
+        self.assertEqual(delta['new'], [])
+
+    def test_select_due(self):
+        current = {'global/a': 'fp-a', 'global/b': 'fp-b', 'global/c': 'fp-c'}
+        previous = {'global/a': {'fingerprint': 'fp-a', 'attempted_at': 950},
+                    'global/b': {'fingerprint': 'fp-b', 'attempted_at': 100},
+                    'global/c': {'fingerprint': 'old', 'attempted_at': 950}}
+        # Make call at t=1000 with a 300s retry interval
+        due, snapshot = select_due(previous, current, 1000, 300)
+        # Assertion (recent attempt skipped, stale attempt and change retried)
+        self.assertEqual(sorted(due), ['global/b', 'global/c'])
+        self.assertEqual(snapshot['global/a']['attempted_at'], 950)
+        self.assertEqual(snapshot['global/b']['attempted_at'], 1000)
+
+    def test_state_store(self):
+        # Record a snapshot and read it back from a fresh connection
+        path = self.state_dir + '/state.db'
+        with StateStore(path) as store:
+            store.record(self.project, 'fingerprint', {'global/a': {'fingerprint': 'fp-a', 'attempted_at': 10}},
+                         'failed', 300)
+        with StateStore(path) as store:
+            project = store.project(self.project)
+            addresses = store.addresses(self.project)
+        # Assertion
+        self.assertEqual(project['fingerprint'], 'fingerprint')
+        self.assertEqual(project['retry_at'], 310)
+        self.assertEqual(project['outcome'], 'failed')
+        self.assertEqual(addresses, {'global/a': {'fingerprint': 'fp-a', 'attempted_at': 10}})
+
+    def test_sweep_checkpoint(self):
+        path = self.state_dir + '/state.db'
+        with StateStore(path) as store:
+            # Sweep interrupted after one project
+            first = store.begin_sweep(3600)
+            store.finish_project(first['id'], 'project-a')
+        with StateStore(path) as store:
+            # Next run resumes it, then finishes it
+            resumed = store.begin_sweep(3600)
+            store.finish_sweep(resumed['id'])
+            after = store.begin_sweep(3600)
+            # Interrupted sweep too old to resume
+            stale = store.begin_sweep(0)
+        # Assertion
+        self.assertEqual(resumed['id'], first['id'])
+        self.assertEqual(resumed['done'], frozenset(['project-a']))
+        self.assertNotEqual(after['id'], first['id'])
+        self.assertEqual(after['done'], frozenset())
+        self.assertNotEqual(stale['id'], after['id'])
+
+    def test_operation_journal(self):
+        with StateStore(self.state_dir + '/state.db') as store:
+            store.add_operation(self.project, 'operation-1', zone='europe-west1-b')
+            store.add_operation(self.project, 'operation-2')
+            store.remove_operation(self.project, 'operation-2')
+            operations = store.operations()
+        # Assertion
+        self.assertEqual(len(operations), 1)
+        self.assertEqual((operations[0]['operation'], operations[0]['zone'], operations[0]['region']),
+                         ('operation-1', 'europe-west1-b', None))
+
+    def test_schedule(self):
+        with StateStore(self.state_dir + '/state.db') as store:
+            store.record(self.project, 'fingerprint', {}, 'clean', 300)
+            store.record('other-project', 'fingerprint', {}, 'clean', 300)
+            store.record_score(self.project, 1.5, 2.0)
+            schedule = store.schedule()
+            score = store.score(self.project)
+        # Assertion (scores joined to the last scan, None where never recorded)
+        self.assertEqual((schedule[self.project]['violations'], schedule[self.project]['churn']), (1.5, 2.0))
+        self.assertEqual(score['updated_at'], schedule[self.project]['updated_at'])
+        self.assertIsNone(schedule['other-project']['violations'])
+        self.assertIsNotNone(schedule['other-project']['scanned_at'])